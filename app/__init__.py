@@ -5,10 +5,53 @@ import os
 import mysql.connector
 from mysql.connector import Error
 
+from .async_db import create_async_db
+from .cache import CatalogCache
+from .embeddings import LazyUserEmbeddings
+from .features import NORMALIZATION_VERSION, stored_normalization_version
+from .friends import LazyFriendGraph
+from .likes import LikedTracks
+from .similar_tracks import LazySimilarTracks, default_directory
+from .snapshot import LazySnapshot, DEFAULT_SNAPSHOT_DIR
+from .write_behind import WriteBehindQueue
+
 # load database connection keys/info
 dotenv_path = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(dotenv_path)
 
+DEFAULT_JOURNAL_DIR = str(Path(__file__).resolve().parent.parent / "journal")
+DEFAULT_PROFILE_DIR = str(Path(__file__).resolve().parent.parent / "profiles")
+
+def check_normalization_version(conn):
+    '''
+    Warns if Tracks was loaded under a different feature normalization than this code expects (see app/features.py).
+    '''
+    cursor = conn.cursor()
+    try:
+        stored = stored_normalization_version(cursor)
+    finally:
+        cursor.close()
+    if stored != NORMALIZATION_VERSION:
+        print(f"WARNING: Tracks were loaded with feature normalization version {stored}, the app expects "
+              f"{NORMALIZATION_VERSION}. Similarity results will be off until load_tracks.py is rerun.")
+
+def connect_db(config):
+    '''
+    Opens a new connection to the app's database (the request connection, and the write-behind flusher's own).
+
+    Autocommit, like the async pool: a connection that only reads never ends its transaction, so under REPEATABLE
+    READ it would keep reading the snapshot of its first SELECT and never see what other connections committed.
+    Writes that must be atomic start their own transaction (see write_behind.write_batch).
+    '''
+    return mysql.connector.connect(
+        host=config['DB_HOST'],
+        port=config['DB_PORT'],
+        user=config['DB_USER'],
+        password=config['DB_PASSWORD'],
+        database=config['DB_NAME'],
+        autocommit=True
+    )
+
 def create_app():
     app = Flask(__name__)
     app.secret_key = "dev"  # dev key for now since this isn't some secure production app
@@ -18,20 +61,105 @@ def create_app():
     app.config['DB_USER'] = os.getenv("DB_USER")
     app.config['DB_PASSWORD'] = os.getenv("DB_PASSWORD")
     app.config['DB_NAME'] = os.getenv("DB_NAME")
+    app.config['DB_PORT'] = int(os.getenv("DB_PORT", "3306"))
+
+    # async pool used to run independent page queries concurrently (see app/async_db.py)
+    app.config['DB_ASYNC'] = os.getenv("DB_ASYNC", "1") == "1"
+    app.config['DB_ASYNC_POOL_SIZE'] = int(os.getenv("DB_ASYNC_POOL_SIZE", "8"))
+
+    # catalog cache config
+    app.config['CATALOG_CACHE_MB'] = int(os.getenv("CATALOG_CACHE_MB", "64"))
+    app.config['CATALOG_VERSION_CHECK_SECONDS'] = float(os.getenv("CATALOG_VERSION_CHECK_SECONDS", "30"))
+    app.config['FRIEND_GRAPH_MAX_AGE_SECONDS'] = float(os.getenv("FRIEND_GRAPH_MAX_AGE_SECONDS", "300"))
+    app.config['RECOMMEND_BUDGET_MS'] = float(os.getenv("RECOMMEND_BUDGET_MS", "250"))
+    app.config['SNAPSHOT_DIR'] = os.getenv("SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR)
+    app.config['USER_EMBEDDINGS_MAX_AGE_SECONDS'] = float(os.getenv("USER_EMBEDDINGS_MAX_AGE_SECONDS", "3600"))
+    app.config['HOME_PAGE_SIZE'] = int(os.getenv("HOME_PAGE_SIZE", "50"))
+    app.config['LIKED_SET_MAX_USERS'] = int(os.getenv("LIKED_SET_MAX_USERS", "10000"))
+    app.config['LIKED_SET_MAX_AGE_SECONDS'] = float(os.getenv("LIKED_SET_MAX_AGE_SECONDS", "60"))
+
+    # write-behind queue for likes, comments and friend toggles (see app/write_behind.py)
+    app.config['WRITE_BEHIND'] = os.getenv("WRITE_BEHIND", "1") == "1"
+    app.config['WRITE_BEHIND_DIR'] = os.getenv("WRITE_BEHIND_DIR", DEFAULT_JOURNAL_DIR)
+    app.config['WRITE_BEHIND_FLUSH_MS'] = float(os.getenv("WRITE_BEHIND_FLUSH_MS", "200"))
+    app.config['WRITE_BEHIND_MAX_BATCH'] = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "500"))
+    app.config['WRITE_BEHIND_FSYNC'] = os.getenv("WRITE_BEHIND_FSYNC", "1") == "1"
+
+    # /metrics (see app/metrics.py). a directory is only needed to merge the workers of a pre-forking server
+    app.config['METRICS_DIR'] = os.getenv("METRICS_DIR") or None
+    app.config['METRICS_WRITE_SECONDS'] = float(os.getenv("METRICS_WRITE_SECONDS", "5"))
+
+    # opt-in request profiling (see app/profiling.py). off unless a token or a sample rate is set
+    app.config['PROFILE_TOKEN'] = os.getenv("PROFILE_TOKEN") or None
+    app.config['PROFILE_SAMPLE_RATE'] = int(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    app.config['PROFILE_ENDPOINTS'] = [e.strip() for e in os.getenv(
+        "PROFILE_ENDPOINTS", "main.home,main.track_page,api.dashboard").split(",") if e.strip()]
+    app.config['PROFILE_INTERVAL_MS'] = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+    app.config['PROFILE_DIR'] = os.getenv("PROFILE_DIR", DEFAULT_PROFILE_DIR)
+    app.config['PROFILE_KEEP'] = int(os.getenv("PROFILE_KEEP", "200"))
 
     # connect DB to app
     try:
-        app.db = mysql.connector.connect(
-            host=app.config['DB_HOST'],
-            user=app.config['DB_USER'],
-            password=app.config['DB_PASSWORD'],
-            database=app.config['DB_NAME']
-        )
+        app.db = connect_db(app.config)
         print("Connected to MySQL database successfully.")
     except Error as e:
         print(f"Error connecting to MySQL: {e}")
+    else:
+        try:
+            check_normalization_version(app.db)
+        except Error as e:
+            # e.g. CatalogMeta doesn't exist yet because the migrations haven't been applied
+            print(f"Could not check the feature normalization version (run python schema/migrate.py?): {e}")
+
+    # shared in-memory cache of static catalog data (tracks, artists)
+    app.catalog_cache = CatalogCache(
+        max_bytes=app.config['CATALOG_CACHE_MB'] * 1024 * 1024,
+        check_interval=app.config['CATALOG_VERSION_CHECK_SECONDS']
+    )
+
+    app.async_db = create_async_db(app.config)
+
+    # in-memory friend graph for friend-of-friend queries, built on first use
+    app.friend_graph = LazyFriendGraph(max_age=app.config['FRIEND_GRAPH_MAX_AGE_SECONDS'])
+
+    # users x features taste matrix for platform-wide soulmate search, loaded on first use and rebuilt in the
+    # background when stale
+    app.user_embeddings = LazyUserEmbeddings(os.path.join(app.config['SNAPSHOT_DIR'], "user_embeddings"),
+                                             connect=lambda: connect_db(app.config),
+                                             max_age=app.config['USER_EMBEDDINGS_MAX_AGE_SECONDS'])
+
+    # memory-mapped catalog snapshot (see app/snapshot.py). nothing is opened until first use
+    app.catalog = LazySnapshot(app.config['SNAPSHOT_DIR'],
+                               check_interval=app.config['CATALOG_VERSION_CHECK_SECONDS'])
+
+    # per-user liked-track sets for "liked" checks without a query per track
+    app.liked_tracks = LikedTracks(app.catalog, max_users=app.config['LIKED_SET_MAX_USERS'],
+                                   max_age=app.config['LIKED_SET_MAX_AGE_SECONDS'])
+
+    # precomputed similar-track lists written by the nightly `python -m app.similar_tracks build`
+    app.similar_tracks = LazySimilarTracks(default_directory(app.config['SNAPSHOT_DIR']),
+                                           check_interval=app.config['CATALOG_VERSION_CHECK_SECONDS'])
+
+    # journal + flusher thread are only started by the first write (or overlay read) in each process
+    app.write_behind = WriteBehindQueue(app.config['WRITE_BEHIND_DIR'],
+                                        connect=lambda: connect_db(app.config),
+                                        flush_interval=app.config['WRITE_BEHIND_FLUSH_MS'] / 1000,
+                                        max_batch=app.config['WRITE_BEHIND_MAX_BATCH'],
+                                        fsync=app.config['WRITE_BEHIND_FSYNC'],
+                                        enabled=app.config['WRITE_BEHIND'])
 
     from .routes import bp
     app.register_blueprint(bp)
 
+    # JSON endpoints fetched by the pages' JavaScript (see app/api.py)
+    from .api import api
+    app.register_blueprint(api)
+
+    # request latency histograms, cache/pool callbacks and the /metrics endpoint
+    from .metrics import init_app
+    init_app(app)
+
+    from .profiling import init_app as init_profiling
+    init_profiling(app)
+
     return app
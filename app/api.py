@@ -0,0 +1,93 @@
+'''
+Versioned JSON API used by the pages' JavaScript.
+
+    GET /api/v1/dashboard/<desired_query>[?friend_id=<id>]
+
+returns `{"query": <desired_query>, "result": ...}` with the same result the /home form would render (see the
+query functions in routes.py, similarity.py and dashboard.py for the shapes). Responses carry a strong ETag over
+the body, so polling a panel whose data hasn't changed costs a 304 and no payload. Results that are random on
+every call (discovery) are sent with `no-store` instead.
+'''
+import hashlib
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+from flask import Blueprint, Response, current_app, request, session, url_for
+
+from .dashboard import parse_friend_id
+from .routes import run_dashboard_query
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+DASHBOARD_QUERIES = {"artists", "genres", "discovery", "soulmate", "platform_soulmate", "compatibility",
+                     "recommend_friend", "dashboard", "radar", "obscurity", "music_age"}
+# different on every call, so never worth revalidating
+UNCACHEABLE_QUERIES = {"discovery"}
+
+
+def to_json(value):
+    '''
+    Converts query results (dates, Decimals, NumPy scalars) into plain JSON types.
+    '''
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def json_response(payload, cacheable=True, status=200):
+    '''
+    Compact JSON response with a strong ETag, answered with 304 when the client already has this body.
+    '''
+    body = json.dumps(payload, separators=(",", ":"))
+    response = Response(body, status=status, mimetype="application/json")
+    if not cacheable:
+        response.headers["Cache-Control"] = "no-store"
+        return response
+    response.set_etag(hashlib.sha1(body.encode("utf-8")).hexdigest())
+    # per-user data: the browser may keep it but must revalidate every time
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
+
+
+def dashboard_image(filename):
+    # the PNG is rewritten in place, so version its URL by mtime to keep browsers from showing a stale one
+    if not filename:
+        return None
+    path = os.path.join(current_app.root_path, "static", filename)
+    version = int(os.path.getmtime(path)) if os.path.exists(path) else 0
+    return {"image": url_for("static", filename=filename, v=version)}
+
+
+@api.route('/dashboard/<desired_query>')
+def dashboard(desired_query):
+    '''
+    One dashboard query as JSON. `friend_id` (query string) is required for "compatibility" and optional for
+    "radar" (overlay).
+    '''
+    if 'user_id' not in session:
+        return json_response({"error": "not logged in"}, cacheable=False, status=401)
+    if desired_query not in DASHBOARD_QUERIES:
+        return json_response({"error": f"unknown query {desired_query}"}, cacheable=False, status=404)
+
+    try:
+        friend_id = parse_friend_id(request.args.get('friend_id'))
+    except ValueError:
+        return json_response({"error": "friend_id must be an integer"}, cacheable=False, status=400)
+
+    result = run_dashboard_query(desired_query, friend_id)
+    if desired_query == "dashboard":
+        result = dashboard_image(result)
+
+    return json_response({"query": desired_query, "result": to_json(result)},
+                         cacheable=desired_query not in UNCACHEABLE_QUERIES)
@@ -0,0 +1,158 @@
+'''
+Async MySQL access for pages that fan out into several independent queries.
+
+Flask views stay synchronous; the aiomysql pool lives on its own event loop in a background thread.
+`fan_out()` hands a batch of registered statements (see statements.py) to that loop, which runs them concurrently
+with `asyncio.gather` on separate pooled connections, so the page waits for the slowest query instead of the sum.
+
+If aiomysql isn't installed or DB_ASYNC is off, `fan_out()` just runs the statements one after another on the
+regular connection.
+'''
+import asyncio
+import threading
+import time
+
+from flask import current_app
+
+from .metrics import DB_POOL_WAIT_SECONDS, DB_QUERY_ERRORS, DB_QUERY_SECONDS
+from .statements import STATEMENTS, run
+
+try:
+    import aiomysql
+except ImportError:  # optional, falls back to sequential queries
+    aiomysql = None
+
+# errors that mean the pool couldn't run the queries (server unreachable, connection lost, too slow), after which
+# fan_out() retries them on the regular connection. anything else (a bad statement) is raised
+CONNECTION_ERRORS = (TimeoutError, OSError)
+if aiomysql is not None:
+    CONNECTION_ERRORS += (aiomysql.OperationalError, aiomysql.InterfaceError)
+
+
+class AsyncDB:
+    '''
+    aiomysql pool + the event loop thread that owns it. Both are created lazily on the first `gather()`, so this is
+    safe to construct before a pre-forking server forks.
+    '''
+
+    def __init__(self, host, user, password, database, port=3306, pool_size=8, timeout=10.0):
+        self.connect_args = dict(host=host, user=user, password=password, db=database, port=port)
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+        self._loop = None
+        self._pool = None
+        self._pool_lock = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="async-db", daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    async def _get_pool(self):
+        if self._pool is None:
+            if self._pool_lock is None:
+                self._pool_lock = asyncio.Lock()
+            async with self._pool_lock:
+                if self._pool is None:
+                    # autocommit so every read sees what the sync connection just committed
+                    self._pool = await aiomysql.create_pool(minsize=1, maxsize=self.pool_size, autocommit=True,
+                                                            **self.connect_args)
+        return self._pool
+
+    async def _run(self, name, params=(), fetch="all"):
+        pool = await self._get_pool()
+        waiting = time.perf_counter()
+        async with pool.acquire() as conn:
+            start = time.perf_counter()
+            DB_POOL_WAIT_SECONDS.observe(start - waiting)
+            try:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    await cursor.execute(STATEMENTS[name], params)
+                    if fetch == "one":
+                        return await cursor.fetchone()
+                    return list(await cursor.fetchall())
+            except Exception:
+                DB_QUERY_ERRORS.inc(name, "pool")
+                raise
+            finally:
+                DB_QUERY_SECONDS.observe(time.perf_counter() - start, name, "pool")
+
+    async def _gather(self, queries):
+        return await asyncio.gather(*(self._run(*query) for query in queries))
+
+    def gather(self, *queries):
+        '''
+        Runs `queries` concurrently and returns their results in order.
+
+        :param queries: tuples of (statement name, params[, fetch]) with fetch "all" (default) or "one"
+        '''
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(self._gather(queries), loop)
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            # stop the queries on the loop too, or they would keep holding pooled connections
+            future.cancel()
+            raise
+
+    def usage(self):
+        '''
+        Connections of the pool by state: {("in_use",): n, ("open",): n, ("max",): n}, or None before the first
+        `gather()` created it.
+        '''
+        pool = self._pool
+        if pool is None:
+            return None
+        return {("in_use",): pool.size - pool.freesize, ("open",): pool.size, ("max",): pool.maxsize}
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._pool is not None:
+            self._pool.close()
+            asyncio.run_coroutine_threadsafe(self._pool.wait_closed(), self._loop).result(self.timeout)
+            self._pool = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+
+
+def create_async_db(config):
+    '''
+    Builds the AsyncDB for `create_app()`, or returns None if async queries are disabled or aiomysql is missing.
+    '''
+    if not config['DB_ASYNC']:
+        return None
+    if aiomysql is None:
+        print("aiomysql is not installed, running fan-out queries sequentially.")
+        return None
+    return AsyncDB(
+        host=config['DB_HOST'],
+        user=config['DB_USER'],
+        password=config['DB_PASSWORD'],
+        database=config['DB_NAME'],
+        port=config['DB_PORT'],
+        pool_size=config['DB_ASYNC_POOL_SIZE']
+    )
+
+
+def fan_out(*queries):
+    '''
+    Runs several independent registered statements and returns their results in order, concurrently when the
+    app has an AsyncDB. Each query is a tuple of (statement name, params[, fetch]).
+
+        user, friends = fan_out(("user_info", (user_id,), "one"),
+                                ("friends_with_dates", (user_id, user_id)))
+    '''
+    async_db = getattr(current_app, "async_db", None)
+    if async_db is not None:
+        try:
+            return async_db.gather(*queries)
+        except CONNECTION_ERRORS as e:
+            print(f"Async queries failed, retrying sequentially: {e!r}")
+
+    return [run(*query) for query in queries]
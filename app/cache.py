@@ -0,0 +1,138 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from mysql.connector import Error
+
+# the loaders bump this row in CatalogMeta whenever Tracks/Artists are reloaded
+CATALOG_VERSION_KEY = "catalog_version"
+
+
+def estimate_size(obj) -> int:
+    '''
+    Rough deep size (in bytes) of a cached value. Only walks the container types we actually cache
+    (dicts, lists, tuples) so it stays cheap.
+    '''
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += estimate_size(key) + estimate_size(value)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += estimate_size(item)
+    return size
+
+
+class CatalogCache:
+    '''
+    Bounded, size-aware LRU cache for static catalog data (track metadata, artist info, artist top tracks...).
+
+    Entries are evicted least-recently-used first once the estimated total size goes over `max_bytes`.
+    The whole cache is dropped whenever the catalog version stamp in CatalogMeta changes, which the loaders
+    bump after every reload. The stamp is re-read at most once every `check_interval` seconds.
+
+    Only shared data belongs in here. Per-viewer bits (liked, is_friends...) must be merged into a copy of
+    the cached value by the caller.
+    '''
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, check_interval: float = 30.0):
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return  # never worth evicting everything for one entry
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def check_version(self, db):
+        '''
+        Re-reads the catalog version stamp (rate limited by `check_interval`) and clears the cache if it changed.
+        Databases created before CatalogMeta existed just never invalidate.
+        '''
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+
+        try:
+            # a read inside an open transaction sees its snapshot, never a bump committed since it began. the app's
+            # connections are autocommit (see connect_db); end any transaction still open on others first
+            if db.in_transaction:
+                db.commit()
+            cursor = db.cursor()
+            cursor.execute("SELECT meta_value FROM CatalogMeta WHERE meta_key = %s", (CATALOG_VERSION_KEY,))
+            row = cursor.fetchone()
+            cursor.close()
+        except Error as e:
+            print(f"Could not read catalog version: {e}")
+            return
+
+        version = row[0] if row else None
+        if version != self.version:
+            if self.version is not None:
+                print(f"Catalog version changed ({self.version} -> {version}), clearing catalog cache.")
+            self.clear()
+            self.version = version
+
+    def get_or_load(self, key, loader, db=None):
+        '''
+        Returns the cached value for `key`, calling `loader()` and caching its result on a miss.
+        `None` results are not cached so unknown ids keep hitting the database.
+
+        :param key: hashable cache key, e.g. ("track", track_id)
+        :param loader: zero-arg callable that queries the database
+        :param db: connection used to check the catalog version stamp (skipped if None)
+        '''
+        if db is not None:
+            self.check_version(db)
+
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.put(key, value)
+        return value
@@ -0,0 +1,197 @@
+import json
+import os
+
+import numpy as np
+
+# Spotify ids are 22 chars, the schema allows up to 32
+TRACK_ID_DTYPE = "S32"
+NO_YEAR = -1  # release_year sentinel for tracks without a release date
+
+TRACK_SELECT_COLUMNS = ["track_id", "title", "popularity", "duration_ms", "release_date"]
+
+
+class Track:
+    '''
+    Lightweight read-only view of one row of a TrackStore. Uses __slots__ so creating one per lookup is cheap.
+    '''
+    __slots__ = ("index", "track_id", "title", "popularity", "duration_ms", "release_year", "features")
+
+    def __init__(self, index, track_id, title, popularity, duration_ms, release_year, features):
+        self.index = index
+        self.track_id = track_id
+        self.title = title
+        self.popularity = popularity
+        self.duration_ms = duration_ms
+        self.release_year = release_year
+        self.features = features
+
+    def to_dict(self):
+        return {"track_id": self.track_id, "title": self.title}
+
+
+class TrackStore:
+    '''
+    Compact columnar store of the Tracks catalog for in-process use (similarity, caching...).
+
+    Instead of one dict per row, every column is a single NumPy array:
+        - track_ids: fixed-width bytes, sorted, so the dense integer id of a track is its position \
+          (looked up with a binary search instead of a 586K entry dict)
+        - titles: one UTF-8 blob plus an offsets array
+        - features: float32 matrix, one column per name in `feature_columns` (NaN where missing)
+        - popularity (int16), duration_ms (int32), release_year (int16, NO_YEAR if unknown)
+
+    Everything can be saved as plain .npy files and loaded back with `np.load(mmap_mode='r')`, so every worker
+    process maps the same pages instead of holding its own copy.
+    '''
+    __slots__ = ("track_ids", "feature_columns", "features", "popularity", "duration_ms", "release_year",
+                 "_title_offsets", "_title_blob")
+
+    ARRAYS = ("track_ids", "features", "popularity", "duration_ms", "release_year", "title_offsets", "title_blob")
+
+    def __init__(self, track_ids, feature_columns, features, popularity, duration_ms, release_year,
+                 title_offsets, title_blob):
+        self.track_ids = track_ids
+        self.feature_columns = list(feature_columns)
+        self.features = features
+        self.popularity = popularity
+        self.duration_ms = duration_ms
+        self.release_year = release_year
+        self._title_offsets = title_offsets
+        self._title_blob = title_blob
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    @classmethod
+    def from_rows(cls, rows, feature_columns):
+        '''
+        Builds a store from an iterable of tuples ordered like `TRACK_SELECT_COLUMNS + feature_columns`
+        (i.e. the rows of `select_tracks_query(feature_columns)` from a non-dictionary cursor).
+        '''
+        ids, titles, popularity, duration, year, features = [], [], [], [], [], []
+        for row in rows:
+            track_id, title, pop, dur, release_date = row[:5]
+            ids.append(track_id.encode("utf-8"))
+            titles.append((title or "").encode("utf-8"))
+            popularity.append(pop or 0)
+            duration.append(dur or 0)
+            year.append(release_date.year if release_date else NO_YEAR)
+            features.append([np.nan if v is None else float(v) for v in row[5:]])
+
+        track_ids = np.array(ids, dtype=TRACK_ID_DTYPE)
+        order = np.argsort(track_ids, kind="stable")
+
+        title_lengths = np.array([len(titles[i]) for i in order], dtype=np.int64)
+        title_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(title_lengths, out=title_offsets[1:])
+        title_blob = np.frombuffer(b"".join(titles[i] for i in order), dtype=np.uint8)
+
+        features = np.array(features, dtype=np.float32).reshape(len(ids), len(feature_columns))
+
+        return cls(
+            track_ids=track_ids[order],
+            feature_columns=feature_columns,
+            features=features[order],
+            popularity=np.array(popularity, dtype=np.int16)[order],
+            duration_ms=np.array(duration, dtype=np.int32)[order],
+            release_year=np.array(year, dtype=np.int16)[order],
+            title_offsets=title_offsets,
+            title_blob=title_blob
+        )
+
+    @classmethod
+    def from_cursor(cls, cursor, feature_columns, batch_size=50000):
+        '''
+        Streams the whole Tracks table out of a plain (non-dictionary) cursor in batches.
+        '''
+        cursor.execute(select_tracks_query(feature_columns))
+
+        def batches():
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from rows
+
+        return cls.from_rows(batches(), feature_columns)
+
+    def save(self, directory):
+        '''
+        Writes every column to `<directory>/<name>.npy` plus a small `columns.json` describing the features.
+        '''
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), self._array(name))
+        with open(os.path.join(directory, "columns.json"), "w", encoding="utf-8") as f:
+            json.dump({"feature_columns": self.feature_columns}, f)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        '''
+        Loads a store written by `save`. With `mmap=True` the arrays are read-only memory maps shared between
+        every process that loads the same files.
+        '''
+        mode = "r" if mmap else None
+        with open(os.path.join(directory, "columns.json"), "r", encoding="utf-8") as f:
+            feature_columns = json.load(f)["feature_columns"]
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode) for name in cls.ARRAYS}
+        return cls(feature_columns=feature_columns, **arrays)
+
+    def _array(self, name):
+        if name == "title_offsets":
+            return self._title_offsets
+        if name == "title_blob":
+            return self._title_blob
+        return getattr(self, name)
+
+    def index_of(self, track_id) -> int:
+        '''
+        Dense integer id of `track_id`, or -1 if it isn't in the store.
+        '''
+        key = np.array(track_id.encode("utf-8"), dtype=TRACK_ID_DTYPE)
+        i = int(np.searchsorted(self.track_ids, key))
+        if i < len(self.track_ids) and self.track_ids[i] == key:
+            return i
+        return -1
+
+    def indices_of(self, track_ids) -> np.ndarray:
+        '''
+        Vectorized `index_of`. Unknown ids map to -1.
+        '''
+        keys = np.array([t.encode("utf-8") for t in track_ids], dtype=TRACK_ID_DTYPE)
+        idx = np.searchsorted(self.track_ids, keys)
+        idx = np.minimum(idx, max(len(self.track_ids) - 1, 0))
+        found = self.track_ids[idx] == keys if len(self.track_ids) else np.zeros(len(keys), dtype=bool)
+        return np.where(found, idx, -1)
+
+    def track_id(self, index: int) -> str:
+        return self.track_ids[index].decode("utf-8")
+
+    def title(self, index: int) -> str:
+        start, end = self._title_offsets[index], self._title_offsets[index + 1]
+        return bytes(self._title_blob[start:end]).decode("utf-8")
+
+    def row(self, index: int) -> Track:
+        return Track(
+            index=index,
+            track_id=self.track_id(index),
+            title=self.title(index),
+            popularity=int(self.popularity[index]),
+            duration_ms=int(self.duration_ms[index]),
+            release_year=int(self.release_year[index]),
+            features=self.features[index]
+        )
+
+    def get(self, track_id):
+        '''
+        Returns the Track view for `track_id`, or None if it isn't in the store.
+        '''
+        i = self.index_of(track_id)
+        return self.row(i) if i >= 0 else None
+
+
+def select_tracks_query(feature_columns):
+    '''
+    The SELECT that `TrackStore.from_rows` expects rows from.
+    '''
+    return "SELECT " + ", ".join(TRACK_SELECT_COLUMNS + list(feature_columns)) + " FROM Tracks"
@@ -0,0 +1,138 @@
+'''
+The listening dashboard: the radar chart data the page draws itself (`dashboard_profile`) and the server-rendered
+PNG fallback (`create_dashboard`).
+
+matplotlib is only imported by the first `create_dashboard()` call, not with this module: importing pyplot costs
+more than the rest of the app's startup together, and most processes never render a PNG.
+'''
+import numpy as np
+from flask import abort, current_app, session
+
+from .async_db import fan_out
+from .features import FEATURE_COLUMNS, normalize_row
+from .loaders import loader
+from .metrics import DASHBOARD_RENDER_SECONDS
+from .similarity import get_taste_profiles
+from .statements import run
+
+_pyplot = None
+
+
+def pyplot():
+    '''
+    matplotlib.pyplot on the non-GUI Agg backend, imported on first use.
+    '''
+    global _pyplot
+    if _pyplot is None:
+        import matplotlib
+        matplotlib.use('Agg')  # use non-GUI backend so it can render in Flask
+        import matplotlib.pyplot as plt
+        _pyplot = plt
+    return _pyplot
+
+
+def parse_friend_id(value):
+    '''
+    The `friend_id` of a dashboard query as an int, None if no friend was picked (missing or empty). Raises
+    ValueError if it isn't a number. Shared by the /home form, the JSON API and the queries themselves.
+    '''
+    if value is None or value == "":
+        return None
+    return int(value)
+
+
+def dashboard_profile(friend_id=None):
+    '''
+    The data behind the dashboard radar chart, small enough to send as JSON and draw in the browser \
+    (static/radar.js) instead of rasterizing a PNG per user. Values are the normalized feature averages of the \
+    liked tracks (the taste profile), so a friend's profile can be overlaid on the same [0, 1] axes.
+
+    :param friend_id: optional user whose profile is included for comparison (loaded in the same query)
+    :returns result: dict[theme: str, features: List[str], values: List[float] or None (no liked tracks), \
+        friend: dict[friend_id: int, username: str, values: List[float] or None] or None]
+    '''
+
+    user_id = session["user_id"]
+    try:
+        friend_id = parse_friend_id(friend_id)
+    except ValueError:
+        abort(400)
+
+    profiles = get_taste_profiles([user_id] + ([friend_id] if friend_id is not None else []))
+    theme = run("theme", (user_id,), fetch="one")
+
+    def values(profile):
+        # the zero profile means no liked tracks, nothing to draw
+        return [round(float(v), 4) for v in profile] if profile.any() else None
+
+    friend = None
+    if friend_id is not None:
+        friend = {"friend_id": friend_id, "username": loader("user").load(friend_id), "values": values(profiles[1])}
+
+    return {
+        "theme": theme["theme"] if theme and theme["theme"] else "dark",
+        "features": FEATURE_COLUMNS,
+        "values": values(profiles[0]),
+        "friend": friend
+    }
+
+
+def create_dashboard():
+    '''
+    Generates a radar/web plot of the musical attributes the user most listens to. The page normally draws this \
+    chart itself from `dashboard_profile`; the PNG is the fallback for posting the form without JavaScript.
+    This web plot has 8 variables which are the features in the FEATURE_COLUMNS variable. (i.e. danceability, valence)
+    If the user's theme in the Preferences table is 'light', axes are black and bg is white. If 'dark', \
+        use a black bg and white axes. The color of the web itself is #1DB954 (spotify green).
+
+    Stores the figure as a png in the static/ folder.
+    Returns name of the file in the static folder.
+    '''
+
+    user_id = session["user_id"]
+
+    # theme preference and average liked track features
+    result, averages = fan_out(("theme", (user_id,), "one"),
+                               ("liked_feature_averages", (user_id,), "one"))
+    theme = result["theme"] if result and result["theme"] else "dark"
+    if not averages or all(averages[col] is None for col in FEATURE_COLUMNS):
+        return None
+
+    # on the same [0, 1] scale as the plot
+    values = normalize_row(averages).tolist()
+
+    num_vars = len(FEATURE_COLUMNS)
+    angles = np.linspace(0, 2 * np.pi, num_vars, endpoint=False).tolist()
+    values += values[:1]
+    angles += angles[:1]
+    labels = FEATURE_COLUMNS + [FEATURE_COLUMNS[0]]
+
+    if theme == "dark":
+        bg_color   = "#191414"
+        axis_color = "white"
+    else:
+        bg_color   = "white"
+        axis_color = "#191414"
+
+    plt = pyplot()
+    with DASHBOARD_RENDER_SECONDS.time():
+        fig, ax = plt.subplots(figsize=(6, 6), subplot_kw=dict(polar=True))
+        fig.patch.set_facecolor(bg_color)
+        ax.set_facecolor(bg_color)
+        ax.spines['polar'].set_color(axis_color)
+        ax.tick_params(colors=axis_color)
+        ax.xaxis.label.set_color(axis_color)
+        ax.yaxis.label.set_color(axis_color)
+        plt.xticks(angles[:-1], FEATURE_COLUMNS, color=axis_color)
+        ax.plot(angles, values, color="#1DB954", linewidth=2)
+        ax.fill(angles, values, color="#1DB954", alpha=0.25)
+        ax.set_ylim(0, 1)
+
+        filename = f"dashboard_{user_id}.png"
+        filepath = current_app.root_path + "/static/" + filename
+
+        plt.tight_layout()
+        plt.savefig(filepath, dpi=200, transparent=False)
+        plt.close()
+
+    return filename
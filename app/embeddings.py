@@ -0,0 +1,355 @@
+'''
+Users x features taste matrix for platform-wide "musical soulmate" search.
+
+Row `user_id` holds the sum of the normalized feature vectors of every track the user likes (plus the like count),
+so a like/unlike is one row update instead of re-running the taste profile query. `unit` keeps every row scaled
+to length 1, which makes the cosine similarity against every user on the platform a single matrix-vector product.
+
+The matrix is built with one grouped query and snapshot to `<SNAPSHOT_DIR>/user_embeddings/`:
+
+    CURRENT                           # name of the active snapshot, swapped atomically
+    embeddings-<time>-<pid>.npz       # sums and counts, written under a unique name and never modified
+
+Workers load the CURRENT snapshot and keep serving it while a newer one is built in the background (see
+LazyUserEmbeddings), so no request waits for the grouped query.
+
+Usage (from the project root):
+    python -m app.embeddings build     # rebuild from the database and write the snapshot
+'''
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from mysql.connector import Error
+
+from .features import FEATURE_COLUMNS, FEATURE_MINS, FEATURE_SPANS
+from .snapshot import current_snapshot_path, publish_current
+from .statements import iter_rows
+from .write_behind import try_lock
+
+SNAPSHOT_PREFIX = "embeddings-"
+KEEP_SNAPSHOTS = 2  # CURRENT plus the one before it
+BUILD_LOCK_FILE = ".build.lock"
+
+
+class UserEmbeddings:
+    '''
+    Per-user taste vectors kept as (sums, counts) plus a unit-length float32 copy for search.
+    '''
+
+    def __init__(self, sums, counts):
+        self.sums = sums
+        self.counts = counts
+        self.unit = np.zeros(sums.shape, dtype=np.float32)
+        self._lock = threading.Lock()
+        self._refresh_rows(slice(None))
+
+    @classmethod
+    def empty(cls, num_users=0):
+        return cls(np.zeros((num_users, len(FEATURE_COLUMNS)), dtype=np.float64),
+                   np.zeros(num_users, dtype=np.int32))
+
+    @classmethod
+    def from_db(cls, conn=None, batch_size=100000):
+        '''
+        Builds the matrix from one GROUP BY over TrackLikes. The query returns raw feature sums, which are turned
+        into sums of normalized vectors here: sum((x - min) / span) = (sum(x) - count * min) / span.
+        '''
+        user_ids, counts, raw_sums = [], [], []
+        for rows in iter_rows("user_feature_sums", batch_size=batch_size, conn=conn):
+            for row in rows:
+                user_ids.append(row[0])
+                counts.append(row[1])
+                raw_sums.append([float(v or 0.0) for v in row[2:]])
+
+        num_users = (max(user_ids) + 1) if user_ids else 0
+        embeddings = cls.empty(num_users)
+        if user_ids:
+            idx = np.array(user_ids, dtype=np.int64)
+            count_arr = np.array(counts, dtype=np.int32)
+            embeddings.counts[idx] = count_arr
+            embeddings.sums[idx] = (np.array(raw_sums) - count_arr[:, None] * FEATURE_MINS) / FEATURE_SPANS
+            embeddings._refresh_rows(slice(None))
+        return embeddings
+
+    def save(self, directory):
+        '''
+        Writes the sums and counts to one new, uniquely named .npz file and points CURRENT at it, so a reader
+        never sees the sums of one build with the counts of another, whichever processes save at the same time.
+
+        :returns: the file name
+        '''
+        os.makedirs(directory, exist_ok=True)
+        name = f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{os.getpid()}.npz"
+        tmp = os.path.join(directory, f".{name}")
+        with open(tmp, "wb") as f:
+            np.savez(f, sums=self.sums, counts=self.counts)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(directory, name))
+        publish_current(directory, name)
+        _prune(directory, keep=name)
+        return name
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Loads a snapshot file written by `save()`.
+        '''
+        with np.load(path) as data:
+            return cls(data["sums"], data["counts"])
+
+    @property
+    def num_users(self):
+        return len(self.counts)
+
+    def _refresh_rows(self, rows):
+        norms = np.linalg.norm(self.sums[rows], axis=-1, keepdims=True)
+        self.unit[rows] = np.divide(self.sums[rows], norms, out=np.zeros_like(self.sums[rows]), where=norms > 0)
+
+    def _grow(self, user_id):
+        if user_id < self.num_users:
+            return
+        size = max(user_id + 1, self.num_users * 2)
+        pad = size - self.num_users
+        self.sums = np.vstack([self.sums, np.zeros((pad, self.sums.shape[1]))])
+        self.counts = np.concatenate([self.counts, np.zeros(pad, dtype=np.int32)])
+        self.unit = np.vstack([self.unit, np.zeros((pad, self.unit.shape[1]), dtype=np.float32)])
+
+    def update(self, user_id, track_vector, sign=1):
+        '''
+        Adds (sign=1, like) or removes (sign=-1, unlike) one normalized track vector from a user's row.
+        '''
+        with self._lock:
+            self._grow(user_id)
+            self.sums[user_id] += sign * np.asarray(track_vector, dtype=np.float64)
+            self.counts[user_id] += sign
+            if self.counts[user_id] <= 0:
+                self.sums[user_id] = 0.0
+                self.counts[user_id] = 0
+            self._refresh_rows(user_id)
+
+    def profile(self, user_id):
+        '''
+        The user's taste profile (average normalized feature vector), zeros if they haven't liked anything.
+        '''
+        with self._lock:
+            if user_id >= self.num_users or self.counts[user_id] == 0:
+                return np.zeros(len(FEATURE_COLUMNS))
+            return self.sums[user_id] / self.counts[user_id]
+
+    def most_similar(self, user_id, k=1, exclude=()):
+        '''
+        Top-`k` users by cosine similarity to `user_id` over the whole platform.
+
+        :param exclude: user ids to leave out (the user themself is always excluded)
+        :returns: list of (user_id, similarity) pairs, most similar first
+        '''
+        # under the lock: update() may be growing (replacing) the arrays, which must be read at the same size
+        with self._lock:
+            if user_id >= self.num_users or self.counts[user_id] == 0:
+                return []
+
+            scores = self.unit @ self.unit[user_id]
+            scores[user_id] = -np.inf
+            scores[self.counts == 0] = -np.inf
+            excluded = [u for u in exclude if u < self.num_users]
+            if excluded:
+                scores[excluded] = -np.inf
+            k = min(k, self.num_users)
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(u), float(scores[u])) for u in top if np.isfinite(scores[u])]
+
+
+def snapshot_age(directory):
+    '''
+    Seconds since the CURRENT snapshot in `directory` was written, None if there is none.
+    '''
+    path = current_snapshot_path(directory)
+    try:
+        return time.time() - os.path.getmtime(path) if path else None
+    except OSError:
+        return None
+
+
+def _prune(directory, keep):
+    names = sorted(n for n in os.listdir(directory) if n.startswith(SNAPSHOT_PREFIX) and n.endswith(".npz"))
+    for old in names[:max(0, len(names) - KEEP_SNAPSHOTS)]:
+        if old != keep:
+            try:
+                os.remove(os.path.join(directory, old))
+            except FileNotFoundError:
+                pass
+
+
+class LazyUserEmbeddings:
+    '''
+    Holds the app's UserEmbeddings. The first `get()` loads the CURRENT snapshot, whatever its age (or starts
+    from an empty matrix if there is none). Once the matrix is older than `max_age`, `get()` keeps returning it and
+    starts a background refresh: that loads a newer snapshot if one was written by another worker (or by
+    `python -m app.embeddings build`), otherwise rebuilds from the database on its own connection and writes one.
+    Only one process rebuilds at a time (a flock on BUILD_LOCK_FILE), the others pick up its snapshot later.
+
+    Likes and unlikes made while a refresh runs go to the matrix being served and to a delta log, which is replayed
+    on the new matrix when it is swapped in: the snapshot was read from the database before they were written.
+    '''
+
+    def __init__(self, directory, connect=None, max_age=3600.0, retry_interval=60.0):
+        '''
+        :param directory: where the snapshots live
+        :param connect: zero-arg callable returning a new database connection for background rebuilds
+        :param max_age: seconds before the matrix is refreshed
+        :param retry_interval: seconds between refresh attempts while the matrix stays stale (failed rebuild,
+            another process rebuilding)
+        '''
+        self.directory = directory
+        self.connect = connect
+        self.max_age = max_age
+        self.retry_interval = retry_interval
+        self._embeddings = None
+        self._built_at = 0.0     # time.time() the loaded snapshot was written
+        self._next_check = 0.0   # time.monotonic() of the next refresh attempt
+        self._refresher = None
+        self._pending = None     # (user_id, track_vector, sign) updated during a refresh, None when none runs
+        self._lock = threading.Lock()
+
+    def get(self) -> UserEmbeddings:
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    self._load_current()
+                if self._embeddings is None:
+                    # nothing built yet: serve an empty matrix until the first build is done
+                    self._embeddings = UserEmbeddings.empty()
+        if time.time() - self._built_at >= self.max_age and time.monotonic() >= self._next_check:
+            self._start_refresh()
+        return self._embeddings
+
+    def refresh(self, conn=None):
+        '''
+        Rebuilds the snapshot if it is older than `max_age` (and no other process is rebuilding it), then loads the
+        CURRENT one. Runs in the caller's thread: the background refresher, or the gunicorn master's preload.
+
+        :param conn: connection to build with, defaults to a new one from `connect` (closed afterwards)
+        '''
+        with self._lock:
+            self._pending = []
+        try:
+            age = snapshot_age(self.directory)
+            if age is None or age >= self.max_age:
+                self._rebuild(conn)
+            with self._lock:
+                if self._load_current():
+                    for user_id, track_vector, sign in self._pending:
+                        self._embeddings.update(user_id, track_vector, sign)
+        finally:
+            with self._lock:
+                self._pending = None
+
+    @property
+    def loaded(self):
+        return self._embeddings is not None
+
+    def update(self, user_id, track_vector, sign=1):
+        if track_vector is None:
+            return
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((user_id, track_vector, sign))
+            embeddings = self._embeddings
+        # nothing to keep up to date until someone asks for the matrix
+        if embeddings is not None:
+            embeddings.update(user_id, track_vector, sign)
+
+    def _start_refresh(self):
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._next_check = time.monotonic() + self.retry_interval
+            self._refresher = threading.Thread(target=self._refresh_in_background, name="user-embeddings-refresh",
+                                               daemon=True)
+            self._refresher.start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except (Error, OSError, ValueError) as e:
+            print(f"Could not refresh user embeddings, still serving the previous ones: {e}")
+
+    def _rebuild(self, conn=None):
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(os.path.join(self.directory, BUILD_LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if not try_lock(fd):
+                return  # another process is rebuilding, its snapshot is loaded by a later refresh
+            age = snapshot_age(self.directory)
+            if age is not None and age < self.max_age:
+                return  # written while this process was deciding to rebuild
+            own_conn = conn is None
+            if own_conn:
+                conn = self.connect()
+            try:
+                started = time.perf_counter()
+                embeddings = UserEmbeddings.from_db(conn)
+                embeddings.save(self.directory)
+                print(f"Rebuilt {embeddings.num_users} user embeddings in {time.perf_counter() - started:.1f}s")
+            finally:
+                if own_conn:
+                    conn.close()
+        finally:
+            os.close(fd)  # releases the flock
+
+    def _load_current(self):
+        # caller holds self._lock. True if a different snapshot was swapped in
+        path = current_snapshot_path(self.directory)
+        if path is None:
+            return False
+        try:
+            built_at = os.path.getmtime(path)
+            if self._embeddings is not None and built_at == self._built_at:
+                return False
+            embeddings = UserEmbeddings.load(path)
+        except (OSError, ValueError) as e:
+            print(f"Could not load user embeddings from {path}: {e}")
+            return False
+        self._embeddings, self._built_at = embeddings, built_at
+        return True
+
+
+def main(argv):
+    import mysql.connector
+    from dotenv import load_dotenv
+    from .snapshot import DEFAULT_SNAPSHOT_DIR
+
+    load_dotenv(os.path.join(os.path.dirname(DEFAULT_SNAPSHOT_DIR), ".env"))
+    command = argv[1] if len(argv) > 1 else "build"
+    if command != "build":
+        print(f"Unknown command {command}. Use 'build'.")
+        return 1
+
+    conn = mysql.connector.connect(
+        host=os.getenv("DB_HOST", "localhost"),
+        port=int(os.getenv("DB_PORT", "3306")),
+        user=os.getenv("DB_USER", "spotify_user"),
+        password=os.getenv("DB_PASSWORD", "Spotify123!"),
+        database=os.getenv("DB_NAME", "spotify_db")
+    )
+    try:
+        started = time.perf_counter()
+        embeddings = UserEmbeddings.from_db(conn)
+        directory = os.path.join(os.getenv("SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR), "user_embeddings")
+        embeddings.save(directory)
+        print(f"Wrote {embeddings.num_users} user embeddings to {directory} "
+              f"in {time.perf_counter() - started:.1f}s")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
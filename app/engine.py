@@ -0,0 +1,233 @@
+'''
+Small chunked map/reduce engine for catalog-wide NumPy work.
+
+A kernel is a top-level function `kernel(arrays, start, end, *args)` that works on rows [start, end) of the
+arrays it is given and returns a partial result. `map_reduce()` splits the rows into chunks, runs the kernel on a
+ProcessPoolExecutor and folds the partial results (in chunk order) with a reducer:
+
+    stats = map_reduce(column_stats, {"matrix": features}, reduce=merge_column_stats, args=(bin_edges,))
+
+Input arrays are copied once into `multiprocessing.shared_memory` (or, if given as a path to a .npy file,
+memory-mapped by each worker), so workers read the same pages instead of each receiving a pickled copy.
+`map_csv()` does the same for a CSV read in pandas chunks, with the kernel getting one DataFrame at a time.
+
+Small inputs (a single chunk) or workers=1 run inline in the calling process.
+'''
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+DEFAULT_CHUNK_ROWS = 65536
+
+
+class SharedArray:
+    '''
+    A NumPy array living in a named shared memory block. The creating process owns (and unlinks) it, workers
+    attach to it by name through `spec`.
+    '''
+
+    def __init__(self, shm, shape, dtype, owner=False):
+        self.shm = shm
+        self.array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        self.owner = owner
+
+    @classmethod
+    def create(cls, array):
+        array = np.ascontiguousarray(array)
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = cls(shm, array.shape, array.dtype, owner=True)
+        shared.array[...] = array
+        return shared
+
+    @property
+    def spec(self):
+        return ("shm", self.shm.name, self.array.shape, self.array.dtype.str)
+
+    @classmethod
+    def attach(cls, spec):
+        _, name, shape, dtype = spec
+        return cls(shared_memory.SharedMemory(name=name), shape, np.dtype(dtype))
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _run_chunk(payload):
+    # attached per chunk and closed when the kernel returns: a handle left open keeps the block mapped in the
+    # worker and makes the resource tracker warn about it at exit. Kernels must not return views of their inputs.
+    kernel, specs, start, end, args = payload
+    attached = []
+    arrays = {}
+    try:
+        for name, spec in specs.items():
+            if spec[0] == "npy":
+                arrays[name] = np.load(spec[1], mmap_mode="r")
+            else:
+                attached.append(SharedArray.attach(spec))
+                arrays[name] = attached[-1].array
+        return kernel(arrays, start, end, *args)
+    finally:
+        # the ndarrays borrow the blocks' buffers, which can't be closed while they are referenced
+        arrays = None
+        for shared in attached:
+            shared.close()
+
+
+def _fold(partials, reduce, initial):
+    if reduce is None:
+        return list(partials)
+    acc = initial
+    for partial in partials:
+        acc = partial if acc is None else reduce(acc, partial)
+    return acc
+
+
+def chunk_bounds(n_rows, chunk_rows=DEFAULT_CHUNK_ROWS):
+    return [(start, min(start + chunk_rows, n_rows)) for start in range(0, n_rows, chunk_rows)]
+
+
+def map_reduce(kernel, arrays, n_rows=None, chunk_rows=DEFAULT_CHUNK_ROWS, reduce=None, initial=None, args=(),
+               workers=None):
+    '''
+    Runs `kernel(arrays, start, end, *args)` over row chunks of `arrays` and folds the partial results.
+
+    :param kernel: top-level (picklable) function returning a partial result for rows [start, end)
+    :param arrays: dict of name -> ndarray, or name -> path of a .npy file (memory-mapped by the workers)
+    :param n_rows: rows to split, defaults to the length of the first array
+    :param reduce: reduce(acc, partial) -> acc, applied in chunk order. None returns the list of partials.
+    :param initial: starting accumulator (None = the first partial; with no rows at all the kernel then runs once
+        on the empty range so the result still has the partials' shape)
+    :param workers: process pool size, defaults to os.cpu_count(). 1 runs inline.
+    '''
+    if n_rows is None:
+        first = next(iter(arrays.values()))
+        n_rows = len(np.load(first, mmap_mode="r")) if isinstance(first, str) else len(first)
+    bounds = chunk_bounds(n_rows, chunk_rows)
+    if not bounds and reduce is not None and initial is None:
+        bounds = [(0, 0)]
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(bounds) <= 1:
+        local = {name: np.load(a, mmap_mode="r") if isinstance(a, str) else a for name, a in arrays.items()}
+        return _fold((kernel(local, start, end, *args) for start, end in bounds), reduce, initial)
+
+    shared = {}
+    try:
+        specs = {}
+        for name, array in arrays.items():
+            if isinstance(array, str):
+                specs[name] = ("npy", array)
+            else:
+                shared[name] = SharedArray.create(array)
+                specs[name] = shared[name].spec
+
+        payloads = [(kernel, specs, start, end, args) for start, end in bounds]
+        with ProcessPoolExecutor(max_workers=min(workers, len(bounds))) as pool:
+            return _fold(pool.map(_run_chunk, payloads), reduce, initial)
+    finally:
+        for array in shared.values():
+            array.close()
+
+
+def _run_frame(payload):
+    kernel, frame, args = payload
+    return kernel(frame, *args)
+
+
+def map_csv(kernel, path, chunk_rows=DEFAULT_CHUNK_ROWS, reduce=None, initial=None, args=(), workers=None,
+            **read_csv_kwargs):
+    '''
+    Reads `path` with pandas in chunks of `chunk_rows` and runs `kernel(frame, *args)` on each chunk in a process
+    pool while the next chunks are being read. Partial results are folded in file order like `map_reduce()`.
+    Extra keyword arguments go to `pandas.read_csv` (dtype, usecols, ...).
+    '''
+    import pandas as pd
+
+    reader = pd.read_csv(path, chunksize=chunk_rows, **read_csv_kwargs)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return _fold((kernel(frame, *args) for frame in reader), reduce, initial)
+
+    def partials(pool):
+        # keep at most 2 chunks per worker in flight so a big file is never fully in memory
+        pending = []
+        for frame in reader:
+            pending.append(pool.submit(_run_frame, (kernel, frame, args)))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return _fold(partials(pool), reduce, initial)
+
+
+# ---------- reducers ----------
+
+def add(acc, partial):
+    '''
+    Element-wise sum of partials (numbers, arrays, or dicts/tuples of them), e.g. sums, counts, histograms.
+    '''
+    if isinstance(acc, dict):
+        return {key: add(acc[key], partial[key]) for key in acc}
+    if isinstance(acc, tuple):
+        return tuple(add(a, p) for a, p in zip(acc, partial))
+    return acc + partial
+
+
+def merge_top_k(k):
+    '''
+    Reducer keeping the `k` best (score, index) pairs per row. Partials are (scores, indices) arrays of shape
+    (rows, n) or (n,); the result is sorted best first, with -inf scores for missing entries.
+    '''
+    def reduce(acc, partial):
+        return top_k(np.concatenate([acc[0], partial[0]], axis=-1),
+                     np.concatenate([acc[1], partial[1]], axis=-1), k)
+    return reduce
+
+
+def top_k(scores, indices, k):
+    '''
+    The `k` highest scores along the last axis (and their indices), sorted best first.
+    '''
+    if scores.shape[-1] > k:
+        part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+        scores = np.take_along_axis(scores, part, axis=-1)
+        indices = np.take_along_axis(indices, part, axis=-1)
+    order = np.argsort(-scores, axis=-1, kind="stable")
+    return np.take_along_axis(scores, order, axis=-1), np.take_along_axis(indices, order, axis=-1)
+
+
+# ---------- kernels ----------
+
+def column_stats(arrays, start, end, bin_edges):
+    '''
+    Partial count/sum/sum of squares/min/max and histogram (over `bin_edges`) of every column of
+    arrays["matrix"][start:end], ignoring NaN. Reduce with `merge_column_stats`.
+    '''
+    block = np.asarray(arrays["matrix"][start:end], dtype=np.float64)
+    valid = ~np.isnan(block)
+    filled = np.where(valid, block, 0.0)
+    histograms = np.stack([np.histogram(block[valid[:, c], c], bins=bin_edges)[0]
+                           for c in range(block.shape[1])])
+    return {
+        "count": valid.sum(axis=0),
+        "sum": filled.sum(axis=0),
+        "sum_sq": (filled ** 2).sum(axis=0),
+        "min": np.where(valid, block, np.inf).min(axis=0, initial=np.inf),
+        "max": np.where(valid, block, -np.inf).max(axis=0, initial=-np.inf),
+        "histogram": histograms
+    }
+
+
+def merge_column_stats(acc, partial):
+    merged = add({key: acc[key] for key in ("count", "sum", "sum_sq", "histogram")},
+                 {key: partial[key] for key in ("count", "sum", "sum_sq", "histogram")})
+    merged["min"] = np.minimum(acc["min"], partial["min"])
+    merged["max"] = np.maximum(acc["max"], partial["max"])
+    return merged
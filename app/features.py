@@ -0,0 +1,109 @@
+'''
+Shared normalization of the musical features, used by the app and the loaders alike.
+
+Tracks stores the raw Spotify values (loudness in dB, tempo in BPM, the rest already 0-1). Everything that
+compares tracks or users maps them to [0, 1] with the FEATURE_RANGES below, a whole batch/matrix at a time.
+
+NORMALIZATION_VERSION is stamped into CatalogMeta by the loaders and into every catalog snapshot, so data
+written under different conventions is detected instead of silently normalized twice.
+'''
+import numpy as np
+
+# Bump when the stored representation or FEATURE_RANGES change, and reload the catalog.
+#   1: loaders stored loudness/tempo pre-normalized to [0, 1] (legacy, never stamped)
+#   2: raw values stored, normalized only here
+NORMALIZATION_VERSION = "2"
+NORMALIZATION_VERSION_KEY = "feature_normalization"
+LEGACY_NORMALIZATION_VERSION = "1"  # what an unstamped database holds
+
+FEATURE_RANGES = {
+    "mode": (0,1),
+    "danceability": (0, 1),
+    "energy": (0, 1),
+    "loudness": (-60, 5.4),
+    "speechiness": (0, 1),
+    "acousticness": (0, 1),
+    "instrumentalness": (0, 1),
+    "liveness": (0, 1),
+    "valence": (0, 1),
+    "tempo": (0, 246)
+}
+
+FEATURE_COLUMNS = [
+    "mode",
+    "danceability",
+    "energy",
+    "valence",
+    "tempo",
+    "acousticness",
+    "instrumentalness",
+    "liveness",
+    "speechiness",
+    "loudness"
+]
+
+# FEATURE_RANGES as arrays in FEATURE_COLUMNS order
+FEATURE_MINS = np.array([FEATURE_RANGES[c][0] for c in FEATURE_COLUMNS], dtype=np.float64)
+FEATURE_MAXS = np.array([FEATURE_RANGES[c][1] for c in FEATURE_COLUMNS], dtype=np.float64)
+FEATURE_SPANS = FEATURE_MAXS - FEATURE_MINS
+
+
+def feature_matrix(rows) -> np.ndarray:
+    '''
+    Raw (rows x len(FEATURE_COLUMNS)) float64 matrix from dict rows keyed by feature name. None becomes NaN.
+    '''
+    return np.array([[row[c] for c in FEATURE_COLUMNS] for row in rows], dtype=np.float64) \
+        .reshape(-1, len(FEATURE_COLUMNS))
+
+
+def normalize_matrix(matrix, dtype=np.float32) -> np.ndarray:
+    '''
+    Maps a (rows x len(FEATURE_COLUMNS)) matrix (or a single vector) of raw values, columns in FEATURE_COLUMNS
+    order, to [0, 1]. Missing values (NaN) become 0.0.
+    '''
+    matrix = np.asarray(matrix, dtype=np.float64)
+    normalized = (matrix - FEATURE_MINS) / FEATURE_SPANS
+    return np.nan_to_num(normalized, nan=0.0).astype(dtype, copy=False)
+
+
+def normalize_rows(rows) -> np.ndarray:
+    '''
+    Normalized float64 matrix of dict rows (e.g. from a dictionary cursor), one row per input row.
+    '''
+    return normalize_matrix(feature_matrix(rows), dtype=np.float64)
+
+
+def normalize_row(row) -> np.ndarray:
+    '''
+    Normalized float64 vector of one dict row.
+    '''
+    return normalize_rows([row])[0]
+
+
+def clip_to_ranges(matrix) -> np.ndarray:
+    '''
+    Clips raw values into FEATURE_RANGES (NaN stays NaN), so stored data normalizes into [0, 1].
+    '''
+    return np.clip(np.asarray(matrix, dtype=np.float64), FEATURE_MINS, FEATURE_MAXS)
+
+
+def stored_normalization_version(cursor):
+    '''
+    The normalization version the database's Tracks were loaded with (LEGACY_NORMALIZATION_VERSION if unstamped).
+    '''
+    cursor.execute("SELECT meta_value FROM CatalogMeta WHERE meta_key = %s", (NORMALIZATION_VERSION_KEY,))
+    row = cursor.fetchone()
+    if not row:
+        return LEGACY_NORMALIZATION_VERSION
+    return row["meta_value"] if isinstance(row, dict) else row[0]
+
+
+def taste_profile_from_row(row) -> np.ndarray:
+    '''
+    Normalized taste vector from a row of per-feature averages over a user's liked tracks (zeros if the user has no
+    likes, i.e. all averages are NULL). The average of raw values normalizes the same as the average of normalized
+    values (it's linear).
+    '''
+    if not row or all(row[feature] is None for feature in FEATURE_COLUMNS):
+        return np.zeros(len(FEATURE_COLUMNS))
+    return normalize_row(row)
@@ -0,0 +1,159 @@
+'''
+In-memory friend graph used for friend-of-friend candidate generation.
+
+Friendships(user_id1, user_id2) stores each friendship once. The graph mirrors every edge and keeps a CSR
+adjacency (indptr/indices NumPy arrays indexed by user_id), so a user's friends are one array slice and the
+friends-of-friends of a user, with mutual friend counts, come from one gather + np.unique.
+
+Friend toggles made through the app are applied to a small overlay right away; the CSR is rebuilt from the
+database every `max_age` seconds (picking up changes made by other workers) or once the overlay gets large.
+'''
+import threading
+import time
+
+import numpy as np
+
+from .statements import iter_rows
+
+EMPTY = np.zeros(0, dtype=np.int64)
+
+
+class FriendGraph:
+    '''
+    Symmetric CSR adjacency of the friendship graph plus an overlay of edges added/removed since it was built.
+    '''
+
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+        self.built_at = time.monotonic()
+        self._added = {}    # user_id -> set of friend ids added since the build
+        self._removed = {}  # user_id -> set of friend ids removed since the build
+        self.overlay_size = 0
+
+    @classmethod
+    def from_edges(cls, user_id1, user_id2):
+        '''
+        Builds the CSR from two parallel arrays of user ids (one row per friendship, either orientation).
+        '''
+        user_id1 = np.asarray(user_id1, dtype=np.int64)
+        user_id2 = np.asarray(user_id2, dtype=np.int64)
+        src = np.concatenate([user_id1, user_id2])
+        dst = np.concatenate([user_id2, user_id1])
+
+        n = int(src.max()) + 1 if len(src) else 0
+        order = np.lexsort((dst, src))  # sorted by src, then dst -> every neighbour list is sorted
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+        return cls(indptr, dst[order])
+
+    @classmethod
+    def from_db(cls, conn=None, batch_size=100000):
+        user_id1, user_id2 = [], []
+        for rows in iter_rows("all_friendships", batch_size=batch_size, conn=conn):
+            for u1, u2 in rows:
+                user_id1.append(u1)
+                user_id2.append(u2)
+        return cls.from_edges(user_id1, user_id2)
+
+    @property
+    def num_users(self):
+        return len(self.indptr) - 1
+
+    def _base_neighbors(self, user_id):
+        if user_id < 0 or user_id >= self.num_users:
+            return EMPTY
+        return self.indices[self.indptr[user_id]:self.indptr[user_id + 1]]
+
+    def neighbors(self, user_id) -> np.ndarray:
+        '''
+        Sorted array of `user_id`'s friends.
+        '''
+        base = self._base_neighbors(user_id)
+        added, removed = self._added.get(user_id), self._removed.get(user_id)
+        if not added and not removed:
+            return base
+        result = set(base.tolist())
+        result |= added or set()
+        result -= removed or set()
+        return np.array(sorted(result), dtype=np.int64)
+
+    def degree(self, user_id) -> int:
+        return len(self.neighbors(user_id))
+
+    def friends_of_friends(self, user_id):
+        '''
+        Users exactly two hops away from `user_id` (not the user, not already friends).
+
+        :returns: (candidate_ids, mutual_counts) as parallel arrays, where mutual_counts[i] is how many of the
+            user's friends are also friends with candidate_ids[i].
+        '''
+        friends = self.neighbors(user_id)
+        if len(friends) == 0:
+            return EMPTY, EMPTY
+
+        # friends without overlay changes are gathered straight out of the CSR in one vectorized step
+        dirty = np.array([f in self._added or f in self._removed for f in friends.tolist()], dtype=bool)
+        clean = friends[~dirty & (friends < self.num_users)]
+
+        starts = self.indptr[clean]
+        lengths = self.indptr[clean + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        parts = [self.indices[offsets + np.arange(lengths.sum())]]
+        parts += [self.neighbors(f) for f in friends[dirty].tolist()]
+
+        candidates, counts = np.unique(np.concatenate(parts), return_counts=True)
+
+        # drop the user and their direct friends
+        keep = ~np.isin(candidates, friends) & (candidates != user_id)
+        return candidates[keep], counts[keep]
+
+    def mutual_friend_count(self, user_a, user_b) -> int:
+        return len(np.intersect1d(self.neighbors(user_a), self.neighbors(user_b), assume_unique=True))
+
+    def _toggle(self, a, b, add):
+        target, other = (self._added, self._removed) if add else (self._removed, self._added)
+        for u, v in ((a, b), (b, a)):
+            if v in other.get(u, ()):
+                other[u].discard(v)
+            else:
+                target.setdefault(u, set()).add(v)
+        self.overlay_size += 1
+
+    def add_edge(self, user_a, user_b):
+        self._toggle(user_a, user_b, add=True)
+
+    def remove_edge(self, user_a, user_b):
+        self._toggle(user_a, user_b, add=False)
+
+
+class LazyFriendGraph:
+    '''
+    Holds the app's FriendGraph. Built on first use and rebuilt once it is older than `max_age` seconds or has
+    more than `max_overlay` pending edge changes.
+    '''
+
+    def __init__(self, max_age=300.0, max_overlay=10000):
+        self.max_age = max_age
+        self.max_overlay = max_overlay
+        self._graph = None
+        self._lock = threading.Lock()
+
+    def get(self, conn=None) -> FriendGraph:
+        graph = self._graph
+        if graph is None or time.monotonic() - graph.built_at > self.max_age \
+                or graph.overlay_size > self.max_overlay:
+            with self._lock:
+                if self._graph is graph:
+                    self._graph = FriendGraph.from_db(conn)
+                graph = self._graph
+        return graph
+
+    def add_edge(self, user_a, user_b):
+        # nothing to update if the graph was never built
+        if self._graph is not None:
+            self._graph.add_edge(user_a, user_b)
+
+    def remove_edge(self, user_a, user_b):
+        if self._graph is not None:
+            self._graph.remove_edge(user_a, user_b)
@@ -0,0 +1,147 @@
+'''
+Per-user liked-track sets, so "has this user liked this track" is a membership test instead of a query.
+
+A user's likes are loaded once (one index-only read of TrackLikes) into a LikedSet: a sorted int32 array of the
+tracks' dense ids in the attached catalog snapshot, plus a small Python set for track ids the snapshot doesn't
+know (tracks added since it was exported, or every id when no snapshot is attached). A single check is a binary
+search; marking a whole search result or similar-tracks list is one `np.isin`.
+
+Likes made through this process update the set in place. Sets are kept for `max_users` users (LRU) and reloaded
+after `max_age` seconds or when a new snapshot is attached, which also picks up likes made through other worker
+processes. Pending likes in the write-behind queue are checked by the caller first (see routes.mark_liked).
+
+The sets are only for marking lists of tracks. Whether a single track is liked, which decides the like/unlike
+toggle, is read from the database (routes.has_liked), so it is never stale.
+'''
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .statements import run
+
+EMPTY = np.zeros(0, dtype=np.int32)
+
+
+class LikedSet:
+    '''
+    The tracks one user has liked, against one snapshot (or none).
+    '''
+
+    def __init__(self, track_ids, snapshot=None):
+        self.snapshot = snapshot
+        self.loaded_at = time.monotonic()
+        self.extra = set()
+        if snapshot is None:
+            self.indices = EMPTY
+            self.extra = set(track_ids)
+            return
+        indices = snapshot.tracks.indices_of(track_ids) if track_ids else EMPTY
+        self.indices = np.unique(indices[indices >= 0]).astype(np.int32)
+        self.extra = {t for t, i in zip(track_ids, indices) if i < 0}
+
+    def __len__(self):
+        return len(self.indices) + len(self.extra)
+
+    def _index(self, track_id):
+        return self.snapshot.tracks.index_of(track_id) if self.snapshot is not None else -1
+
+    def __contains__(self, track_id):
+        i = self._index(track_id)
+        if i < 0:
+            return track_id in self.extra
+        pos = np.searchsorted(self.indices, i)
+        return pos < len(self.indices) and self.indices[pos] == i
+
+    def contains_many(self, track_ids) -> np.ndarray:
+        '''
+        Boolean array, one flag per id in `track_ids`.
+        '''
+        if not track_ids:
+            return np.zeros(0, dtype=bool)
+        if self.snapshot is None:
+            return np.array([t in self.extra for t in track_ids], dtype=bool)
+        indices = self.snapshot.tracks.indices_of(track_ids)
+        flags = np.isin(indices, self.indices) & (indices >= 0)
+        for k in np.flatnonzero(indices < 0):
+            flags[k] = track_ids[k] in self.extra
+        return flags
+
+    def add(self, track_id):
+        i = self._index(track_id)
+        if i < 0:
+            self.extra.add(track_id)
+            return
+        pos = np.searchsorted(self.indices, i)
+        if pos == len(self.indices) or self.indices[pos] != i:
+            self.indices = np.insert(self.indices, pos, i)
+
+    def discard(self, track_id):
+        i = self._index(track_id)
+        if i < 0:
+            self.extra.discard(track_id)
+            return
+        pos = np.searchsorted(self.indices, i)
+        if pos < len(self.indices) and self.indices[pos] == i:
+            self.indices = np.delete(self.indices, pos)
+
+
+class LikedTracks:
+    '''
+    LRU of LikedSets by user id. Attached to the app by `create_app()` as `app.liked_tracks`.
+    '''
+
+    def __init__(self, catalog, max_users=10000, max_age=60.0):
+        '''
+        :param catalog: the app's LazySnapshot (dense track ids come from its current snapshot)
+        :param max_users: how many users' sets to keep
+        :param max_age: seconds before a set is reloaded from the database
+        '''
+        self.catalog = catalog
+        self.max_users = max_users
+        self.max_age = max_age
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+        self._sets = OrderedDict()  # user_id -> LikedSet
+        self._lock = threading.Lock()
+
+    def get(self, user_id) -> LikedSet:
+        snapshot = self.catalog.get()
+        with self._lock:
+            liked = self._sets.get(user_id)
+            if liked is not None and liked.snapshot is snapshot \
+                    and time.monotonic() - liked.loaded_at < self.max_age:
+                self._sets.move_to_end(user_id)
+                self.hits += 1
+                return liked
+
+        track_ids = [row["track_id"] for row in run("user_liked_track_ids", (user_id,))]
+        liked = LikedSet(track_ids, snapshot)
+        with self._lock:
+            self.loads += 1
+            self._sets[user_id] = liked
+            self._sets.move_to_end(user_id)
+            while len(self._sets) > self.max_users:
+                self._sets.popitem(last=False)
+                self.evictions += 1
+        return liked
+
+    def contains(self, user_id, track_id) -> bool:
+        return track_id in self.get(user_id)
+
+    def contains_many(self, user_id, track_ids) -> np.ndarray:
+        return self.get(user_id).contains_many(list(track_ids))
+
+    def add(self, user_id, track_id):
+        # nothing to update if the user's set isn't loaded, the next load reads it from the database
+        liked = self._sets.get(user_id)
+        if liked is not None:
+            liked.add(track_id)
+
+    def discard(self, user_id, track_id):
+        liked = self._sets.get(user_id)
+        if liked is not None:
+            liked.discard(track_id)
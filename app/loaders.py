@@ -0,0 +1,179 @@
+'''
+Request-scoped data loaders: an identity map plus batching for the entities routes look up by key.
+
+`loader(name)` returns the request's DataLoader for one kind of entity (kept on `flask.g`, so it lives exactly as
+long as the request). Every key is fetched at most once per request, and keys asked for together are fetched with
+one `JSON_TABLE` (id list) query instead of one query each:
+
+    profiles = loader("taste_profile").load_many([user_id] + friend_ids)     # one query for all of them
+
+`defer(key)` only queues the key and returns a handle; the first `.get()` on any handle loads every key queued so
+far in one batch, so a loop can ask for things one at a time and still cost a single query:
+
+    handles = [loader("track_artists").defer(t["track_id"]) for t in tracks]
+    for track, handle in zip(tracks, handles):
+        track["artists"] = handle.get()
+
+Results a page already has (e.g. from a `fan_out`) can be handed over with `prime()` so helpers further down
+don't select them again.
+'''
+import copy
+import json
+
+import numpy as np
+from flask import current_app, g
+
+from .features import FEATURE_COLUMNS, taste_profile_from_row
+from .statements import run
+
+
+class Deferred:
+    '''
+    A key queued on a DataLoader. `get()` loads it (together with everything else queued) on first use.
+    '''
+
+    def __init__(self, loader, key):
+        self.loader = loader
+        self.key = key
+
+    def get(self):
+        if self.key not in self.loader._cache:
+            self.loader.dispatch()
+        return self.loader._cache[self.key]
+
+
+class DataLoader:
+    '''
+    Memoizes `batch_load(keys) -> {key: value}` per key. Keys missing from the result map to `default`.
+    '''
+
+    def __init__(self, batch_load, key=None, default=None):
+        '''
+        :param batch_load: loads a list of (unique, uncached) keys, returns a dict of key -> value
+        :param key: optional key normalizer, e.g. int for ids that may arrive as form strings
+        :param default: value for keys `batch_load` returned nothing for (each key gets its own copy)
+        '''
+        self.batch_load = batch_load
+        self.key = key or (lambda k: k)
+        self.default = default
+        self.batches = 0
+        self._cache = {}
+        self._queue = []
+
+    def load(self, key):
+        return self.load_many([key])[0]
+
+    def load_many(self, keys) -> list:
+        keys = [self.key(k) for k in keys]
+        self._queue.extend(k for k in keys if k not in self._cache)
+        self.dispatch()
+        return [self._cache[k] for k in keys]
+
+    def defer(self, key) -> Deferred:
+        key = self.key(key)
+        if key not in self._cache:
+            self._queue.append(key)
+        return Deferred(self, key)
+
+    def dispatch(self):
+        '''
+        Loads every queued key in one `batch_load` call.
+        '''
+        keys = list(dict.fromkeys(k for k in self._queue if k not in self._cache))
+        self._queue = []
+        if not keys:
+            return
+        self.batches += 1
+        values = self.batch_load(keys)
+        for k in keys:
+            # a copy, so a caller appending to one missing key's list can't change what every other key gets
+            self._cache[k] = values[k] if k in values else copy.copy(self.default)
+
+    def prime(self, key, value):
+        self._cache[self.key(key)] = value
+
+    def clear(self, key):
+        self._cache.pop(self.key(key), None)
+
+
+# ---------- batch loaders ----------
+
+def _load_users(user_ids):
+    # user_id -> username
+    return {row["friend_id"]: row["username"] for row in run("users_by_ids", (json.dumps(user_ids),))}
+
+
+def _load_taste_profiles(user_ids):
+    # users without likes have no row and fall back to the zero vector (the loader default)
+    rows = run("taste_profiles_for_users", (json.dumps(user_ids),))
+    return {row["user_id"]: taste_profile_from_row(row) for row in rows}
+
+
+def _load_track_artists(track_ids):
+    # catalog data: shared across requests through the catalog cache, only the misses are queried (in one go)
+    cache = current_app.catalog_cache
+    cache.check_version(current_app.db)
+    names = {}
+    misses = []
+    for track_id in track_ids:
+        cached = cache.get(("track_artists", track_id))
+        if cached is None:
+            misses.append(track_id)
+        else:
+            names[track_id] = cached
+    if misses:
+        loaded = {track_id: [] for track_id in misses}
+        for row in run("track_artist_names_for_tracks", (json.dumps(misses),)):
+            loaded[row["track_id"]].append(row["name"])
+        for track_id, artist_names in loaded.items():
+            # unknown tracks get [] for this request but aren't cached, like get_or_load's None
+            if artist_names:
+                cache.put(("track_artists", track_id), artist_names)
+        names.update(loaded)
+    return names
+
+
+def _load_friends(user_ids):
+    # user_id -> [dict(user_id, username, date_befriended)], the "friends_with_dates" rows
+    ids = json.dumps(user_ids)
+    friends = {}
+    for row in run("friends_with_dates_for_users", (ids, ids)):
+        friends.setdefault(row.pop("owner_id"), []).append(row)
+    return friends
+
+
+def _load_friendships(pairs):
+    # (user_id1, user_id2) in stored order -> bool. a toggle pending in the write-behind queue wins
+    result = {}
+    unknown = []
+    for pair in pairs:
+        pending = current_app.write_behind.are_friends(*pair)
+        if pending is None:
+            unknown.append(pair)
+        else:
+            result[pair] = pending
+    if unknown:
+        found = run("friendships_for_pairs", (json.dumps(unknown),))
+        friends = {(row["user_id1"], row["user_id2"]) for row in found}
+        result.update((pair, pair in friends) for pair in unknown)
+    return result
+
+
+LOADERS = {
+    "user": dict(batch_load=_load_users, key=int),
+    "taste_profile": dict(batch_load=_load_taste_profiles, key=int,
+                          default=np.zeros(len(FEATURE_COLUMNS))),
+    "track_artists": dict(batch_load=_load_track_artists, default=[]),
+    "friends": dict(batch_load=_load_friends, key=int, default=[]),
+    "friendship": dict(batch_load=_load_friendships, key=lambda pair: tuple(sorted(map(int, pair))), default=False),
+}
+
+
+def loader(name) -> DataLoader:
+    '''
+    The current request's DataLoader for `name` (a key of LOADERS), created on first use.
+    '''
+    loaders = g.setdefault("loaders", {})
+    if name not in loaders:
+        loaders[name] = DataLoader(**LOADERS[name])
+    return loaders[name]
@@ -0,0 +1,467 @@
+'''
+In-process metrics, exposed at /metrics in the Prometheus text format.
+
+Metrics are module-level objects the instrumented code updates directly:
+
+    DB_QUERY_SECONDS.observe(elapsed, name, "sync")
+    with DASHBOARD_QUERY_SECONDS.time(desired_query):
+        ...
+
+Counters and histograms are sharded per thread: every thread only ever adds to its own shard, and a scrape sums the
+shards, so updating a metric takes no lock. Values owned by other objects (cache hit counts, pool sizes) are read by
+callbacks at scrape time instead of being copied on every update.
+
+Under gunicorn every worker has its own registry. With METRICS_DIR set, each worker writes its samples to
+`<METRICS_DIR>/<pid>.json` (at most every METRICS_WRITE_SECONDS, and when it exits), and whichever worker answers a
+scrape merges all the files: counters and histograms are summed and gauges of live workers get a `pid` label. The
+counters and histograms of exited workers are folded into one `aggregate.json` and their files deleted, so the
+totals never go backwards and the directory doesn't grow with every worker restart. The directory is emptied when
+the server starts, and each worker starts from zero (`reset()` after the fork).
+'''
+import bisect
+import json
+import os
+import time
+from contextlib import contextmanager
+from threading import get_ident
+
+from flask import Blueprint, Response, current_app, g, request
+
+try:
+    import fcntl
+except ImportError:  # no flock on Windows: merges aren't serialized between processes
+    fcntl = None
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _shard(shards, make):
+    # this thread's shard, created on its first update. only this thread writes to it
+    ident = get_ident()
+    shard = shards.get(ident)
+    if shard is None:
+        shard = shards[ident] = make()
+    return shard
+
+
+class _CounterChild:
+    __slots__ = ("_shards",)
+
+    def __init__(self):
+        self._shards = {}
+
+    def inc(self, amount=1.0):
+        _shard(self._shards, lambda: [0.0])[0] += amount
+
+    def samples(self, name):
+        yield name, sum(shard[0] for shard in list(self._shards.values()))
+
+
+class _HistogramChild:
+    __slots__ = ("_shards", "buckets")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._shards = {}
+
+    def observe(self, value):
+        # one count per bucket (made cumulative at scrape time) + the sum in the last slot
+        shard = _shard(self._shards, lambda: [0] * (len(self.buckets) + 1) + [0.0])
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def samples(self, name):
+        totals = [0] * (len(self.buckets) + 2)
+        for shard in list(self._shards.values()):
+            for i, value in enumerate(shard):
+                totals[i] += value
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), totals):
+            cumulative += count
+            yield f"{name}_bucket", cumulative, ("le", _format_bound(bound))
+        yield f"{name}_sum", totals[-1]
+        yield f"{name}_count", cumulative
+
+
+class Metric:
+    '''
+    A metric family: one child (time series) per combination of label values, created on first use.
+    '''
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def _make_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            # setdefault so two threads creating the same child end up sharing one
+            child = self._children.setdefault(values, self._make_child())
+        return child
+
+    def collect(self):
+        '''
+        Yields (sample name, labels dict, value).
+        '''
+        for values, child in list(self._children.items()):
+            for name, value, *extra in child.samples(self.name):
+                labels = dict(zip(self.labelnames, values))
+                labels.update(extra)
+                yield name, labels, value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _make_child(self):
+        return _CounterChild()
+
+    def inc(self, *labels, amount=1.0):
+        self.labels(*labels).inc(amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _make_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value, *labels):
+        self.labels(*labels).observe(value)
+
+    @contextmanager
+    def time(self, *labels):
+        '''
+        Observes how long the `with` block took. Blocks that raise aren't observed (an unknown dashboard query
+        shouldn't become a label).
+        '''
+        start = time.perf_counter()
+        yield
+        self.labels(*labels).observe(time.perf_counter() - start)
+
+
+class Callback(Metric):
+    '''
+    A counter or gauge whose value is read at scrape time: `fn()` returns a number, or a dict of label value tuple
+    -> number. Callbacks that fail (e.g. the object they read isn't set up) are skipped.
+    '''
+
+    def __init__(self, name, help, kind, fn, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+        self.fn = fn
+
+    def collect(self):
+        try:
+            values = self.fn()
+        except Exception:
+            return
+        if values is None:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in values.items():
+            yield self.name, dict(zip(self.labelnames, label_values)), value
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        # re-registering a name (create_app called again, e.g. in a test) replaces the old callback
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, kind, fn, labelnames=()):
+        return self.register(Callback(name, help, kind, fn, labelnames))
+
+    def reset(self):
+        '''
+        Drops every counter and histogram sample. A forked worker calls this first, so the samples of the preloaded
+        master (inherited with its memory) aren't reported again by every worker.
+        '''
+        for metric in list(self._metrics.values()):
+            if not isinstance(metric, Callback):
+                metric._children.clear()
+
+    def families(self):
+        '''
+        This process's metrics as JSON-friendly dicts: name, kind, help, samples [[sample name, labels, value]].
+        '''
+        return [{"name": metric.name, "kind": metric.kind, "help": metric.help,
+                 "samples": [[name, labels, value] for name, labels, value in metric.collect()]}
+                for metric in list(self._metrics.values())]
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Request latency by endpoint", ("endpoint", "method", "status"))
+DASHBOARD_QUERY_SECONDS = REGISTRY.histogram(
+    "dashboard_query_duration_seconds", "Dashboard query latency by desired_query", ("query",))
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "db_query_duration_seconds", "Registered statement latency, on the sync connection or the async pool",
+    ("statement", "connection"))
+DB_QUERY_ERRORS = REGISTRY.counter(
+    "db_query_errors_total", "Registered statements that raised", ("statement", "connection"))
+DB_POOL_WAIT_SECONDS = REGISTRY.histogram(
+    "db_pool_wait_seconds", "Time spent waiting for a connection from the async pool",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+DASHBOARD_RENDER_SECONDS = REGISTRY.histogram(
+    "dashboard_render_duration_seconds", "matplotlib rendering of the dashboard PNG",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+
+
+# ---------- exposition ----------
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(families):
+    '''
+    Prometheus text format (version 0.0.4) of `families` (see Registry.families).
+    '''
+    lines = []
+    for family in families:
+        if not family["samples"]:
+            continue
+        lines.append(f"# HELP {family['name']} {family['help']}")
+        lines.append(f"# TYPE {family['name']} {family['kind']}")
+        for name, labels, value in family["samples"]:
+            if labels:
+                label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_text}}} {_format_value(value)}")
+            else:
+                lines.append(f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------- multi-process ----------
+
+AGGREGATE_FILE = "aggregate.json"
+MERGE_LOCK_FILE = ".merge.lock"
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def write_process_file(directory):
+    '''
+    Writes this process's samples to `<directory>/<pid>.json`, replacing its previous file atomically.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    _write_json(os.path.join(directory, f"{os.getpid()}.json"), REGISTRY.families())
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # being replaced right now, or torn by a crash
+
+
+def _add_families(merged, families, pid=None):
+    # sums `families` into `merged` (family name -> family dict with samples keyed by (sample name, labels)).
+    # gauges are only kept for a live process, labelled with its pid
+    for family in families:
+        target = merged.setdefault(family["name"], dict(family, samples={}))
+        for name, labels, value in family["samples"]:
+            if family["kind"] == "gauge":
+                if pid is None:
+                    continue
+                labels = dict(labels, pid=str(pid))
+            key = (name, tuple(sorted(labels.items())))
+            if key in target["samples"]:
+                target["samples"][key][2] += value
+            else:
+                target["samples"][key] = [name, labels, value]
+
+
+def _as_families(merged):
+    return [dict(family, samples=list(family["samples"].values())) for family in merged.values()]
+
+
+def _fold_dead_processes(directory):
+    '''
+    Adds the files of exited processes to AGGREGATE_FILE and deletes them. The aggregate lists the files it has
+    absorbed until they are gone, so a crash between writing it and deleting them can't count them twice.
+    '''
+    aggregate_path = os.path.join(directory, AGGREGATE_FILE)
+    aggregate = _read_json(aggregate_path) or {"families": [], "folded": []}
+    already_folded = set(aggregate["folded"])
+
+    merged = {}
+    _add_families(merged, aggregate["families"])
+    folded = []
+    for filename in sorted(os.listdir(directory)):
+        if not _is_process_file(filename) or _alive(int(filename[:-len(".json")])):
+            continue
+        if filename not in already_folded:
+            families = _read_json(os.path.join(directory, filename))
+            if families is None:
+                continue
+            _add_families(merged, families)
+        folded.append(filename)
+    if not folded:
+        return
+
+    _write_json(aggregate_path, {"families": _as_families(merged), "folded": folded})
+    for filename in folded:
+        try:
+            os.remove(os.path.join(directory, filename))
+        except FileNotFoundError:
+            pass
+
+
+def _is_process_file(filename):
+    return filename.endswith(".json") and filename[:-len(".json")].isdigit()
+
+
+def merge_process_files(directory):
+    '''
+    The families of every process that wrote to `directory`, merged into one list (see the module docstring).
+    '''
+    lock_fd = os.open(os.path.join(directory, MERGE_LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        # one merge at a time, or two scrapes could fold the same exited worker into the aggregate twice
+        if fcntl is not None:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        _fold_dead_processes(directory)
+
+        merged = {}
+        aggregate = _read_json(os.path.join(directory, AGGREGATE_FILE))
+        if aggregate is not None:
+            _add_families(merged, aggregate["families"])
+        for filename in sorted(os.listdir(directory)):
+            if not _is_process_file(filename):
+                continue
+            families = _read_json(os.path.join(directory, filename))
+            if families is not None:
+                _add_families(merged, families, pid=int(filename[:-len(".json")]))
+        return _as_families(merged)
+    finally:
+        os.close(lock_fd)  # releases the flock
+
+
+def clear_directory(directory):
+    '''
+    Removes the process files left by a previous run of the server (gunicorn's `on_starting`).
+    '''
+    if not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        if filename.endswith((".json", ".tmp")):
+            os.remove(os.path.join(directory, filename))
+
+
+# ---------- Flask wiring ----------
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    directory = current_app.config['METRICS_DIR']
+    if directory:
+        write_process_file(directory)
+        families = merge_process_files(directory)
+    else:
+        families = REGISTRY.families()
+    return Response(render(families), mimetype="text/plain; version=0.0.4")
+
+
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+
+def _observe_request(response):
+    start = g.pop("request_start", None)
+    if start is not None:
+        # unmatched URLs share one label so random paths can't create new series
+        endpoint = request.endpoint if request.url_rule is not None else "<unmatched>"
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint, request.method, str(response.status_code))
+
+    directory = current_app.config['METRICS_DIR']
+    if directory:
+        now = time.monotonic()
+        if now - current_app.metrics_written_at >= current_app.config['METRICS_WRITE_SECONDS']:
+            current_app.metrics_written_at = now
+            try:
+                write_process_file(directory)
+            except OSError as e:
+                print(f"Could not write metrics to {directory}: {e}")
+    return response
+
+
+def init_app(app):
+    '''
+    Times every request, registers the scrape-time callbacks for the app's caches and pool, and adds /metrics.
+    Called by `create_app()`.
+    '''
+    app.metrics_written_at = 0.0
+    app.before_request(_start_timer)
+    app.after_request(_observe_request)
+
+    cache = app.catalog_cache
+    REGISTRY.callback("catalog_cache_requests_total", "Catalog cache lookups by result", "counter",
+                      lambda: {("hit",): cache.hits, ("miss",): cache.misses}, ("result",))
+    REGISTRY.callback("catalog_cache_evictions_total", "Catalog cache entries evicted for space", "counter",
+                      lambda: cache.evictions)
+    REGISTRY.callback("catalog_cache_bytes", "Estimated size of the catalog cache", "gauge",
+                      lambda: cache.size_bytes)
+    REGISTRY.callback("catalog_cache_entries", "Entries in the catalog cache", "gauge", lambda: len(cache))
+
+    liked = app.liked_tracks
+    REGISTRY.callback("liked_set_requests_total", "Liked-track set lookups by result (a miss loads the set)",
+                      "counter", lambda: {("hit",): liked.hits, ("miss",): liked.loads}, ("result",))
+    REGISTRY.callback("liked_set_evictions_total", "Liked-track sets evicted from the LRU", "counter",
+                      lambda: liked.evictions)
+
+    REGISTRY.callback("db_pool_connections", "Async pool connections (in use, open, max)", "gauge",
+                      lambda: app.async_db.usage() if app.async_db is not None else None, ("state",))
+
+    app.register_blueprint(metrics_bp)
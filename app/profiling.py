@@ -0,0 +1,175 @@
+'''
+Opt-in per-request profiling, for finding out where a slow request spends its time (SQL, NumPy, Python, matplotlib).
+
+A request is profiled when
+    - it carries the PROFILE_TOKEN, in an `X-Profile` header or a `profile` query parameter, or
+    - PROFILE_SAMPLE_RATE is N > 0 and it is picked at random 1 time in N (only for the PROFILE_ENDPOINTS).
+
+A profiled request runs under cProfile and, at the same time, a sampler thread that records the request thread's
+stack every PROFILE_INTERVAL_MS. Two files are written to PROFILE_DIR, named after the time, endpoint and pid:
+
+    <name>.pstats       # python -m pstats <file>, or snakeviz
+    <name>.collapsed    # one "frame;frame;frame count" line per stack: flamegraph.pl, speedscope, inferno
+
+The name is returned to the client in the X-Profile-Id header. Only the newest PROFILE_KEEP pairs are kept.
+
+With neither a token nor a sample rate configured, `init_app()` registers nothing, so requests pay nothing.
+'''
+import cProfile
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from flask import g, request
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+class StackSampler(threading.Thread):
+    '''
+    Records the stack of one thread every `interval` seconds until stopped, as collapsed stacks. The sampler only
+    runs when it gets the GIL, so a thread busy in pure Python is sampled about every `sys.getswitchinterval()`.
+    '''
+
+    def __init__(self, thread_id, interval=0.001):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def frame_label(frame):
+    code = frame.f_code
+    filename = code.co_filename
+    # project files relative to the root, libraries from their package down
+    if filename.startswith(str(PROJECT_ROOT)):
+        filename = os.path.relpath(filename, PROJECT_ROOT)
+    elif "site-packages" in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def write_collapsed(stacks, path):
+    with open(path, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+
+def prune(directory, keep):
+    # oldest first by name (names start with the time)
+    profiles = sorted(name for name in os.listdir(directory) if name.endswith(".pstats"))
+    for name in profiles[:max(0, len(profiles) - keep)]:
+        for suffix in (".pstats", ".collapsed"):
+            try:
+                os.remove(os.path.join(directory, name[:-len(".pstats")] + suffix))
+            except FileNotFoundError:
+                pass
+
+
+class RequestProfiler:
+    '''
+    The before/after/teardown request hooks, attached by `init_app()`.
+    '''
+
+    def __init__(self, directory, token=None, sample_rate=0, endpoints=(), interval=0.001, keep=200):
+        '''
+        :param directory: where profiles are written
+        :param token: secret that turns profiling on for one request (None: only sampling)
+        :param sample_rate: profile 1 in `sample_rate` requests to `endpoints` (0: only with the token)
+        :param endpoints: endpoint names sampling applies to, e.g. "main.home" (empty: all)
+        :param interval: seconds between stack samples
+        :param keep: how many profiles to keep
+        '''
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate
+        self.endpoints = set(endpoints)
+        self.interval = interval
+        self.keep = keep
+
+    def requested(self):
+        if self.token:
+            given = request.headers.get("X-Profile") or request.args.get("profile")
+            if given and hmac.compare_digest(given.encode("utf-8"), self.token.encode("utf-8")):
+                return True
+        if self.sample_rate > 0 and (not self.endpoints or request.endpoint in self.endpoints):
+            return random.randrange(self.sample_rate) == 0
+        return False
+
+    def start(self):
+        if not self.requested():
+            return
+        endpoint = (request.endpoint or "unmatched").replace(".", "_")
+        g.profile_name = f"{datetime.now():%Y%m%d-%H%M%S-%f}_{endpoint}_{os.getpid()}"
+        g.profile_started = time.perf_counter()
+        g.profile_sampler = StackSampler(threading.get_ident(), self.interval)
+        g.profile_sampler.start()
+        g.profile = cProfile.Profile()
+        g.profile.enable()
+
+    def add_header(self, response):
+        if "profile_name" in g:
+            response.headers["X-Profile-Id"] = g.profile_name
+        return response
+
+    def finish(self, exc=None):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return
+        profile.disable()
+        g.profile_sampler.stop()
+        elapsed_ms = (time.perf_counter() - g.profile_started) * 1000
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            base = os.path.join(self.directory, g.profile_name)
+            profile.dump_stats(base + ".pstats")
+            write_collapsed(g.profile_sampler.stacks, base + ".collapsed")
+            prune(self.directory, self.keep)
+            # the path only: the query string may hold the token
+            print(f"Profiled {request.method} {request.path} ({elapsed_ms:.0f} ms) -> {base}.pstats")
+        except OSError as e:
+            print(f"Could not write profile {g.profile_name}: {e}")
+
+
+def init_app(app):
+    '''
+    Registers the profiling hooks if PROFILE_TOKEN or PROFILE_SAMPLE_RATE is set. Called by `create_app()`.
+    '''
+    config = app.config
+    if not config['PROFILE_TOKEN'] and config['PROFILE_SAMPLE_RATE'] <= 0:
+        return
+
+    profiler = RequestProfiler(config['PROFILE_DIR'],
+                               token=config['PROFILE_TOKEN'],
+                               sample_rate=config['PROFILE_SAMPLE_RATE'],
+                               endpoints=config['PROFILE_ENDPOINTS'],
+                               interval=config['PROFILE_INTERVAL_MS'] / 1000,
+                               keep=config['PROFILE_KEEP'])
+    app.before_request(profiler.start)
+    app.after_request(profiler.add_header)
+    # teardown runs even when the view raised, so the profiler is always switched off
+    app.teardown_request(profiler.finish)
+    print(f"Request profiling on, writing to {config['PROFILE_DIR']}.")
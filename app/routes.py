@@ -1,13 +1,18 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify, current_app, abort
+from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify, current_app, abort, \
+    make_response
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from datetime import date
-import numpy as np
-from numpy.linalg import norm
-import random
-import matplotlib
-matplotlib.use('Agg')  # ADDED - > use non-GUI backend so it can render in Flask
-import matplotlib.pyplot as plt
+import base64
+import json
+
+from .loaders import loader
+from .statements import run
+from .async_db import fan_out
+from .similarity import get_compatibility, find_soulmate, find_platform_soulmate, recommend_friend, \
+    track_feature_vector, get_similar_tracks
+from .dashboard import dashboard_profile, create_dashboard, parse_friend_id
+from .metrics import DASHBOARD_QUERY_SECONDS
 
 bp = Blueprint('main', __name__, template_folder="templates")
 
@@ -37,19 +42,14 @@ def register():
         pfp_color = request.form['pfp_color']
 
         try:
-            cursor = current_app.db.cursor(dictionary=True)
             # user info insertion
             created_at = date.today().strftime("%Y-%m-%d")
-            query = "INSERT INTO Users (username, email, password_hash, created_at) VALUES (%s, %s, %s, %s)"
-            cursor.execute(query, (username, email, hashed_pw, created_at))
+            user_id = run("insert_user", (username, email, hashed_pw, created_at), fetch="none")
             current_app.db.commit()
             
             # preferences insertion
-            user_id = cursor.lastrowid
-            query_pref = "INSERT INTO Preferences (user_id, theme, pfp_color) VALUES (%s, %s, %s)"
-            cursor.execute(query_pref, (user_id, theme, pfp_color))
+            run("insert_preferences", (user_id, theme, pfp_color), fetch="none")
             current_app.db.commit()
-            cursor.close()
 
             return redirect(url_for('main.login'))
         except Exception as e:
@@ -73,14 +73,9 @@ def login():
         - password (str): the submitted, unhashed password
     '''
     if request.method == 'POST':
-        cursor = current_app.db.cursor(dictionary=True)
-
         username_or_email = request.form['username_or_email']
         password = request.form['password']
-        query = "SELECT * FROM Users WHERE username=%s OR email=%s"
-        cursor.execute(query, (username_or_email, username_or_email))
-        user = cursor.fetchone()
-        cursor.close()
+        user = run("user_by_login", (username_or_email, username_or_email), fetch="one")
         if user and check_password_hash(user['password_hash'], password):
             session['user_id'] = user['user_id']
             return redirect(url_for('main.home'))
@@ -94,15 +89,21 @@ def home():
     '''
     A user's home page that shows them their own information.
 
-    This always returns a list of liked songs (which are tuples in the list I think) and a list of friends.
+    This always returns the first page of the user's liked songs (newest like first) and friends, plus the cursors
+    of the next pages (None when there are no more), which the page lazy-loads from `/home/liked_songs` and
+    `/home/friends`. Only one page is ever queried and rendered, however long the user's history is.
     Upon receiving a POST from the page (such as one for computing friend compatibility or whatever), the appropriate
     queries will be run and returned (data attribute names tbd).
 
     Information expected from POST:
         - desired_query (str): data of the type input (i.e. a radio button) that describes the query we should run
         in the backend. The names of some queries that this expects are below:
-            - dashboard: the user dashboard of their listening insights
+            - dashboard: the user dashboard of their listening insights (server-rendered PNG, the no-JavaScript \
+            fallback of `radar`)
+            - radar: the data behind the dashboard chart, drawn in the browser (JSON API only)
+                - Optional `friend_id` attr. A friend whose profile is overlaid for comparison
             - soulmate: find musical soulmate or the most compatible friend
+            - platform_soulmate: find the most compatible listener on the whole platform (not just friends)
             - compatibility: calculate compatibility with a certain friend
                 - Requires `friend_id` attr. The friend with whom to calculate compatibility
             - genres: top 3 most liked to genres
@@ -110,7 +111,7 @@ def home():
             - obscurity: how obscure is their music taste
             - music_age: how "old" is their music
             - discovery: generate a discovery playlist for the user
-            - recommend_friend: recommend a friend of a friend based on similarity
+            - recommend_friend: recommend friends of friends, ranked by mutual friends and taste similarity
                 - Requires `friend_id` attr. The friend of whom to find a friend
 
     For full information on what each of the above possible desired queries sends to the frontend, read each query's
@@ -122,62 +123,135 @@ def home():
         return redirect(url_for('main.login'))
 
     user_id = session['user_id']
-    liked_songs = []
-    friends = []
-    
-    # find liked songs
-    query = "SELECT t.track_id, t.title, t.duration_ms, t.release_date FROM Tracks t JOIN TrackLikes tl ON t.track_id = tl.track_id WHERE tl.user_id = %s"
-    cursor = current_app.db.cursor(dictionary=True)
-    cursor.execute(query, (user_id,))
-    liked_songs = cursor.fetchall()
-    # find friends
-    query = "SELECT u.user_id, u.username, f.date_befriended FROM Users u " \
-            "JOIN Friendships f ON" \
-            "(u.user_id = f.user_id1 AND f.user_id2 = %s) OR (u.user_id = f.user_id2 AND f.user_id1 = %s)"
-    cursor.execute(query, (user_id, user_id))
-    friends = cursor.fetchall()
-    cursor.close()
+    page_size = current_app.config['HOME_PAGE_SIZE']
+
+    # first page of liked songs and friends (independent, so run concurrently). one extra row tells if there's more
+    liked_rows, friend_rows = fan_out(("liked_songs_first_page", (user_id, page_size + 1)),
+                                      ("friends_page", friends_page_params(user_id, 0, page_size + 1)))
+    liked_songs, liked_cursor = paginate(liked_rows, page_size, liked_song_cursor)
+    friends, friends_cursor = paginate(friend_rows, page_size, friend_cursor)
+    if friends_cursor is None:
+        # that's all of them: dashboard helpers below reuse the friend list instead of selecting it again
+        loader("friends").prime(user_id, friends)
 
     dashboard_result = []
     dashboard_description = "TODO"
     query_type = None
+    form_error = None
     if request.method == 'POST':
+        # without JavaScript the form posts here; home.html normally fetches the result from the JSON API instead
         desired_query = request.form['desired_query']
         query_type = dashboard_result
+        try:
+            friend_id = parse_friend_id(request.form.get('friend_id'))
+        except ValueError:
+            form_error = "The friend id must be a number."
+        else:
+            dashboard_result = run_dashboard_query(desired_query, friend_id)
+
+    response = make_response(render_template('home.html',
+                                             liked_songs=liked_songs,
+                                             liked_cursor=liked_cursor,
+                                             friends=friends,
+                                             friends_cursor=friends_cursor,
+                                             query_type=query_type,
+                                             dashboard_result=dashboard_result,
+                                             dashboard_description=dashboard_description,
+                                             form_error=form_error))
+    if request.method == 'GET':
+        # the base page only changes when the user's likes or friends do: let the browser revalidate it
+        response.add_etag()
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response = response.make_conditional(request)
+    return response
+
+
+@bp.route('/home/liked_songs')
+def more_liked_songs():
+    '''
+    The next page of the home page's liked songs, as table rows (fragment). Expects the `cursor` of the previous
+    page; the cursor of the page after this one is sent in the X-Next-Cursor header (empty on the last page).
+    '''
+    if 'user_id' not in session:
+        abort(401)
+
+    liked_at, track_id = decode_cursor(request.args.get('cursor', ''), 2)
+    page_size = current_app.config['HOME_PAGE_SIZE']
+    rows = run("liked_songs_next_page", (session['user_id'], liked_at, liked_at, track_id, page_size + 1))
+    liked_songs, cursor = paginate(rows, page_size, liked_song_cursor)
+
+    response = make_response(render_template('_liked_song_rows.html', liked_songs=liked_songs))
+    response.headers['X-Next-Cursor'] = cursor or ""
+    return response
+
+
+@bp.route('/home/friends')
+def more_friends():
+    '''
+    The next page of the home page's friends, as table rows (fragment). Same cursor protocol as `more_liked_songs`.
+    '''
+    if 'user_id' not in session:
+        abort(401)
+
+    (after_id,) = decode_cursor(request.args.get('cursor', ''), 1)
+    if not isinstance(after_id, int):
+        abort(400)
+    page_size = current_app.config['HOME_PAGE_SIZE']
+    rows = run("friends_page", friends_page_params(session['user_id'], after_id, page_size + 1))
+    friends, cursor = paginate(rows, page_size, friend_cursor)
+
+    response = make_response(render_template('_friend_rows.html', friends=friends))
+    response.headers['X-Next-Cursor'] = cursor or ""
+    return response
+
+
+def run_dashboard_query(desired_query: str, friend_id=None):
+    '''
+    Runs one of the dashboard queries listed in `home`'s docstring for the logged in user. Shared by the /home
+    form and the JSON API (see api.py). Aborts with 404 for an unknown query and 400 for a non-numeric `friend_id`
+    (both callers check it first to show their own error).
+
+    :param desired_query: the query name, e.g. "artists"
+    :param friend_id: the friend for "compatibility" and "radar", an int or a string of one
+    :returns: the query's result (see each query function's docstring)
+    '''
+    try:
+        friend_id = parse_friend_id(friend_id)
+    except ValueError:
+        abort(400)
+
+    # unknown queries abort, so only the known ones become labels
+    with DASHBOARD_QUERY_SECONDS.time(desired_query):
         match desired_query:
             case "artists":
-                dashboard_result = top_3_artists()
+                return top_3_artists()
             case "genres":
-                dashboard_result = top_3_genres()
+                return top_3_genres()
             case "discovery":
-                dashboard_result = create_discovery_playlist()
+                return create_discovery_playlist()
             case "soulmate":
-                dashboard_result = find_soulmate()
+                return find_soulmate()
+            case "platform_soulmate":
+                return find_platform_soulmate()
             case "compatibility":
-                # expects the id of the friend to calculate compatibility with to be passed in POST
-                friend = request.form.get('friend_id')
-                if friend:
-                    dashboard_result = round(get_compatibility(friend), 1)  # round to 1 decimal place
-                else:
-                    dashboard_result = "No friend selected."
+                # expects the id of the friend to calculate compatibility with
+                if friend_id:
+                    return round(get_compatibility(friend_id), 1)  # round to 1 decimal place
+                return "No friend selected."
             case "recommend_friend":
-                dashboard_result = recommend_friend()
+                return recommend_friend()
             case "dashboard":
-                dashboard_result = create_dashboard()
+                return create_dashboard()
+            case "radar":
+                # optional friend to overlay
+                return dashboard_profile(friend_id)
             case "obscurity":
-                dashboard_result = calculate_obscurity()
+                return calculate_obscurity()
             case "music_age":
-                dashboard_result = calculate_music_age()
+                return calculate_music_age()
             case _:
                 abort(404)
 
-    return render_template('home.html',
-                           liked_songs=liked_songs,
-                           friends=friends,
-                           query_type=query_type,
-                           dashboard_result=dashboard_result,
-                           dashboard_description=dashboard_description)
-
 
 @bp.route('/search', methods=['GET', 'POST'])
 def search():
@@ -215,7 +289,8 @@ def search():
                 'track_id': int, 
                 'title': str, 
                 'artist_name': str, 
-                'duration': int (seconds)
+                'duration': int (seconds),
+                'liked': bool (whether the user has liked the track)
             }
         ]
     '''
@@ -234,7 +309,7 @@ def search():
             tracks = []
             artists = []
         elif track_keyword and track_keyword != "":
-            tracks = search_tracks(track_keyword, artist_keyword if artist_keyword else "")
+            tracks = mark_liked(session['user_id'], search_tracks(track_keyword, artist_keyword if artist_keyword else ""))
             users = []
             if artist_keyword and artist_keyword != "":
                 artists = search_artists(artist_keyword)
@@ -309,7 +384,6 @@ def user_page(user_id):
             }
         ]
     '''
-    cursor = current_app.db.cursor(dictionary=True)
     self_id = session['user_id']
 
     user_id1, user_id2 = sorted([self_id, user_id])
@@ -319,38 +393,26 @@ def user_page(user_id):
         add_friend = request.form.get('add_friend', 'false').lower() == 'true'
         
         # if friendship already exists
-        cursor.execute(
-            "SELECT * FROM Friendships WHERE user_id1=%s AND user_id2=%s",
-            (user_id1, user_id2)
-        )
-        exists = cursor.fetchone()
+        exists = loader("friendship").load((user_id1, user_id2))
 
+        # queued for the next group commit (app/write_behind.py), the in-memory graph is updated right away
         if add_friend and not exists:
-            cursor.execute(
-                "INSERT INTO Friendships (user_id1, user_id2, date_befriended) VALUES (%s, %s, CURDATE())",
-                (user_id1, user_id2)
-            )
+            current_app.write_behind.befriend(user_id1, user_id2)
+            current_app.friend_graph.add_edge(user_id1, user_id2)
         elif not add_friend and exists:
             # delete
-            cursor.execute(
-                "DELETE FROM Friendships WHERE user_id1=%s AND user_id2=%s",
-                (user_id1, user_id2)
-            )
-        current_app.db.commit()
+            current_app.write_behind.unfriend(user_id1, user_id2)
+            current_app.friend_graph.remove_edge(user_id1, user_id2)
+        # the page below sees the new state without selecting it again
+        loader("friendship").prime((user_id1, user_id2), add_friend)
 
-    cursor.execute(
-        "SELECT * FROM Friendships WHERE user_id1=%s AND user_id2=%s",
-        (user_id1, user_id2)
-    )
-    is_friends = cursor.fetchone() is not None
-
-    page_data = user_page_data(user_id)
+    page_data = user_page_data(user_id, viewer_id=self_id)
 
     return render_template('user.html',
                            user=page_data["user_info"],
                            liked_tracks=page_data["liked_tracks"],
                            friends=page_data["friends"],
-                           is_friends=is_friends)
+                           is_friends=page_data["is_friends"])
 
 
 @bp.route('/track/<track_id>', methods=['GET', 'POST'])
@@ -388,7 +450,8 @@ def track_page(track_id):
         similar_tracks = [
             {
                 track_id: int,
-                title: str
+                title: str,
+                liked: bool
             }
         ]
     '''
@@ -404,68 +467,83 @@ def track_page(track_id):
         liked = request.form.get("liked")
         similar_tracks = request.form.get("similar_tracks")
 
-        cursor = current_app.db.cursor(dictionary=True)
-
+        # likes and comments are acknowledged right away and written in the next group commit
         if comment != "":
-            # insert comment from user
-            today = date.today().strftime('%Y-%m-%d')
-            insert_comment_query = """
-                INSERT INTO Comments (user_id, track_id, content, created_at)
-                VALUES (%s, %s, %s, %s)
-            """
-            cursor.execute(insert_comment_query, (user_id, track_id, comment, today))
-            current_app.db.commit()
+            # insert comment from user (the username is only for showing it before it is written)
+            user = run("user_info", (user_id,), fetch="one")
+            current_app.write_behind.comment(user_id, track_id, comment, username=user["username"] if user else None)
         if liked:
             # update tracklikes (if the user hasn't liked yet, add it. but if they have liked it, then remove the like)
-            check_like_query = """
-                SELECT 1
-                FROM TrackLikes
-                WHERE user_id = %s AND track_id = %s
-            """
-            cursor.execute(check_like_query, (user_id, track_id))
-            already_liked = cursor.fetchone() is not None
+            already_liked = has_liked(user_id, track_id)
 
             if already_liked:
                 # unlike
-                unlike_query = """
-                    DELETE FROM TrackLikes
-                    WHERE user_id = %s AND track_id = %s
-                """
-                cursor.execute(unlike_query, (user_id, track_id))
+                current_app.write_behind.unlike(user_id, track_id)
+                current_app.liked_tracks.discard(user_id, track_id)
             else:
                 # add like
-                today = date.today().strftime('%Y-%m-%d')
-                like_query = """
-                    INSERT INTO TrackLikes (user_id, track_id, liked_at)
-                    VALUES (%s, %s, %s)
-                """
-                cursor.execute(like_query, (user_id, track_id, today))
-            
-            current_app.db.commit()
+                current_app.write_behind.like(user_id, track_id)
+                current_app.liked_tracks.add(user_id, track_id)
+
+            # keep the user's row of the taste matrix current without rebuilding it
+            if current_app.user_embeddings.loaded:
+                current_app.user_embeddings.update(user_id, track_feature_vector(track_id),
+                                                   sign=-1 if already_liked else 1)
         if similar_tracks:
             # find 10 similar tracks
-            top_10 = get_similar_tracks(track_id)
-
-    # see if user has liked the track
-    cursor = current_app.db.cursor(dictionary=True)
-    cursor.execute(
-        "SELECT * FROM TrackLikes WHERE user_id = %s AND track_id = %s",
-        (user_id, track_id)
-    )
-    has_liked = cursor.fetchone() is not None
-        
+            top_10 = mark_liked(user_id, get_similar_tracks(track_id))
+
     page_data = track_page_data(track_id)
 
     return render_template('track.html',
                            track=page_data["track_info"],
                            comments=page_data["comments"],
                            similar_tracks=top_10,
-                           has_liked=has_liked)
+                           has_liked=page_data["track_info"]["liked"])
 
 ########################################################
 #        Helper functions for complex queries          #
 ########################################################
 
+def encode_cursor(*values) -> str:
+    '''
+    Opaque, URL-safe pagination cursor holding the sort key of the last row of a page.
+    '''
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> list:
+    '''
+    The values of a cursor made by `encode_cursor`. Aborts with 400 if it isn't a cursor of `size` values.
+    '''
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        abort(400)
+    if not isinstance(values, list) or len(values) != size:
+        abort(400)
+    return values
+
+def paginate(rows: list, page_size: int, cursor_of):
+    '''
+    Splits `page_size + 1` fetched rows into the page and the cursor of the next one (None if this is the last).
+
+    :param cursor_of: row -> cursor string for the page after that row
+    '''
+    if len(rows) <= page_size:
+        return rows, None
+    page = rows[:page_size]
+    return page, cursor_of(page[-1])
+
+def liked_song_cursor(row) -> str:
+    return encode_cursor(str(row["liked_at"]), row["track_id"])
+
+def friend_cursor(row) -> str:
+    return encode_cursor(row["user_id"])
+
+def friends_page_params(user_id: int, after_id: int, limit: int) -> tuple:
+    # each side of the union is limited too, so neither reads more than one page
+    return (user_id, after_id, limit, user_id, after_id, limit, limit)
+
 def search_users(keyword: str):
     '''
     Searches for users with `keyword` in their name. Limits search results to first 10 results.
@@ -479,30 +557,9 @@ def search_users(keyword: str):
     '''
 
     CURRENT_USER_ID = session['user_id']
-    cursor = current_app.db.cursor(dictionary=True)
-
-    query = """
-    SELECT 
-        u.user_id,
-        u.username,
-        CASE
-            WHEN f.user_id1 IS NOT NULL OR f.user_id2 IS NOT NULL THEN TRUE
-            ELSE FALSE
-        END AS friend
-    FROM Users u
-    LEFT JOIN Friendships f
-        ON (f.user_id1 = %s AND f.user_id2 = u.user_id)
-        OR (f.user_id2 = %s AND f.user_id1 = u.user_id)
-    WHERE u.username LIKE %s
-      AND u.user_id != %s
-    ORDER BY friend DESC, u.username ASC
-    LIMIT 10;
-    """
     search_term = f"%{keyword}%"
 
-    cursor.execute(query, (CURRENT_USER_ID, CURRENT_USER_ID, search_term, CURRENT_USER_ID))
-    result = cursor.fetchall()
-    cursor.close()
+    result = run("search_users", (CURRENT_USER_ID, CURRENT_USER_ID, search_term, CURRENT_USER_ID))
 
     return result
 
@@ -519,30 +576,10 @@ def search_tracks(track_keyword: str, artist_keyword: str):
     ms in the database to seconds in the returned variable.
     '''
 
-    cursor = current_app.db.cursor(dictionary=True)
-    base_query = """
-        SELECT
-            t.track_id,
-            t.title,
-            a.name AS artist_name,
-            t.duration_ms
-        FROM Tracks t
-        JOIN TrackArtists ta ON t.track_id = ta.track_id
-        JOIN Artists a ON ta.artist_id = a.artist_id
-        WHERE t.title LIKE %s
-    """
-
-    params = [f"%{track_keyword}%"]
-
     if artist_keyword:
-        base_query += " AND a.name LIKE %s"
-        params.append(f"%{artist_keyword}%")
-
-    base_query += "ORDER BY t.popularity LIMIT 10"
-
-    cursor.execute(base_query, tuple(params))
-    result = cursor.fetchall()
-    cursor.close()
+        result = run("search_tracks_by_artist", (f"%{track_keyword}%", f"%{artist_keyword}%"))
+    else:
+        result = run("search_tracks", (f"%{track_keyword}%",))
 
     # convert ms to secs for readability in frontend
     for r in result:
@@ -560,22 +597,8 @@ def search_artists(keyword: str):
     :returns result: List[dict[artist_id: int, name: str, popularity: int]]
     '''
 
-    cursor = current_app.db.cursor(dictionary=True)
-    query = """
-        SELECT 
-            artist_id,
-            name,
-            popularity
-        FROM Artists
-        WHERE name LIKE %s
-        ORDER BY popularity DESC;
-    """
-
     like_pattern = f"%{keyword}%"
-    cursor.execute(query, (like_pattern,))
-
-    result = cursor.fetchall()
-    cursor.close()
+    result = run("search_artists", (like_pattern,))
 
     return result
 
@@ -583,6 +606,7 @@ def artist_page_data(artist_id: int):
     '''
     Returns all the data needed to construct an artist page in the frontend.
     Only returns the 100 most popular songs of the artist.
+    This is all static catalog data, so the whole result is served from the catalog cache when possible.
     
     :param artist_id: the id of the artist for whom to make a page
     :type artist_id: int
@@ -591,127 +615,108 @@ def artist_page_data(artist_id: int):
         popularity: int]
     '''
 
-    cursor = current_app.db.cursor(dictionary=True)
+    return current_app.catalog_cache.get_or_load(("artist", artist_id),
+                                                 lambda: load_artist_page_data(artist_id),
+                                                 current_app.db)
+
+def load_artist_page_data(artist_id: int):
+    '''
+    Queries the database for `artist_page_data`. Returns None if the artist doesn't exist.
+    '''
 
-    artist_query = """
-        SELECT name, popularity
-        FROM Artists
-        WHERE artist_id = %s;
-    """
-    cursor.execute(artist_query, (artist_id,))
-    artist = cursor.fetchone()
+    artist = run("artist_info", (artist_id,), fetch="one")
 
     if not artist:
-        cursor.close()
         return None
 
     # Get tracks by this artist
-    tracks_query = """
-        SELECT 
-            t.track_id,
-            t.title,
-            t.duration_ms,
-            t.explicit
-        FROM Tracks t
-        JOIN TrackArtists ta ON t.track_id = ta.track_id
-        WHERE ta.artist_id = %s
-        ORDER BY t.popularity DESC
-        LIMIT 100;
-    """
-
-    cursor.execute(tracks_query, (artist_id,))
-    tracks = cursor.fetchall()
+    tracks = run("artist_top_tracks", (artist_id,))
 
     for track in tracks:
         track["duration"] = track.pop("duration_ms") // 1000
 
-    cursor.close()
-
     return {
         "artist_info": artist,
         "tracks": tracks
     }
 
-def user_page_data(user_id: int):
+def user_page_data(user_id: int, viewer_id: int = None):
     '''
     Returns all data needed to contrsuct a user's page (a general user not the current user).
+    The user info, liked tracks and friends queries are independent and run concurrently.
     
     :param user_id: the id of the user for whom to make a page
     :type user_id: int
+    :param viewer_id: the id of the user looking at the page. If given, `is_friends` is filled in.
+    :type viewer_id: int
 
     :returns data: dict[username: str, pfp_color: str, liked_tracks: List[dict[track_id, title, duration (secs), \
-        artists: List[name: str]]], friends: List[dict[friend_id, friend_name]]]
+        artists: List[name: str]]], friends: List[dict[friend_id, friend_name]], is_friends: bool]
     '''
 
-    cursor = current_app.db.cursor(dictionary=True)
-
-    # base user info
-    user_query = """
-        SELECT u.username, p.pfp_color
-        FROM Users u
-        LEFT JOIN Preferences p ON u.user_id = p.user_id
-        WHERE u.user_id = %s;
-    """
-    cursor.execute(user_query, (user_id,))
-    user = cursor.fetchone()
+    user, liked_tracks, friends = fan_out(("user_info", (user_id,), "one"),
+                                         ("user_liked_tracks", (user_id,)),
+                                         ("user_friends", (user_id, user_id)))
+    # memoized for the request, so right after a friend toggle this is not selected again
+    is_friends = viewer_id is not None and loader("friendship").load((viewer_id, user_id))
 
     if not user:
-        cursor.close()
         return None
 
-
-    # get liked tracks
-    liked_tracks_query = """
-        SELECT
-            t.track_id,
-            t.title,
-            t.duration_ms
-        FROM TrackLikes tl
-        JOIN Tracks t ON tl.track_id = t.track_id
-        WHERE tl.user_id = %s;
-    """
-
-    cursor.execute(liked_tracks_query, (user_id,))
-    liked_tracks = cursor.fetchall()
-
-    # for each liked track, get all of its artists
-    for track in liked_tracks:
-        artist_query = """
-            SELECT a.name
-            FROM Artists a
-            JOIN TrackArtists ta ON a.artist_id = ta.artist_id
-            WHERE ta.track_id = %s;
-        """
-        cursor.execute(artist_query, (track["track_id"],))
-        artists = cursor.fetchall()
-
-        track["artists"] = [artist["name"] for artist in artists]
-
+    # for each liked track, get all of its artists (catalog cache, the misses in one query)
+    artists = [loader("track_artists").defer(track["track_id"]) for track in liked_tracks]
+    for track, track_artists in zip(liked_tracks, artists):
+        track["artists"] = track_artists.get()
         track["duration"] = track.pop("duration_ms") // 1000
 
-    friends_query = """
-        SELECT 
-            u.user_id AS friend_id,
-            u.username AS friend_name
-        FROM Friendships f
-        JOIN Users u 
-            ON (u.user_id = f.user_id1 AND f.user_id2 = %s)
-            OR (u.user_id = f.user_id2 AND f.user_id1 = %s);
-    """
-    cursor.execute(friends_query, (user_id, user_id))
-    friends = cursor.fetchall()
-
-    cursor.close()
-
     return {
         "user_info": user,
         "liked_tracks": liked_tracks,
-        "friends": friends
+        "friends": friends,
+        "is_friends": is_friends
     }
 
+def has_liked(user_id: int, track_id) -> bool:
+    '''
+    Whether the user has liked the track, including a like/unlike still waiting in this process's write-behind
+    queue. Read from the database, not the liked-track set: the set can be up to `max_age` old for likes made
+    through another worker, and the like toggle must not apply the same like twice.
+    '''
+
+    pending = current_app.write_behind.liked(user_id, track_id)
+    if pending is not None:
+        return pending
+    return run("user_liked_track", (user_id, track_id), fetch="one") is not None
+
+def mark_liked(user_id: int, tracks: list) -> list:
+    '''
+    Sets `liked` on every track dict in `tracks` (from the user's liked-track set, no queries) and returns them.
+    For display only, the set may lag likes made through other workers by up to its `max_age`.
+    '''
+
+    flags = current_app.liked_tracks.contains_many(user_id, [t["track_id"] for t in tracks])
+    for track, liked in zip(tracks, flags.tolist()):
+        pending = current_app.write_behind.liked(user_id, track["track_id"])
+        track["liked"] = pending if pending is not None else liked
+    return tracks
+
+def load_track_info(track_id: int):
+    '''
+    Queries the shared (viewer-independent) part of a track page. Returns None if the track doesn't exist.
+    '''
+
+    track = run("track_info", (track_id,), fetch="one")
+
+    if not track:
+        return None
+
+    track["duration"] = track.pop("duration_ms") // 1000
+    return track
+
 def track_page_data(track_id: int):
     '''
     Returns all data needed to construct a track page (just comments and general track info really).
+    The track metadata comes from the catalog cache; `liked` is looked up per viewer and merged into a copy.
     
     :param track_id: the id of the track for which to make a page
     :type track_id: int
@@ -721,52 +726,19 @@ def track_page_data(track_id: int):
     '''
 
     user_id = session["user_id"]
-    cursor = current_app.db.cursor(dictionary=True)
-
-    # Get base track info
-    track_query = """
-        SELECT
-            t.title,
-            t.release_date,
-            t.duration_ms,
-            t.explicit,
-            t.key_signature,
-            t.popularity,
-            EXISTS (
-                SELECT 1
-                FROM TrackLikes tl
-                WHERE tl.track_id = t.track_id
-                AND tl.user_id = %s
-            ) AS liked
-        FROM Tracks t
-        WHERE t.track_id = %s;
-    """
-    cursor.execute(track_query, (user_id, track_id,))
-    track = cursor.fetchone()
 
-    if not track:
-        cursor.close()
+    shared = current_app.catalog_cache.get_or_load(("track", track_id),
+                                                   lambda: load_track_info(track_id),
+                                                   current_app.db)
+    if not shared:
         return None
 
-    track["duration"] = track.pop("duration_ms") // 1000
-
-
-    # Get comments
-    comments_query = """
-        SELECT
-            u.username,
-            c.content,
-            c.created_at
-        FROM Comments c
-        JOIN Users u ON c.user_id = u.user_id
-        WHERE c.track_id = %s
-        ORDER BY c.created_at DESC;
-    """
+    # per-viewer bits are never cached
+    track = dict(shared)
+    track["liked"] = has_liked(user_id, track_id)
 
-    cursor.execute(comments_query, (track_id,))
-    comments = cursor.fetchall()
-
-    cursor.close()
+    # Get comments (the viewer's own comments may still be queued for writing)
+    comments = current_app.write_behind.pending_comments(track_id) + run("track_comments", (track_id,))
 
     return {
         "track_info": track,
@@ -789,24 +761,7 @@ def top_3_artists():
     '''
 
     user_id = session['user_id']
-    cursor = current_app.db.cursor(dictionary=True)
-
-    query = """
-        SELECT 
-            a.artist_id,
-            a.name AS artist_name,
-            COUNT(tl.track_id) AS like_count
-        FROM TrackLikes tl
-        JOIN TrackArtists ta ON tl.track_id = ta.track_id
-        JOIN Artists a ON ta.artist_id = a.artist_id
-        WHERE tl.user_id = %s
-        GROUP BY a.artist_id, a.name
-        ORDER BY like_count DESC
-        LIMIT 3;
-    """
-
-    cursor.execute(query, (user_id,))
-    results = cursor.fetchall()
+    results = run("top_artists", (user_id,))
 
     return results
 
@@ -824,29 +779,7 @@ def top_3_genres():
     '''
 
     user_id = session["user_id"]
-    cursor = current_app.db.cursor(dictionary=True)
-
-    query = """
-    SELECT 
-        g.genre_name,
-        COUNT(tl.track_id) AS like_count
-    FROM TrackLikes tl
-    JOIN Tracks t ON tl.track_id = t.track_id
-    JOIN ArtistGenres ag ON ag.artist_id = (
-        SELECT ta.artist_id
-        FROM TrackArtists ta
-        WHERE ta.track_id = t.track_id
-        LIMIT 1
-    )
-    JOIN Genres g ON ag.genre_id = g.genre_id
-    WHERE tl.user_id = %s
-    GROUP BY g.genre_id, g.genre_name
-    ORDER BY like_count DESC
-    LIMIT 3;
-    """
-
-    cursor.execute(query, (user_id,))
-    return cursor.fetchall()
+    return run("top_genres", (user_id,))
 
 def calculate_obscurity():
     '''
@@ -857,17 +790,7 @@ def calculate_obscurity():
     '''
 
     user_id = session["user_id"]
-    cursor = current_app.db.cursor(dictionary=True)
-
-    query = """
-        SELECT AVG(t.popularity) AS avg_popularity
-        FROM TrackLikes tl
-        JOIN Tracks t ON tl.track_id = t.track_id
-        WHERE tl.user_id = %s;
-    """
-
-    cursor.execute(query, (user_id,))
-    row = cursor.fetchone()
+    row = run("avg_liked_popularity", (user_id,), fetch="one")
 
     if not row or row["avg_popularity"] is None:
         return 0.0  # no liked tracks
@@ -883,350 +806,13 @@ def calculate_music_age():
     '''
 
     user_id = session["user_id"]
-    cursor = current_app.db.cursor(dictionary=True)
-
-    query = """
-        SELECT AVG(YEAR(CURDATE()) - YEAR(t.release_date)) AS avg_age
-        FROM TrackLikes tl
-        JOIN Tracks t ON tl.track_id = t.track_id
-        WHERE tl.user_id = %s
-        AND t.release_date IS NOT NULL;
-    """
-
-    cursor.execute(query, (user_id,))
-    row = cursor.fetchone()
+    row = run("avg_liked_age", (user_id,), fetch="one")
 
     if not row or row["avg_age"] is None:
         return 0  # no liked songs
 
     return int(round(row["avg_age"]))
 
-FEATURE_RANGES = {
-    "mode": (0,1),
-    "danceability": (0, 1),
-    "energy": (0, 1),
-    "loudness": (-60, 5.4),
-    "speechiness": (0, 1),
-    "acousticness": (0, 1),
-    "instrumentalness": (0, 1),
-    "liveness": (0, 1),
-    "valence": (0, 1),
-    "tempo": (0, 246)
-}
-
-def normalize_feature(value, min_val, max_val):
-    """Required for features not on 0-1 scale for comparability."""
-    if value is None:
-        return 0.0
-    try:
-        v = float(value)
-    except (TypeError, ValueError):
-        # edge case -> 0
-        v = 0.0
-    return (v - min_val) / (max_val - min_val)
-
-FEATURE_COLUMNS = [
-    "mode",
-    "danceability",
-    "energy",
-    "valence",
-    "tempo",
-    "acousticness",
-    "instrumentalness",
-    "liveness",
-    "speechiness",
-    "loudness"
-]
-
-def get_taste_profile(user_id: int) -> np.array:
-    '''
-    Returns the user's "taste profile", computed as the average of the following
-    attributes over all tracks they have liked:
-    [mode, danceability, energy, loudness, speechiness, acousticness,
-     instrumentalness, liveness, valence, tempo]
-
-    :returns: a vector of the average value of characteristic track attributes.
-    :rtype: np.array
-    '''
-
-    cursor = current_app.db.cursor(dictionary=True)
-
-    query = """
-        SELECT
-            AVG(t.mode)                AS mode,
-            AVG(t.danceability)        AS danceability,
-            AVG(t.energy)              AS energy,
-            AVG(t.loudness)            AS loudness,
-            AVG(t.speechiness)         AS speechiness,
-            AVG(t.acousticness)        AS acousticness,
-            AVG(t.instrumentalness)    AS instrumentalness,
-            AVG(t.liveness)            AS liveness,
-            AVG(t.valence)             AS valence,
-            AVG(t.tempo)               AS tempo
-        FROM TrackLikes tl
-        JOIN Tracks t ON tl.track_id = t.track_id
-        WHERE tl.user_id = %s;
-    """
-
-    cursor.execute(query, (user_id,))
-    row = cursor.fetchone()
-    cursor.close()
-
-    if not row or all(v is None for v in row.values()):
-        # no liked tracks
-        return np.zeros(11)
-
-    # final vector
-    taste_vector = np.array([
-        row["mode"],
-        row["danceability"],
-        row["energy"],
-        row["loudness"],
-        row["speechiness"],
-        row["acousticness"],
-        row["instrumentalness"],
-        row["liveness"],
-        row["valence"],
-        row["tempo"]
-    ], dtype=float)
-
-    normalized = []
-    # normalize features for comparability
-    for feature, value in zip(FEATURE_COLUMNS, taste_vector):
-        min_v, max_v = FEATURE_RANGES[feature]
-        normalized.append(normalize_feature(value, min_v, max_v))
-
-    return normalized
-
-def cos_sim(x1: np.array, x2: np.array) -> float:
-    '''
-    Computes the cosine similarity of x1 and x2. 0 = no similarity, 1 = same norm. 
-    It will always fall between 0 and 1 here because the features in Tracks are all non-negative.
-    '''
-    denom = norm(x1) * norm(x2)
-    if denom == 0:  # check for div by zero errors
-        return 0
-    
-    return np.dot(x1, x2) / denom
-
-def get_compatibility(friend_id: int) -> float:
-    '''
-    Docstring for get_compatibility
-    
-    :param friend_id: The id of the friend with whom to test your compatibility
-    :type friend_id: int
-    :return: the "percent" compatibile. .45 corresponds to 45% compatible.
-    :rtype: float
-    '''
-    user_id = session["user_id"]
-    user_profile = get_taste_profile(user_id)
-    friend_profile = get_taste_profile(friend_id)
-    sim = cos_sim(user_profile, friend_profile)
-
-    return sim
-
-def find_soulmate():
-    '''
-    Computes compatibility with all friends and just returns the friend with the highest.
-
-    :returns results: dict[friend_id: int, username: str]
-    '''
-    
-    user_id = session["user_id"]
-    cursor = current_app.db.cursor(dictionary=True)
-
-    # get all friends
-    query = """
-        SELECT 
-            u.user_id AS friend_id,
-            u.username
-        FROM Friendships f
-        JOIN Users u ON (
-            (f.user_id1 = %s AND f.user_id2 = u.user_id)
-            OR
-            (f.user_id2 = %s AND f.user_id1 = u.user_id)
-        )
-    """
-    cursor.execute(query, (user_id, user_id))
-    friends = cursor.fetchall()
-
-    if not friends:
-        return {}  # has no friends
-
-    # find most compatible friend
-    best_friend = None
-    best_score = -1
-
-    for friend in friends:
-        friend_id = friend["friend_id"]
-        score = get_compatibility(friend_id)
-
-        if score > best_score:
-            best_score = score
-            best_friend = friend
-
-    return best_friend if best_friend else {}
-
-def recommend_friend():
-    '''
-    Recommend a friend of a friend that the user is not currently friends with. Looks through every friend of every \
-    friend the user currently has (and goes no deeper. Walk = length 2), and finds the user with the highest \
-    compatibility to the user. This is deterministic. The answer won't change unless the user befriends the first \
-    result and asks for another recommendation.
-
-    :returns result: {friend_id: int, username: str}
-    '''
-
-    cursor = current_app.db.cursor(dictionary=True)
-    user_id = session["user_id"]
-    
-    # current friends
-    cursor.execute("""
-        SELECT 
-            CASE 
-                WHEN user_id1 = %s THEN user_id2
-                ELSE user_id1
-            END AS friend_id
-        FROM Friendships
-        WHERE user_id1 = %s OR user_id2 = %s
-    """, (user_id, user_id, user_id))
-
-    direct_friends = {row["friend_id"] for row in cursor.fetchall()}
-
-    if not direct_friends:
-        return None  # no friends so not recommendations
-
-    direct_friends.add(user_id)  # prevent self-recommendation
-
-    # find friends of friends
-    placeholder = ",".join(["%s"] * len(direct_friends))
-
-    query = f"""
-        SELECT DISTINCT
-            CASE
-                WHEN user_id1 IN ({placeholder}) THEN user_id2
-                ELSE user_id1
-            END AS foaf_id
-        FROM Friendships
-        WHERE user_id1 IN ({placeholder}) OR user_id2 IN ({placeholder})
-    """
-
-    cursor.execute(query, tuple(direct_friends) * 3)
-    candidates = {row["foaf_id"] for row in cursor.fetchall()}
-
-    # remove direct friends + self
-    candidates = candidates - direct_friends
-
-    if not candidates:
-        return None
-
-    best_id = None
-    best_score = -1
-
-    for candidate_id in candidates:
-        score = get_compatibility(candidate_id)
-        if score > best_score:
-            best_score = score
-            best_id = candidate_id
-
-    if best_id is None:
-        return None
-
-    cursor.execute("""
-        SELECT user_id AS friend_id, username
-        FROM Users
-        WHERE user_id = %s
-    """, (best_id,))
-
-    return cursor.fetchone()
-
-def get_track_vector(cursor, track_id):
-    cols = ", ".join(FEATURE_COLUMNS)
-    cursor.execute(f"""
-        SELECT {cols}
-        FROM Tracks
-        WHERE track_id = %s
-    """, (track_id,))
-
-    row = cursor.fetchone()
-
-    if row:
-        normalized = []
-        # normalize features for comparability
-        for feature, value in zip(FEATURE_COLUMNS, row):
-            min_v, max_v = FEATURE_RANGES[feature]
-            normalized.append(normalize_feature(value, min_v, max_v))
-    else:
-        return None
-
-    return normalized
-
-def get_random_sample(cursor, sample_size):
-    cols = ", ".join(["track_id", "title"] + FEATURE_COLUMNS)
-
-    cursor.execute(f"""
-        SELECT {cols}
-        FROM Tracks
-        ORDER BY RAND()
-        LIMIT %s
-    """, (sample_size,))
-
-    return cursor.fetchall()
-
-def get_similar_tracks(track_id, sample_size=2000, top_k=50, return_n=10):
-    '''
-    Non-deterministically finds `return_n` (Default 10) songs that are similar to `track_id` using cosine similarity \
-    between vectors of the musical features of tracks. Samples 2000 songs, finds the top `top_k` that this track is \
-    similar to, then returns a random 10 songs from these 50 (default for `top_k`).
-    
-    :param track_id: the id of the track for which to find similar songs
-    :param sample_size: the size of the random sample from our database to test similarity against
-    :param top_k: the size of the sample of songs that are similar to track_id from which to sample the final 10
-    :param return_n: the final amount of similar songs to return
-
-    :returns results: the top `return_n` similar songs to this track. List[dict[track_id: int, title: str]]
-    '''
-
-    cursor = current_app.db.cursor(dictionary=True)
-
-    target_vector = get_track_vector(cursor, track_id)
-
-    if not target_vector:
-        cursor.close()
-        raise ValueError(f"Track {track_id} not found.")
-
-    # random sample of tracks to compare against
-    sample = get_random_sample(cursor, sample_size)
-
-    similarities = []
-
-    for row in sample:
-        sid = row['track_id']
-        stitle = row['title']
-
-        # skip self
-        if sid == track_id:
-            continue
-
-        normalized = []
-        # row is a dict (because of dictionary=True), so pull values by feature name
-        for feature in FEATURE_COLUMNS:
-            value = row[feature]
-            min_v, max_v = FEATURE_RANGES[feature]
-            normalized.append(normalize_feature(value, min_v, max_v))
-
-        sim = cos_sim(target_vector, normalized)
-        similarities.append((sid, stitle, sim))
-
-    # sort by similarity and get the top_k songs then randomly draw return_n
-    similarities.sort(key=lambda x: x[2], reverse=True)
-    top_candidates = similarities[:top_k]
-    final_selection = random.sample(top_candidates, min(return_n, len(top_candidates)))
-
-    cursor.close()
-
-    return [{"track_id": track_id, "title": title} for track_id, title, _ in final_selection]
-
 def create_discovery_playlist():
     '''
     Creates a collection of 20 songs that are from genres that the user has not liked before.
@@ -1244,130 +830,11 @@ def create_discovery_playlist():
     '''
 
     user_id = session["user_id"]
-    cursor = current_app.db.cursor(dictionary=True)
 
     # genres the user has liked
-    cursor.execute(
-        '''
-        SELECT DISTINCT ag.genre_id
-        FROM TrackLikes tl
-        JOIN TrackArtists ta ON tl.track_id = ta.track_id
-        JOIN ArtistGenres ag ON ta.artist_id = ag.artist_id
-        WHERE tl.user_id = %s
-        ''',
-        (user_id,)
-    )
-
-    excluded_genres = [row["genre_id"] for row in cursor.fetchall()]
-
-    # if user hasn't liked anything
-    if not excluded_genres:
-        genre_filter = ""
-        params = []
-    else:
-        placeholders = ", ".join(["%s"] * len(excluded_genres))
-        genre_filter = f"WHERE ag.genre_id NOT IN ({placeholders})"
-        params = excluded_genres
-
-    # look for 20 songs with optimized randomization
-    query = f'''
-        SELECT
-            t.track_id,
-            t.title,
-            GROUP_CONCAT(DISTINCT a.name SEPARATOR ', ') AS artists
-        FROM Tracks t
-        JOIN TrackArtists ta ON t.track_id = ta.track_id
-        JOIN Artists a ON ta.artist_id = a.artist_id
-        JOIN ArtistGenres ag ON a.artist_id = ag.artist_id
-        {genre_filter}
-          AND t.track_id >= (
-            SELECT FLOOR(
-                (SELECT MIN(track_id) FROM Tracks) +
-                RAND() * (
-                    (SELECT MAX(track_id) FROM Tracks) -
-                    (SELECT MIN(track_id) FROM Tracks)
-                )
-            )
-        )
-        GROUP BY t.track_id
-        LIMIT 20;
-    '''
+    excluded_genres = [row["genre_id"] for row in run("liked_genre_ids", (user_id,))]
 
-    cursor.execute(query, params)
-    results = cursor.fetchall()
+    # look for 20 songs with optimized randomization. an empty list (user hasn't liked anything) excludes nothing
+    results = run("discovery_tracks", (json.dumps(excluded_genres),))
 
     return results
-
-def create_dashboard():
-    '''
-    Generates a radar/web plot of the musical attributes the user most listens to.
-    This web plot has 8 variables which are the features in the FEATURE_COLUMNS variable. (i.e. danceability, valence)
-    If the user's theme in the Preferences table is 'light', axes are black and bg is white. If 'dark', \
-        use a black bg and white axes. The color of the web itself is #1DB954 (spotify green).
-
-    Stores the figure as a png in the static/ folder.
-    Returns name of the file in the static folder.
-    '''
-
-    user_id = session["user_id"]
-    cursor = current_app.db.cursor(dictionary=True)
-
-    # theme preference
-    cursor.execute("""
-        SELECT theme
-        FROM Preferences
-        WHERE user_id = %s
-    """, (user_id,))
-    result = cursor.fetchone()
-    theme = result["theme"] if result and result["theme"] else "dark"
-
-    # average liked track features
-    feature_columns_str = ", ".join([f"AVG(t.{col}) AS {col}" for col in FEATURE_COLUMNS])
-
-    query = f"""
-        SELECT {feature_columns_str}
-        FROM TrackLikes tl
-        JOIN Tracks t ON tl.track_id = t.track_id
-        WHERE tl.user_id = %s
-    """
-
-    cursor.execute(query, (user_id,))
-    averages = cursor.fetchone()
-    if not averages:
-        return None
-
-    values = [averages[col] for col in FEATURE_COLUMNS]
-
-    num_vars = len(FEATURE_COLUMNS)
-    angles = np.linspace(0, 2 * np.pi, num_vars, endpoint=False).tolist()
-    values += values[:1]
-    angles += angles[:1]
-    labels = FEATURE_COLUMNS + [FEATURE_COLUMNS[0]]
-
-    if theme == "dark":
-        bg_color   = "#191414"
-        axis_color = "white"
-    else:
-        bg_color   = "white"
-        axis_color = "#191414"
-
-    fig, ax = plt.subplots(figsize=(6, 6), subplot_kw=dict(polar=True))
-    fig.patch.set_facecolor(bg_color)
-    ax.set_facecolor(bg_color)
-    ax.spines['polar'].set_color(axis_color)
-    ax.tick_params(colors=axis_color)
-    ax.xaxis.label.set_color(axis_color)
-    ax.yaxis.label.set_color(axis_color)
-    plt.xticks(angles[:-1], FEATURE_COLUMNS, color=axis_color)
-    ax.plot(angles, values, color="#1DB954", linewidth=2)
-    ax.fill(angles, values, color="#1DB954", alpha=0.25)
-    ax.set_ylim(0, 1)
-
-    filename = f"dashboard_{user_id}.png"
-    filepath = current_app.root_path + "/static/" + filename
-
-    plt.tight_layout()
-    plt.savefig(filepath, dpi=200, transparent=False)
-    plt.close()
-
-    return filename
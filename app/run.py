@@ -1,3 +1,4 @@
+# development server. production: `gunicorn app.wsgi:app` (see gunicorn.conf.py)
 from app import create_app
 
 app = create_app()
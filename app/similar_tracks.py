@@ -0,0 +1,309 @@
+'''
+Precomputed "similar tracks" lists for the whole catalog.
+
+A batch job (meant to run nightly, after the catalog snapshot is refreshed) computes the `top_k` nearest
+neighbours by cosine similarity of every track in the CURRENT catalog snapshot. The feature matrix is scaled to
+unit rows once, then split into row blocks that the engine (engine.py) hands to a process pool. Each block is
+multiplied against column chunks of the shared matrix (block @ chunk.T), keeping a running top-k per row, and
+the results are written into memory-mapped output arrays as they come back.
+
+Runs are incremental: lists of tracks already in the previous run are carried over and only merged with the
+tracks added since, and only new tracks get a full scan. Too many removed tracks (or --full) forces a rebuild.
+
+Layout of SNAPSHOT_DIR/similar_tracks/:
+
+    CURRENT                 # name of the active run, swapped atomically
+    <name>/
+        meta.json           # source catalog snapshot, top_k, counts
+        track_ids.npy       # sorted track ids (S32), row i of the arrays below is track_ids[i]
+        neighbours.npy      # int32 (tracks x top_k), indices into track_ids, most similar first, -1 = none
+        scores.npy          # float32 (tracks x top_k), cosine similarity of each neighbour
+
+The track page memory-maps the CURRENT run and serves neighbours with no compute at request time.
+
+Usage (from the project root):
+    python -m app.similar_tracks build [--full] [--workers N]
+'''
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from .catalog import TRACK_ID_DTYPE
+from .engine import chunk_bounds, map_reduce, merge_top_k
+from .snapshot import (CatalogSnapshot, DEFAULT_SNAPSHOT_DIR, SnapshotError, _lookup, _prune,
+                       current_snapshot_path, publish_current)
+
+SIMILAR_TRACKS_FORMAT_VERSION = 1
+META_FILE = "meta.json"
+TOP_K = 50
+ROW_BLOCK = 1024          # rows per job
+COLUMN_CHUNK = 16384      # columns multiplied at once, ROW_BLOCK x COLUMN_CHUNK float32 = 64MB per worker
+MAX_REMOVED_FRACTION = 0.05  # rebuild from scratch if more tracks than this disappeared since the last run
+
+
+def default_directory(snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, "similar_tracks")
+
+
+def _unit_rows(features):
+    features = np.asarray(features, dtype=np.float32)
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    return np.divide(features, norms, out=np.zeros_like(features), where=norms > 0)
+
+
+def _neighbour_kernel(arrays, start, end, top_k, merge):
+    '''
+    Engine kernel: the top_k neighbours of tracks arrays["rows"][start:end] among arrays["columns"] (every track if
+    absent), merged with their current lists in arrays["scores"]/arrays["neighbours"] if `merge`.
+
+    :returns: (rows, neighbour indices, scores)
+    '''
+    unit = arrays["unit"]
+    rows = np.asarray(arrays["rows"][start:end])
+    columns = arrays.get("columns")
+    block = unit[rows]
+    if merge:
+        best = (np.array(arrays["scores"][rows]), np.array(arrays["neighbours"][rows]))
+    else:
+        best = (np.full((len(rows), top_k), -np.inf, dtype=np.float32),
+                np.full((len(rows), top_k), -1, dtype=np.int32))
+
+    keep_best = merge_top_k(top_k)
+    n_columns = len(unit) if columns is None else len(columns)
+    for chunk_start, chunk_end in chunk_bounds(n_columns, COLUMN_CHUNK):
+        if columns is None:
+            chunk = np.arange(chunk_start, chunk_end, dtype=np.int32)
+            sims = block @ unit[chunk_start:chunk_end].T
+        else:
+            chunk = np.asarray(columns[chunk_start:chunk_end], dtype=np.int32)
+            sims = block @ unit[chunk].T
+
+        # a track is not its own neighbour (rows and chunk are both sorted)
+        pos = np.searchsorted(chunk, rows)
+        hit = pos < len(chunk)
+        hit[hit] = chunk[pos[hit]] == rows[hit]
+        sims[np.nonzero(hit)[0], pos[hit]] = -np.inf
+
+        best = keep_best(best, (sims, np.broadcast_to(chunk, sims.shape)))
+
+    scores, neighbours = best
+    neighbours = np.where(np.isfinite(scores), neighbours, -1).astype(np.int32)
+    return rows, neighbours, scores.astype(np.float32)
+
+
+def build_similar_tracks(catalog, directory, top_k=TOP_K, workers=None, full=False):
+    '''
+    Computes (or incrementally updates) the neighbour lists for `catalog` and publishes them as the CURRENT run.
+
+    :param catalog: a CatalogSnapshot
+    :param directory: the similar_tracks directory (see default_directory)
+    :param workers: size of the process pool, defaults to os.cpu_count(). 1 runs everything in this process.
+    :param full: ignore the previous run and recompute every list
+    :returns: the name of the new run (or of the CURRENT one if it is already up to date)
+    '''
+    started = time.perf_counter()
+    previous = None
+    previous_path = current_snapshot_path(directory)
+    if previous_path and not full:
+        try:
+            previous = SimilarTracks(previous_path)
+        except (OSError, ValueError, KeyError, SnapshotError) as e:
+            print(f"Ignoring previous similar tracks run {previous_path}: {e}")
+
+    if previous is not None and previous.meta["source_snapshot"] == catalog.name and previous.top_k == top_k:
+        print(f"Similar tracks already computed for snapshot {catalog.name}.")
+        return previous.name
+
+    track_ids = catalog.tracks.track_ids
+    n = len(track_ids)
+    name = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    os.makedirs(directory, exist_ok=True)
+    tmp_dir = os.path.join(directory, f".{name}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    np.save(os.path.join(tmp_dir, "track_ids.npy"), np.asarray(track_ids))
+    neighbours_path = os.path.join(tmp_dir, "neighbours.npy")
+    scores_path = os.path.join(tmp_dir, "scores.npy")
+    neighbours = np.lib.format.open_memmap(neighbours_path, mode="w+", dtype=np.int32, shape=(n, top_k))
+    scores = np.lib.format.open_memmap(scores_path, mode="w+", dtype=np.float32, shape=(n, top_k))
+    neighbours[:] = -1
+    scores[:] = -np.inf
+
+    all_rows = np.arange(n, dtype=np.int64)
+    mode = "full"
+    if previous is not None and previous.top_k == top_k:
+        new_index = _lookup(track_ids, np.asarray(previous.track_ids))  # old row -> new row, -1 if removed
+        removed = int((new_index < 0).sum())
+        if removed <= MAX_REMOVED_FRACTION * len(new_index):
+            mode = "incremental"
+            kept = new_index >= 0
+            old_neighbours = np.asarray(previous.neighbours)[kept]
+            carried = np.where(old_neighbours >= 0, new_index[np.maximum(old_neighbours, 0)], -1)
+            carried_scores = np.where(carried >= 0, np.asarray(previous.scores)[kept], -np.inf)
+            order = np.argsort(-carried_scores, axis=1, kind="stable")
+            neighbours[new_index[kept]] = np.take_along_axis(carried, order, axis=1)
+            scores[new_index[kept]] = np.take_along_axis(carried_scores, order, axis=1).astype(np.float32)
+        else:
+            print(f"{removed} tracks removed since the last run, recomputing everything.")
+    neighbours.flush()
+    scores.flush()
+
+    def write(done, partial):
+        # runs in this process as results arrive; every chunk covers different rows
+        rows, chunk_neighbours, chunk_scores = partial
+        neighbours[rows] = chunk_neighbours
+        scores[rows] = chunk_scores
+        if (done + len(rows)) // (ROW_BLOCK * 50) > done // (ROW_BLOCK * 50):
+            print(f"  {done + len(rows)} rows done...")
+        return done + len(rows)
+
+    unit = _unit_rows(catalog.tracks.features)
+    if mode == "incremental":
+        is_new = np.ones(n, dtype=bool)
+        is_new[new_index[new_index >= 0]] = False
+        new_rows, old_rows = all_rows[is_new], all_rows[~is_new]
+        print(f"Incremental run: {len(new_rows)} new tracks, {len(old_rows)} existing.")
+        if len(new_rows):
+            # existing tracks only need comparing against the new ones, merged into their carried-over lists
+            map_reduce(_neighbour_kernel, {"unit": unit, "rows": old_rows, "columns": new_rows,
+                                           "neighbours": neighbours_path, "scores": scores_path},
+                       n_rows=len(old_rows), chunk_rows=ROW_BLOCK, reduce=write, initial=0,
+                       args=(top_k, True), workers=workers)
+            map_reduce(_neighbour_kernel, {"unit": unit, "rows": new_rows},
+                       n_rows=len(new_rows), chunk_rows=ROW_BLOCK, reduce=write, initial=0,
+                       args=(top_k, False), workers=workers)
+    else:
+        new_rows = all_rows
+        print(f"Full run over {n} tracks.")
+        map_reduce(_neighbour_kernel, {"unit": unit, "rows": all_rows},
+                   n_rows=n, chunk_rows=ROW_BLOCK, reduce=write, initial=0,
+                   args=(top_k, False), workers=workers)
+    neighbours.flush()
+    scores.flush()
+    del neighbours, scores
+
+    meta = {
+        "format_version": SIMILAR_TRACKS_FORMAT_VERSION,
+        "name": name,
+        "source_snapshot": catalog.name,
+        "top_k": top_k,
+        "tracks": n,
+        "new_tracks": int(len(new_rows)),
+        "mode": mode,
+        "created_at": datetime.now().isoformat(timespec="seconds")
+    }
+    with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    os.replace(tmp_dir, os.path.join(directory, name))
+    publish_current(directory, name)
+    _prune(directory, keep=name, marker=META_FILE)
+
+    print(f"Similar tracks {name} written ({mode}, {n} tracks, top {top_k}) "
+          f"in {time.perf_counter() - started:.1f}s")
+    return name
+
+
+class SimilarTracks:
+    '''
+    A loaded (memory-mapped) run of precomputed neighbour lists.
+    '''
+
+    def __init__(self, path):
+        with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format_version") != SIMILAR_TRACKS_FORMAT_VERSION:
+            raise SnapshotError(f"Similar tracks {path} has format version {self.meta.get('format_version')}, "
+                                f"expected {SIMILAR_TRACKS_FORMAT_VERSION}")
+        self.path = path
+        self.name = self.meta["name"]
+        self.top_k = self.meta["top_k"]
+
+        def load(file_name):
+            return np.load(os.path.join(path, f"{file_name}.npy"), mmap_mode="r")
+
+        self.track_ids = load("track_ids")
+        self.neighbours = load("neighbours")
+        self.scores = load("scores")
+        if self.neighbours.shape != (len(self.track_ids), self.top_k):
+            raise SnapshotError(f"Similar tracks {path} has mismatched array shapes")
+
+    def neighbours_of(self, track_id, top_k=None):
+        '''
+        Track ids of the `top_k` (default: all stored) most similar tracks to `track_id`, most similar first.
+        Empty if the track isn't in this run.
+        '''
+        i = _lookup(self.track_ids, np.array([track_id.encode("utf-8")], dtype=TRACK_ID_DTYPE))[0]
+        if i < 0:
+            return []
+        row = self.neighbours[i, :top_k or self.top_k]
+        return [self.track_ids[j].decode("utf-8") for j in row if j >= 0]
+
+
+class LazySimilarTracks:
+    '''
+    Attached to the app by `create_app()`, same pattern as LazySnapshot: nothing is opened until the first `get()`
+    and CURRENT is re-read at most every `check_interval` seconds to pick up the nightly run.
+    '''
+
+    def __init__(self, directory, check_interval=30.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._similar = None
+        self._path = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        '''
+        Returns the SimilarTracks, or None if the batch job hasn't run yet.
+        '''
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return self._similar
+
+        with self._lock:
+            self._last_check = now
+            path = current_snapshot_path(self.directory)
+            if path and path != self._path:
+                try:
+                    self._similar = SimilarTracks(path)
+                    self._path = path
+                    print(f"Attached similar tracks {self._similar.name}.")
+                except (OSError, ValueError, KeyError, SnapshotError) as e:
+                    print(f"Could not load similar tracks {path}: {e}")
+            return self._similar
+
+
+def main(argv):
+    from dotenv import load_dotenv
+
+    load_dotenv(os.path.join(os.path.dirname(DEFAULT_SNAPSHOT_DIR), ".env"))
+    parser = argparse.ArgumentParser(prog="python -m app.similar_tracks")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--full", action="store_true", help="recompute every list instead of updating")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: all cores)")
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    args = parser.parse_args(argv[1:])
+
+    snapshot_dir = os.getenv("SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR)
+    path = current_snapshot_path(snapshot_dir)
+    if not path:
+        print(f"No catalog snapshot in {snapshot_dir}, run `python -m app.snapshot export` first.")
+        return 1
+
+    build_similar_tracks(CatalogSnapshot(path), default_directory(snapshot_dir),
+                         top_k=args.top_k, workers=args.workers, full=args.full)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,259 @@
+'''
+Taste and track similarity: cosine similarity of taste profiles (compatibility, soulmates, friend recommendations)
+and of track feature vectors (similar tracks). Used by the routes and the dashboard queries; split out of
+routes.py so the NumPy work lives in one importable module.
+'''
+import json
+import random
+import time
+
+import numpy as np
+from flask import current_app, session
+from numpy.linalg import norm
+
+from .features import normalize_row, normalize_rows
+from .loaders import loader
+from .statements import run
+
+
+def get_taste_profile(user_id: int) -> np.array:
+    '''
+    Returns the user's "taste profile", computed as the average of the normalized
+    musical attributes (in FEATURE_COLUMNS order) over all tracks they have liked.
+
+    :returns: a vector of the average value of characteristic track attributes.
+    :rtype: np.array
+    '''
+
+    return loader("taste_profile").load(user_id)
+
+
+def get_taste_profiles(user_ids) -> list:
+    '''
+    `get_taste_profile` for several users at once, in one query (profiles already loaded in this request are reused).
+
+    :returns: list of taste profiles, in the same order as `user_ids`.
+    '''
+    return loader("taste_profile").load_many(user_ids)
+
+
+def cos_sim(x1: np.array, x2: np.array) -> float:
+    '''
+    Computes the cosine similarity of x1 and x2. 0 = no similarity, 1 = same norm. 
+    It will always fall between 0 and 1 here because the features in Tracks are all non-negative.
+    '''
+    denom = norm(x1) * norm(x2)
+    if denom == 0:  # check for div by zero errors
+        return 0
+    
+    return np.dot(x1, x2) / denom
+
+
+def get_compatibility(friend_id: int) -> float:
+    '''
+    Docstring for get_compatibility
+    
+    :param friend_id: The id of the friend with whom to test your compatibility
+    :type friend_id: int
+    :return: the "percent" compatibile. .45 corresponds to 45% compatible.
+    :rtype: float
+    '''
+    user_id = session["user_id"]
+    user_profile, friend_profile = get_taste_profiles([user_id, friend_id])
+    sim = cos_sim(user_profile, friend_profile)
+
+    return sim
+
+
+def find_soulmate():
+    '''
+    Computes compatibility with all friends and just returns the friend with the highest.
+
+    :returns results: dict[friend_id: int, username: str]
+    '''
+    
+    user_id = session["user_id"]
+
+    # get all friends (already loaded if /home just listed them)
+    friends = [{"friend_id": f["user_id"], "username": f["username"]} for f in loader("friends").load(user_id)]
+
+    if not friends:
+        return {}  # has no friends
+
+    # find most compatible friend. all profiles are fetched in one batch
+    user_profile, *friend_profiles = get_taste_profiles([user_id] + [f["friend_id"] for f in friends])
+    best_friend = None
+    best_score = -1
+
+    for friend, friend_profile in zip(friends, friend_profiles):
+        score = cos_sim(user_profile, friend_profile)
+
+        if score > best_score:
+            best_score = score
+            best_friend = friend
+
+    return best_friend if best_friend else {}
+
+
+def find_platform_soulmate():
+    '''
+    Finds the most compatible listener on the whole platform, friends or not, using the users x features taste matrix
+    (one matrix-vector product instead of one taste profile query per user).
+
+    :returns results: dict[friend_id: int, username: str, compatibility: float] or {} if the user has no likes
+    '''
+
+    user_id = session["user_id"]
+    matches = current_app.user_embeddings.get().most_similar(user_id, k=1)
+    if not matches:
+        return {}
+
+    match_id, score = matches[0]
+    username = loader("user").load(match_id)
+    if username is None:
+        return {}
+
+    return {"friend_id": match_id, "username": username, "compatibility": round(score, 3)}
+
+
+def recommend_friend(top_n=5, prefilter=200, chunk_size=50, budget_ms=None):
+    '''
+    Recommends friends of friends that the user is not currently friends with, ranked best first. Only looks at \
+    friends of friends (walk = length 2).
+
+    Candidates come from the in-memory friend graph together with their mutual friend count. Only the `prefilter` \
+    candidates with the most mutual friends are scored by taste compatibility, in chunks of `chunk_size` with one \
+    query per chunk. If scoring runs past `budget_ms` (default: the RECOMMEND_BUDGET_MS config), the remaining \
+    candidates are left unscored and ranked by mutual friends after the scored ones instead of failing the request.
+
+    :returns result: List[dict[friend_id: int, username: str, mutual_friends: int, compatibility: float or None]] \
+    of up to `top_n` users, or None if there is nobody to recommend. `compatibility` is None for unscored candidates.
+    '''
+
+    user_id = session["user_id"]
+    budget_ms = budget_ms if budget_ms is not None else current_app.config['RECOMMEND_BUDGET_MS']
+    deadline = time.perf_counter() + budget_ms / 1000
+
+    # friends of friends, excluding direct friends + self, straight from the in-memory adjacency
+    candidates, mutual_counts = current_app.friend_graph.get().friends_of_friends(user_id)
+
+    if len(candidates) == 0:
+        return None  # no friends (or no friends of friends) so no recommendations
+
+    # keep the `prefilter` best connected candidates, most mutual friends first
+    if len(candidates) > prefilter:
+        top = np.argpartition(-mutual_counts, prefilter - 1)[:prefilter]
+        candidates, mutual_counts = candidates[top], mutual_counts[top]
+    order = np.lexsort((candidates, -mutual_counts))
+    candidates, mutual_counts = candidates[order].tolist(), mutual_counts[order].tolist()
+
+    # score by taste similarity until we run out of candidates or time
+    user_profile = get_taste_profile(user_id)
+    scores = {}
+    for start in range(0, len(candidates), chunk_size):
+        if time.perf_counter() > deadline:
+            break
+        chunk = candidates[start:start + chunk_size]
+        # users without likes get the zero profile, so no compatibility
+        for candidate_id, profile in zip(chunk, loader("taste_profile").load_many(chunk)):
+            scores[candidate_id] = float(cos_sim(user_profile, profile))
+
+    # scored candidates first (by compatibility, then mutual friends), then unscored ones by mutual friends
+    mutual = dict(zip(candidates, mutual_counts))
+    ranked = sorted(candidates,
+                    key=lambda c: (c in scores, scores.get(c, 0.0), mutual[c]),
+                    reverse=True)[:top_n]
+
+    users = dict(zip(ranked, loader("user").load_many(ranked)))
+
+    return [{
+        "friend_id": candidate_id,
+        "username": users.get(candidate_id),
+        "mutual_friends": mutual[candidate_id],
+        "compatibility": round(scores[candidate_id], 3) if candidate_id in scores else None
+    } for candidate_id in ranked]
+
+
+def get_track_vector(track_id):
+    '''
+    Normalized feature vector (FEATURE_COLUMNS order) of a track, or None if the track doesn't exist.
+    '''
+    row = run("track_vector", (track_id,), fetch="one")
+    return normalize_row(row) if row else None
+
+
+def track_feature_vector(track_id):
+    '''
+    Normalized feature vector of a track, from the catalog snapshot if one is attached, else from the database.
+    '''
+    snapshot = current_app.catalog.get()
+    if snapshot is not None:
+        i = snapshot.tracks.index_of(track_id)
+        if i >= 0:
+            return np.array(snapshot.tracks.features[i], dtype=np.float64)
+    return get_track_vector(track_id)
+
+
+def get_random_sample(sample_size):
+    return run("random_tracks", (sample_size,))
+
+
+def get_track_titles(track_ids):
+    '''
+    Titles of `track_ids`, from the catalog snapshot if one is attached, else from the database.
+
+    :returns results: List[dict[track_id: str, title: str]] in the order of `track_ids` (unknown ids are skipped)
+    '''
+    snapshot = current_app.catalog.get()
+    if snapshot is not None:
+        indices = snapshot.tracks.indices_of(track_ids)
+        return [{"track_id": tid, "title": snapshot.tracks.title(i)} for tid, i in zip(track_ids, indices) if i >= 0]
+
+    titles = {row["track_id"]: row["title"] for row in run("track_titles", (json.dumps(track_ids),))}
+    return [{"track_id": tid, "title": titles[tid]} for tid in track_ids if tid in titles]
+
+
+def get_similar_tracks(track_id, sample_size=2000, top_k=50, return_n=10):
+    '''
+    Non-deterministically finds `return_n` (Default 10) songs that are similar to `track_id` using cosine similarity \
+    between vectors of the musical features of tracks. Picks a random 10 songs from the top `top_k` (default 50) \
+    most similar tracks.
+
+    The top `top_k` come from the lists precomputed for the whole catalog by the nightly batch job \
+    (see similar_tracks.py). If the job hasn't run yet, or the track is newer than the last run, samples 2000 songs \
+    and finds the most similar among them instead.
+    
+    :param track_id: the id of the track for which to find similar songs
+    :param sample_size: the size of the random sample from our database to test similarity against
+    :param top_k: the size of the sample of songs that are similar to track_id from which to sample the final 10
+    :param return_n: the final amount of similar songs to return
+
+    :returns results: the top `return_n` similar songs to this track. List[dict[track_id: int, title: str]]
+    '''
+
+    precomputed = current_app.similar_tracks.get()
+    if precomputed is not None:
+        neighbour_ids = precomputed.neighbours_of(track_id, top_k)
+        if neighbour_ids:
+            return get_track_titles(random.sample(neighbour_ids, min(return_n, len(neighbour_ids))))
+
+    target_vector = get_track_vector(track_id)
+
+    if target_vector is None:
+        raise ValueError(f"Track {track_id} not found.")
+
+    # random sample of tracks to compare against, skipping the track itself
+    sample = [row for row in get_random_sample(sample_size) if row['track_id'] != track_id]
+    if not sample:
+        return []
+
+    # cosine similarity of the whole sample in one matrix-vector product
+    matrix = normalize_rows(sample)
+    denom = norm(matrix, axis=1) * norm(target_vector)
+    sims = np.divide(matrix @ target_vector, denom, out=np.zeros(len(sample)), where=denom > 0)
+
+    # get the top_k songs then randomly draw return_n
+    top_candidates = np.argsort(-sims, kind="stable")[:top_k].tolist()
+    final_selection = random.sample(top_candidates, min(return_n, len(top_candidates)))
+
+    return [{"track_id": sample[i]["track_id"], "title": sample[i]["title"]} for i in final_selection]
@@ -0,0 +1,401 @@
+'''
+Versioned, checksummed binary snapshots of the catalog for fast worker startup.
+
+Layout of SNAPSHOT_DIR:
+
+    CURRENT                 # name of the active snapshot, swapped atomically with os.replace
+    <version>/
+        manifest.json       # format/catalog/normalization version, row counts, sha256 + size of every file
+        columns.json        # feature column names (from TrackStore.save)
+        track_ids.npy, features.npy, ...   # TrackStore columns, features already normalized
+        artist_ids.npy, artist_popularity.npy
+        track_artist_offsets.npy, track_artist_index.npy   # CSR: track index -> artist indices
+        artist_genre_offsets.npy, artist_genre_ids.npy     # CSR: artist index -> genre ids
+        genres.json         # genre_id -> genre_name
+        feature_stats.json  # per-feature mean/std/min/max/histogram
+
+Every .npy file is loaded with `np.load(mmap_mode='r')`, so attaching a snapshot in a worker is a handful of
+mmap calls and all workers share the same pages.
+
+Usage (from the project root):
+    python -m app.snapshot export     # dump the database into a new snapshot and make it CURRENT
+    python -m app.snapshot verify     # re-check the checksums of the CURRENT snapshot
+'''
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from .catalog import TrackStore, TRACK_ID_DTYPE
+from .engine import column_stats, map_reduce, merge_column_stats
+from .features import FEATURE_COLUMNS, NORMALIZATION_VERSION, normalize_matrix, stored_normalization_version
+
+SNAPSHOT_FORMAT_VERSION = 1
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+KEEP_SNAPSHOTS = 2  # CURRENT plus the one before it, for workers still mapping it
+
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "snapshots")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _csr(owner_index, values, n_owners):
+    '''
+    Builds a CSR (offsets, values) mapping from parallel owner-index/value arrays. Rows with an owner of -1
+    (id not found) are dropped.
+    '''
+    keep = owner_index >= 0
+    owner_index, values = owner_index[keep], values[keep]
+    order = np.argsort(owner_index, kind="stable")
+    offsets = np.zeros(n_owners + 1, dtype=np.int64)
+    np.cumsum(np.bincount(owner_index, minlength=n_owners), out=offsets[1:])
+    return offsets, values[order]
+
+
+def _lookup(sorted_ids, keys):
+    '''
+    Positions of `keys` in `sorted_ids` (fixed-width bytes arrays), -1 where missing.
+    '''
+    if len(sorted_ids) == 0:
+        return np.full(len(keys), -1, dtype=np.int64)
+    idx = np.minimum(np.searchsorted(sorted_ids, keys), len(sorted_ids) - 1)
+    return np.where(sorted_ids[idx] == keys, idx, -1)
+
+
+def _fetch_in_batches(cursor, query, batch_size=100000):
+    cursor.execute(query)
+    rows = []
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return rows
+        rows.extend(batch)
+
+
+def _catalog_version(cursor):
+    try:
+        cursor.execute("SELECT meta_value FROM CatalogMeta WHERE meta_key = 'catalog_version'")
+        row = cursor.fetchone()
+        return row[0] if row else "0"
+    except Exception:
+        return "0"
+
+
+def export_snapshot(conn, snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+    '''
+    Dumps the catalog into a new versioned snapshot directory, verifies it, and atomically points CURRENT at it.
+
+    :param conn: an open mysql.connector connection
+    :param snapshot_dir: root directory holding all snapshots
+    :returns: the name of the new snapshot
+    '''
+    started = time.perf_counter()
+    cursor = conn.cursor()
+    normalization_version = stored_normalization_version(cursor)
+    if normalization_version != NORMALIZATION_VERSION:
+        cursor.close()
+        raise SnapshotError(f"Tracks were loaded with feature normalization version {normalization_version}, "
+                            f"expected {NORMALIZATION_VERSION}. Rerun load_tracks.py before exporting.")
+    cursor.execute("SELECT 1 FROM Tracks LIMIT 1")
+    if cursor.fetchone() is None:
+        # e.g. load_artists.py on a fresh database, before load_tracks.py ran
+        cursor.close()
+        raise SnapshotError("no tracks loaded yet, nothing to snapshot")
+    catalog_version = _catalog_version(cursor)
+    name = f"v{catalog_version}-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    tmp_dir = os.path.join(snapshot_dir, f".{name}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print("Snapshotting tracks...")
+    tracks = TrackStore.from_cursor(cursor, FEATURE_COLUMNS)
+    tracks.features = normalize_matrix(tracks.features)
+    tracks.save(tmp_dir)
+
+    print("Snapshotting artists...")
+    artist_rows = _fetch_in_batches(cursor, "SELECT artist_id, popularity FROM Artists")
+    artist_ids = np.array([r[0].encode("utf-8") for r in artist_rows], dtype=TRACK_ID_DTYPE)
+    artist_popularity = np.array([r[1] or 0 for r in artist_rows], dtype=np.int16)
+    order = np.argsort(artist_ids, kind="stable")
+    artist_ids, artist_popularity = artist_ids[order], artist_popularity[order]
+    del artist_rows
+
+    print("Snapshotting track-artist and artist-genre mappings...")
+    ta_rows = _fetch_in_batches(cursor, "SELECT track_id, artist_id FROM TrackArtists")
+    ta_tracks = _lookup(tracks.track_ids, np.array([r[0].encode("utf-8") for r in ta_rows], dtype=TRACK_ID_DTYPE))
+    ta_artists = _lookup(artist_ids, np.array([r[1].encode("utf-8") for r in ta_rows], dtype=TRACK_ID_DTYPE))
+    del ta_rows
+    ta_tracks[ta_artists < 0] = -1
+    track_artist_offsets, track_artist_index = _csr(ta_tracks, ta_artists.astype(np.int32), len(tracks))
+
+    ag_rows = _fetch_in_batches(cursor, "SELECT artist_id, genre_id FROM ArtistGenres")
+    ag_artists = _lookup(artist_ids, np.array([r[0].encode("utf-8") for r in ag_rows], dtype=TRACK_ID_DTYPE))
+    ag_genres = np.array([r[1] for r in ag_rows], dtype=np.int32)
+    del ag_rows
+    artist_genre_offsets, artist_genre_ids = _csr(ag_artists, ag_genres, len(artist_ids))
+
+    cursor.execute("SELECT genre_id, genre_name FROM Genres")
+    genres = {int(genre_id): genre_name for genre_id, genre_name in cursor.fetchall()}
+    cursor.close()
+
+    for file_name, array in [("artist_ids", artist_ids),
+                             ("artist_popularity", artist_popularity),
+                             ("track_artist_offsets", track_artist_offsets),
+                             ("track_artist_index", track_artist_index),
+                             ("artist_genre_offsets", artist_genre_offsets),
+                             ("artist_genre_ids", artist_genre_ids)]:
+        np.save(os.path.join(tmp_dir, f"{file_name}.npy"), array)
+    with open(os.path.join(tmp_dir, "genres.json"), "w", encoding="utf-8") as f:
+        json.dump(genres, f)
+    with open(os.path.join(tmp_dir, "feature_stats.json"), "w", encoding="utf-8") as f:
+        json.dump(feature_stats(tracks.features, tracks.feature_columns), f, indent=2)
+
+    files = {}
+    for file_name in sorted(os.listdir(tmp_dir)):
+        path = os.path.join(tmp_dir, file_name)
+        files[file_name] = {"sha256": _sha256(path), "size": os.path.getsize(path)}
+
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "name": name,
+        "catalog_version": catalog_version,
+        "normalization_version": NORMALIZATION_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "tracks": len(tracks),
+        "artists": len(artist_ids),
+        "genres": len(genres),
+        "files": files
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    verify_snapshot(tmp_dir)
+
+    # publish: rename the finished directory, then swap the CURRENT pointer in one os.replace
+    os.replace(tmp_dir, os.path.join(snapshot_dir, name))
+    publish_current(snapshot_dir, name)
+
+    _prune(snapshot_dir, keep=name)
+
+    print(f"Snapshot {name} written ({len(tracks)} tracks, {len(artist_ids)} artists) "
+          f"in {time.perf_counter() - started:.1f}s")
+    return name
+
+
+def publish_current(snapshot_dir, name):
+    '''
+    Atomically points `snapshot_dir`/CURRENT at the directory `name`.
+    '''
+    # per-process temp name, so two processes publishing at once can't write into each other's file
+    pointer_tmp = os.path.join(snapshot_dir, f".{CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(pointer_tmp, "w", encoding="utf-8") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer_tmp, os.path.join(snapshot_dir, CURRENT_FILE))
+
+
+def feature_stats(features, feature_columns, bins=20, workers=None):
+    '''
+    Per-feature count, mean, std, min, max and histogram over [0, 1] of the normalized feature matrix, computed
+    in parallel chunks by the engine.
+    '''
+    bin_edges = np.linspace(0.0, 1.0, bins + 1)
+    stats = map_reduce(column_stats, {"matrix": features}, reduce=merge_column_stats, args=(bin_edges,),
+                       workers=workers)
+    result = {}
+    for c, column in enumerate(feature_columns):
+        count = int(stats["count"][c])
+        mean = stats["sum"][c] / count if count else 0.0
+        result[column] = {
+            "count": count,
+            "mean": float(mean),
+            "std": float(np.sqrt(max(stats["sum_sq"][c] / count - mean ** 2, 0.0))) if count else 0.0,
+            "min": float(stats["min"][c]) if count else None,
+            "max": float(stats["max"][c]) if count else None,
+            "histogram": stats["histogram"][c].tolist()
+        }
+    return result
+
+
+def _prune(snapshot_dir, keep, marker=MANIFEST_FILE):
+    '''
+    Deletes all but the newest KEEP_SNAPSHOTS snapshots (never `keep`).
+    '''
+    # only directories holding `marker` are snapshots; other state kept in SNAPSHOT_DIR (e.g. user_embeddings/)
+    # is left alone
+    names = [n for n in os.listdir(snapshot_dir)
+             if not n.startswith(".") and os.path.exists(os.path.join(snapshot_dir, n, marker))]
+    names.sort(key=lambda n: os.path.getmtime(os.path.join(snapshot_dir, n)), reverse=True)
+    for old in names[KEEP_SNAPSHOTS:]:
+        if old != keep:
+            shutil.rmtree(os.path.join(snapshot_dir, old), ignore_errors=True)
+
+
+def current_snapshot_path(snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+    '''
+    Path of the snapshot CURRENT points to, or None if there is no snapshot yet.
+    '''
+    try:
+        with open(os.path.join(snapshot_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(snapshot_dir, name) if name else None
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        raise SnapshotError(f"Snapshot {path} has format version {manifest.get('format_version')}, "
+                            f"expected {SNAPSHOT_FORMAT_VERSION}")
+    if manifest.get("normalization_version") != NORMALIZATION_VERSION:
+        raise SnapshotError(f"Snapshot {path} was normalized with version {manifest.get('normalization_version')}, "
+                            f"expected {NORMALIZATION_VERSION}")
+    return manifest
+
+
+def verify_snapshot(path, checksums=True):
+    '''
+    Checks that every file listed in the manifest exists with the right size (and sha256 if `checksums`).
+    Raises SnapshotError on the first mismatch.
+    '''
+    manifest = read_manifest(path)
+    for file_name, expected in manifest["files"].items():
+        file_path = os.path.join(path, file_name)
+        if not os.path.exists(file_path) or os.path.getsize(file_path) != expected["size"]:
+            raise SnapshotError(f"Snapshot file {file_path} is missing or truncated")
+        if checksums and _sha256(file_path) != expected["sha256"]:
+            raise SnapshotError(f"Snapshot file {file_path} failed its checksum")
+    return manifest
+
+
+class CatalogSnapshot:
+    '''
+    A loaded (memory-mapped) snapshot: the TrackStore plus artist/genre mappings.
+    '''
+
+    def __init__(self, path):
+        # sizes only: hashing hundreds of MB would defeat the point of a millisecond attach.
+        # `python -m app.snapshot verify` (and every export) does the full checksum pass.
+        self.manifest = verify_snapshot(path, checksums=False)
+        self.path = path
+        self.name = self.manifest["name"]
+        self.tracks = TrackStore.load(path, mmap=True)
+
+        def load(file_name):
+            return np.load(os.path.join(path, f"{file_name}.npy"), mmap_mode="r")
+
+        self.artist_ids = load("artist_ids")
+        self.artist_popularity = load("artist_popularity")
+        self.track_artist_offsets = load("track_artist_offsets")
+        self.track_artist_index = load("track_artist_index")
+        self.artist_genre_offsets = load("artist_genre_offsets")
+        self.artist_genre_ids = load("artist_genre_ids")
+        with open(os.path.join(path, "genres.json"), "r", encoding="utf-8") as f:
+            self.genres = {int(k): v for k, v in json.load(f).items()}
+
+    def artists_of(self, track_index: int) -> np.ndarray:
+        '''
+        Artist indices (into `artist_ids`) of the track at `track_index`.
+        '''
+        start, end = self.track_artist_offsets[track_index], self.track_artist_offsets[track_index + 1]
+        return self.track_artist_index[start:end]
+
+    def genres_of(self, artist_index: int) -> np.ndarray:
+        '''
+        Genre ids of the artist at `artist_index`.
+        '''
+        start, end = self.artist_genre_offsets[artist_index], self.artist_genre_offsets[artist_index + 1]
+        return self.artist_genre_ids[start:end]
+
+
+class LazySnapshot:
+    '''
+    Attached to the app by `create_app()`. Nothing is opened until the first `get()`, and the CURRENT pointer is
+    re-read at most once every `check_interval` seconds so a refreshed snapshot is picked up without a restart.
+    '''
+
+    def __init__(self, snapshot_dir=DEFAULT_SNAPSHOT_DIR, check_interval=30.0):
+        self.snapshot_dir = snapshot_dir
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._path = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        '''
+        Returns the CatalogSnapshot, or None if no (valid) snapshot has been exported yet.
+        '''
+        now = time.monotonic()
+        if self._snapshot is not None and now - self._last_check < self.check_interval:
+            return self._snapshot
+
+        with self._lock:
+            self._last_check = now
+            path = current_snapshot_path(self.snapshot_dir)
+            if path and path != self._path:
+                try:
+                    self._snapshot = CatalogSnapshot(path)
+                    self._path = path
+                    print(f"Attached catalog snapshot {self._snapshot.name}.")
+                except (OSError, ValueError, KeyError, SnapshotError) as e:
+                    print(f"Could not load catalog snapshot {path}: {e}")
+            return self._snapshot
+
+
+def main(argv):
+    import mysql.connector
+    from dotenv import load_dotenv
+
+    load_dotenv(os.path.join(os.path.dirname(DEFAULT_SNAPSHOT_DIR), ".env"))
+    snapshot_dir = os.getenv("SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR)
+    command = argv[1] if len(argv) > 1 else "export"
+
+    if command == "export":
+        conn = mysql.connector.connect(
+            host=os.getenv("DB_HOST", "localhost"),
+            port=int(os.getenv("DB_PORT", "3306")),
+            user=os.getenv("DB_USER", "spotify_user"),
+            password=os.getenv("DB_PASSWORD", "Spotify123!"),
+            database=os.getenv("DB_NAME", "spotify_db")
+        )
+        try:
+            export_snapshot(conn, snapshot_dir)
+        finally:
+            conn.close()
+    elif command == "verify":
+        path = current_snapshot_path(snapshot_dir)
+        if not path:
+            print(f"No snapshot in {snapshot_dir}")
+            return 1
+        manifest = verify_snapshot(path)
+        print(f"Snapshot {manifest['name']} OK ({manifest['tracks']} tracks)")
+    else:
+        print(f"Unknown command {command}. Use 'export' or 'verify'.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
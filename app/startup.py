@@ -0,0 +1,134 @@
+'''
+Startup-time report: what importing the app and calling `create_app()` costs a fresh process (every gunicorn
+worker restart, every CLI run), broken down by imported module.
+
+The measurement runs in a child interpreter started with `-X importtime`, so modules already imported by this
+process don't hide their cost. Import times are self times (excluding the modules each one imports in turn), so
+they add up per package. Exits non-zero if startup takes longer than the budget (STARTUP_BUDGET_MS, or
+--budget-ms) or if a module that should only be imported on first use (HEAVY_MODULES) was imported at startup.
+
+Usage (from the project root):
+    python -m app.startup [--budget-ms MS] [--top N]
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_BUDGET_MS = 1500.0
+
+# imported lazily by the code that needs them, never by create_app()
+HEAVY_MODULES = ("matplotlib", "pandas", "pyarrow")
+
+# runs in the child: times the import and create_app() separately and dumps the result to the file in argv[1]
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app()
+done = time.perf_counter()
+with open(sys.argv[1], "w") as f:
+    json.dump({"import_ms": (imported - start) * 1000, "create_app_ms": (done - imported) * 1000,
+               "modules": sorted(sys.modules)}, f)
+"""
+
+
+def parse_importtime(stderr):
+    '''
+    Parses `-X importtime` output into a list of (module, self_ms, cumulative_ms), in import order.
+    '''
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    return modules
+
+
+def measure_startup():
+    '''
+    Imports the app and calls `create_app()` in a child interpreter.
+
+    :returns: dict[import_ms: float, create_app_ms: float, modules: List[str] (sys.modules afterwards), \
+        import_times: List[(module, self_ms, cumulative_ms)]]
+    '''
+    with tempfile.TemporaryDirectory() as tmp:
+        result_path = os.path.join(tmp, "startup.json")
+        child = subprocess.run([sys.executable, "-X", "importtime", "-c", _CHILD, result_path],
+                               cwd=PROJECT_ROOT, capture_output=True, text=True)
+        if child.returncode != 0:
+            raise RuntimeError(f"create_app() failed in the child process:\n{child.stderr[-2000:]}")
+        with open(result_path) as f:
+            result = json.load(f)
+    result["import_times"] = parse_importtime(child.stderr)
+    return result
+
+
+def by_package(import_times):
+    '''
+    Total self import time per top-level package, most expensive first.
+    '''
+    totals = defaultdict(float)
+    for name, self_ms, _ in import_times:
+        totals[name.split(".")[0]] += self_ms
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+def report(result, budget_ms, top=15):
+    '''
+    Prints the startup report and returns the list of failures (empty if startup is within budget).
+    '''
+    total_ms = result["import_ms"] + result["create_app_ms"]
+    print(f"import app:   {result['import_ms']:8.1f} ms")
+    print(f"create_app(): {result['create_app_ms']:8.1f} ms")
+    print(f"total:        {total_ms:8.1f} ms (budget {budget_ms:.0f} ms)")
+
+    print(f"\nImport time by package (top {top}):")
+    for package, ms in by_package(result["import_times"])[:top]:
+        print(f"  {ms:8.1f} ms  {package}")
+
+    print(f"\nSlowest modules, self time (top {top}):")
+    slowest = sorted(result["import_times"], key=lambda module: module[1], reverse=True)[:top]
+    for name, self_ms, cumulative_ms in slowest:
+        print(f"  {self_ms:8.1f} ms  {name} (with its imports {cumulative_ms:.1f} ms)")
+
+    failures = []
+    if total_ms > budget_ms:
+        failures.append(f"startup took {total_ms:.0f} ms, over the {budget_ms:.0f} ms budget")
+    loaded = {name.split(".")[0] for name in result["modules"]}
+    for module in HEAVY_MODULES:
+        if module in loaded:
+            failures.append(f"{module} is imported at startup, it should only be imported on first use")
+    return failures
+
+
+def main(argv):
+    from dotenv import load_dotenv
+
+    load_dotenv(PROJECT_ROOT / ".env")
+    parser = argparse.ArgumentParser(prog="python -m app.startup")
+    parser.add_argument("--budget-ms", type=float,
+                        default=float(os.getenv("STARTUP_BUDGET_MS", str(DEFAULT_BUDGET_MS))),
+                        help="fail if importing the app plus create_app() takes longer (default: STARTUP_BUDGET_MS)")
+    parser.add_argument("--top", type=int, default=15, help="how many packages/modules to list")
+    args = parser.parse_args(argv[1:])
+
+    failures = report(measure_startup(), args.budget_ms, args.top)
+    if failures:
+        print()
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        return 1
+    print("\nOK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
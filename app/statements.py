@@ -0,0 +1,522 @@
+'''
+Central registry of the named SQL statements used by the app.
+
+Every statement is static text (no f-strings at request time), so `run()` can execute it through a server-side
+prepared cursor (`cursor(prepared=True)`) that is kept open per connection and per statement. The server parses
+each statement once per connection and only parameters travel over the wire afterwards.
+
+Variable-length id lists are passed as one JSON array parameter and joined with JSON_TABLE instead of building
+`IN (%s, %s, ...)` placeholder lists, which would give every list length its own statement text.
+'''
+import time
+import weakref
+
+from flask import current_app
+from mysql.connector import errors
+
+from .features import FEATURE_COLUMNS
+from .metrics import DB_QUERY_ERRORS, DB_QUERY_SECONDS
+
+
+def _json_ids(alias, column="id", column_type="INT"):
+    # JSON_TABLE over a JSON array parameter, e.g. '[1, 2, 3]' or '["4uLU6hMCjMI75M1A2tKUQC"]'
+    return f"JSON_TABLE(%s, '$[*]' COLUMNS ({column} {column_type} PATH '$')) {alias}"
+
+
+def _json_rows(alias, *columns):
+    # JSON_TABLE over a JSON array of row arrays, e.g. '[[1, "4uLU6hMCjMI75M1A2tKUQC", "2024-05-01 12:00:00"]]'
+    spec = ", ".join(f"{name} {column_type} PATH '$[{i}]'" for i, (name, column_type) in enumerate(columns))
+    return f"JSON_TABLE(%s, '$[*]' COLUMNS ({spec})) {alias}"
+
+
+_LIKE_ROWS = _json_rows("jt", ("user_id", "INT"), ("track_id", "VARCHAR(32)"), ("liked_at", "DATETIME"))
+_FRIEND_ROWS = _json_rows("jt", ("user_id1", "INT"), ("user_id2", "INT"), ("date_befriended", "DATE"))
+_COMMENT_ROWS = _json_rows("jt", ("user_id", "INT"), ("track_id", "VARCHAR(32)"), ("content", "TEXT"),
+                           ("created_at", "DATETIME"))
+
+
+STATEMENTS = {
+    # ---------- auth ----------
+    "insert_user": """
+        INSERT INTO Users (username, email, password_hash, created_at) VALUES (%s, %s, %s, %s)
+    """,
+    "insert_preferences": """
+        INSERT INTO Preferences (user_id, theme, pfp_color) VALUES (%s, %s, %s)
+    """,
+    "user_by_login": """
+        SELECT * FROM Users WHERE username=%s OR email=%s
+    """,
+
+    # ---------- home ----------
+    # liked songs, newest like first, one page at a time. keyset pagination on (liked_at, track_id) walks
+    # idx_likes_user_liked (user_id, liked_at [, track_id]) from the cursor, so every page costs the same
+    "liked_songs_first_page": """
+        SELECT tl.track_id, tl.liked_at, t.title, t.duration_ms, t.release_date
+        FROM TrackLikes tl
+        JOIN Tracks t ON t.track_id = tl.track_id
+        WHERE tl.user_id = %s
+        ORDER BY tl.liked_at DESC, tl.track_id DESC
+        LIMIT %s
+    """,
+    "liked_songs_next_page": """
+        SELECT tl.track_id, tl.liked_at, t.title, t.duration_ms, t.release_date
+        FROM TrackLikes tl
+        JOIN Tracks t ON t.track_id = tl.track_id
+        WHERE tl.user_id = %s
+          AND (tl.liked_at < %s OR (tl.liked_at = %s AND tl.track_id < %s))
+        ORDER BY tl.liked_at DESC, tl.track_id DESC
+        LIMIT %s
+    """,
+    # friends ordered by user id, one page at a time after the cursor id (0 for the first page). each side of the
+    # union reads at most one page from its index (primary key / idx_friends_user2) before the merge
+    "friends_page": """
+        SELECT fr.user_id, u.username, fr.date_befriended
+        FROM (
+            (SELECT f.user_id2 AS user_id, f.date_befriended
+             FROM Friendships f
+             WHERE f.user_id1 = %s AND f.user_id2 > %s
+             ORDER BY f.user_id2
+             LIMIT %s)
+            UNION ALL
+            (SELECT f.user_id1 AS user_id, f.date_befriended
+             FROM Friendships f
+             WHERE f.user_id2 = %s AND f.user_id1 > %s
+             ORDER BY f.user_id1
+             LIMIT %s)
+        ) fr
+        JOIN Users u ON u.user_id = fr.user_id
+        ORDER BY fr.user_id
+        LIMIT %s
+    """,
+    "friends_with_dates": """
+        SELECT u.user_id, u.username, f.date_befriended
+        FROM Friendships f
+        JOIN Users u ON u.user_id = f.user_id2
+        WHERE f.user_id1 = %s
+        UNION ALL
+        SELECT u.user_id, u.username, f.date_befriended
+        FROM Friendships f
+        JOIN Users u ON u.user_id = f.user_id1
+        WHERE f.user_id2 = %s
+    """,
+
+    # ---------- search ----------
+    "search_users": """
+        SELECT
+            u.user_id,
+            u.username,
+            (
+                EXISTS (SELECT 1 FROM Friendships f WHERE f.user_id1 = %s AND f.user_id2 = u.user_id)
+                OR EXISTS (SELECT 1 FROM Friendships f WHERE f.user_id2 = %s AND f.user_id1 = u.user_id)
+            ) AS friend
+        FROM Users u
+        WHERE u.username LIKE %s
+          AND u.user_id != %s
+        ORDER BY friend DESC, u.username ASC
+        LIMIT 10
+    """,
+    "search_tracks": """
+        SELECT
+            t.track_id,
+            t.title,
+            a.name AS artist_name,
+            t.duration_ms
+        FROM Tracks t
+        JOIN TrackArtists ta ON t.track_id = ta.track_id
+        JOIN Artists a ON ta.artist_id = a.artist_id
+        WHERE t.title LIKE %s
+        ORDER BY t.popularity LIMIT 10
+    """,
+    "search_tracks_by_artist": """
+        SELECT
+            t.track_id,
+            t.title,
+            a.name AS artist_name,
+            t.duration_ms
+        FROM Tracks t
+        JOIN TrackArtists ta ON t.track_id = ta.track_id
+        JOIN Artists a ON ta.artist_id = a.artist_id
+        WHERE t.title LIKE %s AND a.name LIKE %s
+        ORDER BY t.popularity LIMIT 10
+    """,
+    "search_artists": """
+        SELECT
+            artist_id,
+            name,
+            popularity
+        FROM Artists
+        WHERE name LIKE %s
+        ORDER BY popularity DESC
+    """,
+
+    # ---------- artist page ----------
+    "artist_info": """
+        SELECT name, popularity
+        FROM Artists
+        WHERE artist_id = %s
+    """,
+    "artist_top_tracks": """
+        SELECT
+            t.track_id,
+            t.title,
+            t.duration_ms,
+            t.explicit
+        FROM Tracks t
+        JOIN TrackArtists ta ON t.track_id = ta.track_id
+        WHERE ta.artist_id = %s
+        ORDER BY t.popularity DESC
+        LIMIT 100
+    """,
+
+    # ---------- user page ----------
+    "user_info": """
+        SELECT u.username, p.pfp_color
+        FROM Users u
+        LEFT JOIN Preferences p ON u.user_id = p.user_id
+        WHERE u.user_id = %s
+    """,
+    "user_liked_tracks": """
+        SELECT
+            t.track_id,
+            t.title,
+            t.duration_ms
+        FROM TrackLikes tl
+        JOIN Tracks t ON tl.track_id = t.track_id
+        WHERE tl.user_id = %s
+    """,
+    "user_friends": """
+        SELECT u.user_id AS friend_id, u.username AS friend_name
+        FROM Friendships f
+        JOIN Users u ON u.user_id = f.user_id2
+        WHERE f.user_id1 = %s
+        UNION ALL
+        SELECT u.user_id AS friend_id, u.username AS friend_name
+        FROM Friendships f
+        JOIN Users u ON u.user_id = f.user_id1
+        WHERE f.user_id2 = %s
+    """,
+
+    # ---------- track page ----------
+    "track_info": """
+        SELECT
+            t.title,
+            t.release_date,
+            t.duration_ms,
+            t.explicit,
+            t.key_signature,
+            t.popularity
+        FROM Tracks t
+        WHERE t.track_id = %s
+    """,
+    # every track a user has liked, for their liked-track set (likes.py). index-only read of the primary key
+    "user_liked_track_ids": """
+        SELECT track_id FROM TrackLikes WHERE user_id = %s
+    """,
+    # whether one user has liked one track (track page, like toggle). primary key lookup, read from the database
+    # rather than the per-process liked-track set, so it sees likes written through any worker
+    "user_liked_track": """
+        SELECT 1 AS liked FROM TrackLikes WHERE user_id = %s AND track_id = %s
+    """,
+    "track_comments": """
+        SELECT
+            u.username,
+            c.content,
+            c.created_at
+        FROM Comments c
+        JOIN Users u ON c.user_id = u.user_id
+        WHERE c.track_id = %s
+        ORDER BY c.created_at DESC
+    """,
+
+    # ---------- dashboard queries ----------
+    "top_artists": """
+        SELECT
+            a.artist_id,
+            a.name AS artist_name,
+            COUNT(tl.track_id) AS like_count
+        FROM TrackLikes tl
+        JOIN TrackArtists ta ON tl.track_id = ta.track_id
+        JOIN Artists a ON ta.artist_id = a.artist_id
+        WHERE tl.user_id = %s
+        GROUP BY a.artist_id, a.name
+        ORDER BY like_count DESC
+        LIMIT 3
+    """,
+    "top_genres": """
+        SELECT
+            g.genre_name,
+            COUNT(tl.track_id) AS like_count
+        FROM TrackLikes tl
+        JOIN Tracks t ON tl.track_id = t.track_id
+        JOIN ArtistGenres ag ON ag.artist_id = (
+            SELECT ta.artist_id
+            FROM TrackArtists ta
+            WHERE ta.track_id = t.track_id
+            LIMIT 1
+        )
+        JOIN Genres g ON ag.genre_id = g.genre_id
+        WHERE tl.user_id = %s
+        GROUP BY g.genre_id, g.genre_name
+        ORDER BY like_count DESC
+        LIMIT 3
+    """,
+    "avg_liked_popularity": """
+        SELECT AVG(t.popularity) AS avg_popularity
+        FROM TrackLikes tl
+        JOIN Tracks t ON tl.track_id = t.track_id
+        WHERE tl.user_id = %s
+    """,
+    "avg_liked_age": """
+        SELECT AVG(YEAR(CURDATE()) - YEAR(t.release_date)) AS avg_age
+        FROM TrackLikes tl
+        JOIN Tracks t ON tl.track_id = t.track_id
+        WHERE tl.user_id = %s
+        AND t.release_date IS NOT NULL
+    """,
+    # every edge, for building the in-memory friend graph (friends.py)
+    "all_friendships": """
+        SELECT user_id1, user_id2 FROM Friendships
+    """,
+    # names of the artists of a JSON array of track ids, one row per (track, artist)
+    "track_artist_names_for_tracks": f"""
+        SELECT ta.track_id, a.name
+        FROM {_json_ids("jt", column_type="VARCHAR(32)")}
+        JOIN TrackArtists ta ON ta.track_id = jt.id
+        JOIN Artists a ON a.artist_id = ta.artist_id
+    """,
+    # the friends_with_dates rows of every user in a JSON array of user ids, tagged with whose friend they are.
+    # both sides are index lookups per id: the primary key for user_id1, idx_friends_user2 for user_id2
+    "friends_with_dates_for_users": f"""
+        SELECT jt.id AS owner_id, u.user_id, u.username, f.date_befriended
+        FROM {_json_ids("jt")}
+        JOIN Friendships f ON f.user_id1 = jt.id
+        JOIN Users u ON u.user_id = f.user_id2
+        UNION ALL
+        SELECT jt.id AS owner_id, u.user_id, u.username, f.date_befriended
+        FROM {_json_ids("jt")}
+        JOIN Friendships f ON f.user_id2 = jt.id
+        JOIN Users u ON u.user_id = f.user_id1
+    """,
+    # which of a JSON array of [user_id1, user_id2] pairs (stored order) are friends, one row per friendship
+    "friendships_for_pairs": f"""
+        SELECT f.user_id1, f.user_id2
+        FROM {_json_rows("jt", ("user_id1", "INT"), ("user_id2", "INT"))}
+        JOIN Friendships f ON f.user_id1 = jt.user_id1 AND f.user_id2 = jt.user_id2
+    """,
+    "users_by_ids": f"""
+        SELECT u.user_id AS friend_id, u.username
+        FROM {_json_ids("jt")}
+        JOIN Users u ON u.user_id = jt.id
+    """,
+    # per-feature averages over the liked tracks of a JSON array of user ids, one row per user that has liked something
+    "taste_profiles_for_users": f"""
+        SELECT
+            tl.user_id,
+            AVG(t.mode)                AS mode,
+            AVG(t.danceability)        AS danceability,
+            AVG(t.energy)              AS energy,
+            AVG(t.loudness)            AS loudness,
+            AVG(t.speechiness)         AS speechiness,
+            AVG(t.acousticness)        AS acousticness,
+            AVG(t.instrumentalness)    AS instrumentalness,
+            AVG(t.liveness)            AS liveness,
+            AVG(t.valence)             AS valence,
+            AVG(t.tempo)               AS tempo
+        FROM {_json_ids("jt")}
+        JOIN TrackLikes tl ON tl.user_id = jt.id
+        JOIN Tracks t ON tl.track_id = t.track_id
+        GROUP BY tl.user_id
+    """,
+    # raw feature sums + like count per user, for building the user embedding matrix (embeddings.py)
+    "user_feature_sums": f"""
+        SELECT tl.user_id, COUNT(*), {", ".join([f"SUM(t.{col})" for col in FEATURE_COLUMNS])}
+        FROM TrackLikes tl
+        JOIN Tracks t ON tl.track_id = t.track_id
+        GROUP BY tl.user_id
+    """,
+    "track_titles": f"""
+        SELECT t.track_id, t.title
+        FROM {_json_ids("jt", column_type="VARCHAR(32)")}
+        JOIN Tracks t ON t.track_id = jt.id
+    """,
+    "track_vector": f"""
+        SELECT {", ".join(FEATURE_COLUMNS)}
+        FROM Tracks
+        WHERE track_id = %s
+    """,
+    "random_tracks": f"""
+        SELECT {", ".join(["track_id", "title"] + FEATURE_COLUMNS)}
+        FROM Tracks
+        ORDER BY RAND()
+        LIMIT %s
+    """,
+    "liked_genre_ids": """
+        SELECT DISTINCT ag.genre_id
+        FROM TrackLikes tl
+        JOIN TrackArtists ta ON tl.track_id = ta.track_id
+        JOIN ArtistGenres ag ON ta.artist_id = ag.artist_id
+        WHERE tl.user_id = %s
+    """,
+    # excluded genre ids are a JSON array ('[]' excludes nothing)
+    "discovery_tracks": f"""
+        SELECT
+            t.track_id,
+            t.title,
+            GROUP_CONCAT(DISTINCT a.name SEPARATOR ', ') AS artists
+        FROM Tracks t
+        JOIN TrackArtists ta ON t.track_id = ta.track_id
+        JOIN Artists a ON ta.artist_id = a.artist_id
+        JOIN ArtistGenres ag ON a.artist_id = ag.artist_id
+        WHERE ag.genre_id NOT IN (SELECT jt.id FROM {_json_ids("jt")})
+          AND t.track_id >= (
+            SELECT FLOOR(
+                (SELECT MIN(track_id) FROM Tracks) +
+                RAND() * (
+                    (SELECT MAX(track_id) FROM Tracks) -
+                    (SELECT MIN(track_id) FROM Tracks)
+                )
+            )
+        )
+        GROUP BY t.track_id
+        LIMIT 20
+    """,
+    "theme": """
+        SELECT theme
+        FROM Preferences
+        WHERE user_id = %s
+    """,
+    "liked_feature_averages": f"""
+        SELECT {", ".join([f"AVG(t.{col}) AS {col}" for col in FEATURE_COLUMNS])}
+        FROM TrackLikes tl
+        JOIN Tracks t ON tl.track_id = t.track_id
+        WHERE tl.user_id = %s
+    """,
+
+    # ---------- write-behind batches (write_behind.py) ----------
+    # INSERT IGNORE so a row whose user/track has since been deleted can't fail (and block) the whole batch
+    "batch_insert_likes": f"""
+        INSERT IGNORE INTO TrackLikes (user_id, track_id, liked_at)
+        SELECT jt.user_id, jt.track_id, jt.liked_at FROM {_LIKE_ROWS}
+    """,
+    "batch_delete_likes": f"""
+        DELETE tl FROM TrackLikes tl
+        JOIN {_LIKE_ROWS} ON tl.user_id = jt.user_id AND tl.track_id = jt.track_id
+    """,
+    "batch_insert_friendships": f"""
+        INSERT IGNORE INTO Friendships (user_id1, user_id2, date_befriended)
+        SELECT jt.user_id1, jt.user_id2, jt.date_befriended FROM {_FRIEND_ROWS}
+    """,
+    "batch_delete_friendships": f"""
+        DELETE f FROM Friendships f
+        JOIN {_FRIEND_ROWS} ON f.user_id1 = jt.user_id1 AND f.user_id2 = jt.user_id2
+    """,
+    # comments have no key to be duplicates of, so no IGNORE: rows whose user/track is gone are left out by the
+    # joins (and logged from batch_rejected_comments), anything else wrong fails the batch instead of being dropped
+    "batch_insert_comments": f"""
+        INSERT INTO Comments (user_id, track_id, content, created_at)
+        SELECT jt.user_id, jt.track_id, jt.content, jt.created_at
+        FROM {_COMMENT_ROWS}
+        JOIN Users u ON u.user_id = jt.user_id
+        JOIN Tracks t ON t.track_id = jt.track_id
+    """,
+    "batch_rejected_comments": f"""
+        SELECT jt.user_id, jt.track_id, jt.content
+        FROM {_COMMENT_ROWS}
+        LEFT JOIN Users u ON u.user_id = jt.user_id
+        LEFT JOIN Tracks t ON t.track_id = jt.track_id
+        WHERE u.user_id IS NULL OR t.track_id IS NULL
+    """,
+    # last journal sequence number committed per journal (written in the same transaction as the batch)
+    "write_behind_checkpoint": """
+        SELECT last_seq FROM WriteBehindCheckpoints WHERE journal_id = %s
+    """,
+    "save_write_behind_checkpoint": """
+        INSERT INTO WriteBehindCheckpoints (journal_id, last_seq) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE last_seq = VALUES(last_seq)
+    """,
+    "delete_write_behind_checkpoint": """
+        DELETE FROM WriteBehindCheckpoints WHERE journal_id = %s
+    """,
+}
+
+# connection -> {statement name: open prepared cursor}
+_prepared_cursors = weakref.WeakKeyDictionary()
+
+
+def prepared_cursor(conn, name):
+    '''
+    Returns the prepared (dictionary) cursor for statement `name` on `conn`, creating it on first use.
+    The statement is prepared on the server by its first execute and reused after that.
+    '''
+    cursors = _prepared_cursors.get(conn)
+    if cursors is None:
+        cursors = _prepared_cursors[conn] = {}
+
+    cursor = cursors.get(name)
+    if cursor is None:
+        cursor = cursors[name] = conn.cursor(prepared=True, dictionary=True)
+    return cursor
+
+
+def forget_connection(conn):
+    '''
+    Closes and drops every prepared cursor of `conn` (e.g. after it reconnected, which invalidates them).
+    '''
+    for cursor in _prepared_cursors.pop(conn, {}).values():
+        try:
+            cursor.close()
+        except errors.Error:
+            pass
+
+
+def iter_rows(name, params=(), batch_size=50000, conn=None):
+    '''
+    Streams the result of statement `name` as lists of plain tuples, `batch_size` rows at a time. Meant for bulk
+    reads (building in-memory structures) where a dict per row would be wasted.
+    '''
+    conn = conn if conn is not None else current_app.db
+    cursor = conn.cursor()
+    try:
+        cursor.execute(STATEMENTS[name], params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close()
+
+
+def run(name, params=(), fetch="all", conn=None):
+    '''
+    Executes the registered statement `name`.
+
+    :param name: key in STATEMENTS
+    :param params: tuple of parameters for the statement's placeholders
+    :param fetch: "all" -> list of dict rows, "one" -> first dict row or None, "none" -> lastrowid (for writes)
+    :param conn: connection to run on. Defaults to current_app.db
+    '''
+    conn = conn if conn is not None else current_app.db
+    cursor = prepared_cursor(conn, name)
+
+    start = time.perf_counter()
+    try:
+        cursor.execute(STATEMENTS[name], params)
+        if fetch == "none":
+            return cursor.lastrowid
+        # always drain the result so the cursor can be executed again
+        rows = cursor.fetchall()
+    except (errors.OperationalError, errors.InterfaceError):
+        # the server side statements died with the session
+        DB_QUERY_ERRORS.inc(name, "sync")
+        forget_connection(conn)
+        raise
+    except errors.Error:
+        DB_QUERY_ERRORS.inc(name, "sync")
+        raise
+    finally:
+        DB_QUERY_SECONDS.observe(time.perf_counter() - start, name, "sync")
+
+    if fetch == "one":
+        return rows[0] if rows else None
+    return rows
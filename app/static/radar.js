@@ -0,0 +1,73 @@
+// Draws the dashboard radar chart as inline SVG from the /api/v1/dashboard/radar payload:
+//   {theme, features: [...], values: [...] | null, friend: {username, values} | null}
+// Same look as the server-side PNG (create_dashboard): Spotify green web on a themed background, values in [0, 1].
+window.radarChart = (function () {
+    const SVG = "http://www.w3.org/2000/svg";
+    const SIZE = 420;
+    const RADIUS = 140;
+    const CENTER = SIZE / 2;
+    const COLORS = {user: "#1DB954", friend: "#FF6B6B"};
+    const THEMES = {
+        dark: {background: "#191414", axis: "white"},
+        light: {background: "white", axis: "#191414"}
+    };
+
+    function node(tag, attrs) {
+        const el = document.createElementNS(SVG, tag);
+        Object.entries(attrs).forEach(([key, value]) => el.setAttribute(key, value));
+        return el;
+    }
+
+    function point(i, n, r) {
+        // first axis points straight up, then clockwise
+        const angle = -Math.PI / 2 + 2 * Math.PI * i / n;
+        return [CENTER + r * Math.cos(angle), CENTER + r * Math.sin(angle)];
+    }
+
+    function polygon(values, color, dashed) {
+        const points = values.map((v, i) => point(i, values.length, RADIUS * Math.max(0, Math.min(1, v))).join(","));
+        const attrs = {points: points.join(" "), fill: color, "fill-opacity": 0.25, stroke: color, "stroke-width": 2};
+        if (dashed) attrs["stroke-dasharray"] = "6 4";
+        return node("polygon", attrs);
+    }
+
+    function render(data) {
+        const theme = THEMES[data.theme] || THEMES.dark;
+        const n = data.features.length;
+        const svg = node("svg", {viewBox: `0 0 ${SIZE} ${SIZE}`, width: "100%", style: "max-width: 600px",
+                                 role: "img", "aria-label": "Listening dashboard"});
+        svg.appendChild(node("rect", {width: SIZE, height: SIZE, fill: theme.background}));
+
+        // grid rings and spokes
+        [0.25, 0.5, 0.75, 1].forEach(r => {
+            const ring = data.features.map((_, i) => point(i, n, RADIUS * r).join(",")).join(" ");
+            svg.appendChild(node("polygon", {points: ring, fill: "none", stroke: theme.axis, "stroke-opacity": 0.3}));
+        });
+        data.features.forEach((feature, i) => {
+            const [x, y] = point(i, n, RADIUS);
+            svg.appendChild(node("line", {x1: CENTER, y1: CENTER, x2: x, y2: y, stroke: theme.axis, "stroke-opacity": 0.3}));
+            const [lx, ly] = point(i, n, RADIUS + 22);
+            const label = node("text", {x: lx, y: ly, fill: theme.axis, "font-size": 12,
+                                        "text-anchor": Math.abs(lx - CENTER) < 1 ? "middle" : (lx > CENTER ? "start" : "end"),
+                                        "dominant-baseline": "middle"});
+            label.textContent = feature;
+            svg.appendChild(label);
+        });
+
+        if (data.friend && data.friend.values) svg.appendChild(polygon(data.friend.values, COLORS.friend, true));
+        if (data.values) svg.appendChild(polygon(data.values, COLORS.user, false));
+
+        // legend
+        const entries = [["You", COLORS.user, data.values]];
+        if (data.friend) entries.push([data.friend.username || "Friend", COLORS.friend, data.friend.values]);
+        entries.forEach(([name, color, values], i) => {
+            svg.appendChild(node("rect", {x: 12, y: 12 + i * 20, width: 12, height: 12, fill: color}));
+            const text = node("text", {x: 30, y: 22 + i * 20, fill: theme.axis, "font-size": 12});
+            text.textContent = values ? name : `${name} (no liked tracks)`;
+            svg.appendChild(text);
+        });
+        return svg;
+    }
+
+    return {render: render};
+})();
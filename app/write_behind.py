@@ -0,0 +1,399 @@
+'''
+Write-behind queue for likes, comments and friendship toggles.
+
+A toggle used to be a read-check, a write and a `commit()` on the shared connection, so a burst of likes was a
+burst of fsyncs on the database. Now the route appends the action to a local journal file (fsync'd, so an
+acknowledged action survives a crash), updates the in-process state right away and returns. A flusher thread
+wakes up every `flush_interval` seconds (or as soon as `max_batch` actions are waiting), coalesces the pending
+actions (the last toggle of a like/friendship wins) and writes them as a few multi-row statements plus a
+checkpoint row in ONE transaction on its own connection: one group commit per batch instead of one per click.
+
+Crash safety: every journal record has a sequence number and WriteBehindCheckpoints holds the last sequence
+committed per journal, updated in the same transaction as the batch. Each process owns one journal file
+(held with an exclusive flock, taken before the file gets its journal name). On start, journals not locked by a
+live process are adopted: records after their checkpoint are replayed, then the file is removed. Nothing is
+applied twice and nothing acknowledged is lost.
+
+Reads that must reflect a pending action (has the viewer liked this, are we friends, the comment just posted)
+check `liked()`, `are_friends()` and `pending_comments()` before the database.
+
+With WRITE_BEHIND=0 every action is written and committed synchronously on the request's connection.
+'''
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import current_app
+from mysql.connector import Error
+
+from .statements import run
+
+try:
+    import fcntl
+except ImportError:  # no flock on Windows: single-process journals only
+    fcntl = None
+
+JOURNAL_SUFFIX = ".journal"
+# a journal is created and locked under this suffix, then renamed into place, so recover() never sees it unlocked
+NEW_JOURNAL_SUFFIX = JOURNAL_SUFFIX + ".new"
+ABANDONED_JOURNAL_SECONDS = 60
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def now():
+    return datetime.now().strftime(DATETIME_FORMAT)
+
+
+def coalesce(records):
+    '''
+    Turns journal records into the statement batches of one flush: the last like/unlike per (user, track) and the
+    last friend/unfriend per pair win, comments are all kept in order.
+
+    :returns: dict of statement name -> list of row arrays (only non-empty batches)
+    '''
+    likes, friends, comments = {}, {}, []
+    for record in records:
+        op, args = record["op"], record["args"]
+        if op in ("like", "unlike"):
+            likes[tuple(args[:2])] = (op, args)
+        elif op in ("friend", "unfriend"):
+            friends[tuple(args[:2])] = (op, args)
+        elif op == "comment":
+            comments.append(args)
+
+    batches = {
+        "batch_insert_likes": [args for op, args in likes.values() if op == "like"],
+        "batch_delete_likes": [args for op, args in likes.values() if op == "unlike"],
+        "batch_insert_friendships": [args for op, args in friends.values() if op == "friend"],
+        "batch_delete_friendships": [args for op, args in friends.values() if op == "unfriend"],
+        "batch_insert_comments": comments
+    }
+    return {name: rows for name, rows in batches.items() if rows}
+
+
+def write_batch(conn, records, journal_id=None):
+    '''
+    Writes `records` and (if `journal_id` is given) the journal checkpoint in one transaction.
+    '''
+    try:
+        # the app's connections are autocommit (see connect_db), so the transaction is started explicitly
+        if not conn.in_transaction:
+            conn.start_transaction()
+        for name, rows in coalesce(records).items():
+            if name == "batch_insert_comments":
+                for row in run("batch_rejected_comments", (json.dumps(rows),), conn=conn):
+                    print(f"Write-behind: dropping comment by user {row['user_id']} on track {row['track_id']}, "
+                          f"the user or track no longer exists: {row['content']!r}")
+            # deletes don't read liked_at/date_befriended but share the insert's row layout
+            run(name, (json.dumps(rows),), fetch="none", conn=conn)
+        if journal_id is not None:
+            run("save_write_behind_checkpoint", (journal_id, records[-1]["seq"]), fetch="none", conn=conn)
+        conn.commit()
+    except Error:
+        try:
+            conn.rollback()
+        except Error:
+            pass
+        raise
+
+
+def read_journal(path):
+    '''
+    The complete records of a journal file. A torn last line (crash mid-append) was never acknowledged and is
+    skipped.
+    '''
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+    return records
+
+
+def try_lock(fd):
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+class WriteBehindQueue:
+    '''
+    Journal + pending-state overlay + flusher thread of one process. Everything is started lazily on first use,
+    so the queue can be created before a pre-forking server forks.
+    '''
+
+    def __init__(self, directory, connect, flush_interval=0.2, max_batch=500, fsync=True, enabled=True):
+        '''
+        :param directory: where the journal files live
+        :param connect: zero-arg callable returning a new database connection for the flusher
+        :param flush_interval: max seconds an action waits before it is written
+        :param max_batch: flush early once this many actions are pending
+        :param fsync: fsync the journal before acknowledging (off trades crash safety for latency)
+        :param enabled: False writes every action synchronously instead
+        '''
+        self.directory = directory
+        self.connect = connect
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.fsync = fsync
+        self.enabled = enabled
+
+        self.flushed_batches = 0
+        self.flushed_records = 0
+
+        self._lock = threading.Lock()      # journal, pending records, overlay
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._wake = threading.Event()
+        self._pid = None
+        self._fd = None
+        self._journal_id = None
+        self._seq = 0
+        self._pending = []
+        self._likes = {}     # (user_id, track_id) -> (seq, liked)
+        self._friends = {}   # (user_id1, user_id2) -> (seq, friends)
+        self._comments = {}  # track_id -> [(seq, comment row)]
+        self._conn = None
+
+    # ---------- lifecycle ----------
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # a forked child must not share the parent's journal or thread
+            self._fd = None
+            self._pending = []
+            self._likes, self._friends, self._comments = {}, {}, {}
+            self._conn = None
+
+            os.makedirs(self.directory, exist_ok=True)
+            journal_id = uuid.uuid4().hex
+            new_path = os.path.join(self.directory, journal_id + NEW_JOURNAL_SUFFIX)
+            fd = os.open(new_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+            if not try_lock(fd):
+                os.close(fd)
+                os.remove(new_path)
+                raise OSError(f"Could not lock write-behind journal {new_path}")
+            os.rename(new_path, self._path(journal_id))
+            self._fd, self._journal_id = fd, journal_id
+            self._seq = 0
+            self._pid = os.getpid()
+
+            threading.Thread(target=self._run, name="write-behind", daemon=True).start()
+            atexit.register(self.close)
+
+    def _path(self, journal_id):
+        return os.path.join(self.directory, journal_id + JOURNAL_SUFFIX)
+
+    def _connection(self):
+        if self._conn is None or not self._conn.is_connected():
+            self._conn = self.connect()
+        return self._conn
+
+    def _run(self):
+        try:
+            self.recover()
+        except Error as e:
+            print(f"Write-behind recovery failed, will retry on restart: {e}")
+        backoff = self.flush_interval
+        while True:
+            self._wake.wait(backoff)
+            self._wake.clear()
+            try:
+                self.flush()
+                backoff = self.flush_interval
+            except Exception as e:
+                # keep everything pending and retry with backoff (the journal still has it)
+                print(f"Write-behind flush failed, retrying: {e}")
+                self._conn = None
+                backoff = min(backoff * 2, 30.0)
+
+    def recover(self, conn=None):
+        '''
+        Replays the journals of dead processes (any journal file nobody holds a lock on) and removes them. Run by
+        the flusher when it starts, and by `wsgi.init_worker()` so a restarted worker replays what its predecessor
+        left before it serves any request.
+
+        :param conn: connection to replay on, defaults to the flusher's
+        '''
+        if not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(NEW_JOURNAL_SUFFIX):
+                self._remove_abandoned(os.path.join(self.directory, name))
+                continue
+            journal_id = name[:-len(JOURNAL_SUFFIX)]
+            if not name.endswith(JOURNAL_SUFFIX) or journal_id == self._journal_id:
+                continue
+            path = self._path(journal_id)
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue  # replayed by another process since the listing
+            try:
+                if not try_lock(fd):
+                    continue  # a live process owns it
+                if not os.path.exists(path):
+                    continue  # replayed and removed by another process between the open and the lock
+                conn = conn if conn is not None else self._connection()
+                checkpoint = run("write_behind_checkpoint", (journal_id,), fetch="one", conn=conn)
+                last_seq = checkpoint["last_seq"] if checkpoint else 0
+                records = [r for r in read_journal(path) if r["seq"] > last_seq]
+                if records:
+                    write_batch(conn, records, journal_id)
+                    print(f"Write-behind: replayed {len(records)} actions from journal {journal_id}")
+                os.remove(path)
+                # only after the file is gone, or a crash in between would replay it without a checkpoint
+                run("delete_write_behind_checkpoint", (journal_id,), fetch="none", conn=conn)
+                conn.commit()
+            finally:
+                os.close(fd)
+
+    @staticmethod
+    def _remove_abandoned(path):
+        # a process died between creating its journal and renaming it into place, so nothing was written to it.
+        # a live process renames it right after creating it, only files left for a while are abandoned
+        try:
+            if time.time() - os.path.getmtime(path) > ABANDONED_JOURNAL_SECONDS:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        '''
+        Flushes what is pending and removes this process's journal (called at exit).
+        '''
+        if self._pid != os.getpid():
+            return
+        try:
+            self.flush()
+            if self._pending:
+                return  # keep the journal for the next start to replay
+            os.close(self._fd)
+            os.remove(self._path(self._journal_id))
+            conn = self._connection()
+            run("delete_write_behind_checkpoint", (self._journal_id,), fetch="none", conn=conn)
+            conn.commit()
+        except (Error, OSError) as e:
+            print(f"Write-behind shutdown flush failed, the journal will be replayed on restart: {e}")
+        finally:
+            self._pid = None
+
+    # ---------- writes ----------
+
+    def _submit(self, op, args, conn=None, **extra):
+        if not self.enabled:
+            write_batch(conn if conn is not None else current_app.db, [{"seq": 0, "op": op, "args": args}])
+            return
+
+        self._ensure_started()
+        with self._lock:
+            self._seq += 1
+            # extra fields (a comment's username) are only for the overlay, never written
+            record = {"seq": self._seq, "op": op, "args": args, **extra}
+            os.write(self._fd, (json.dumps(record) + "\n").encode("utf-8"))
+            if self.fsync:
+                os.fsync(self._fd)
+            self._pending.append(record)
+            self._apply(record)
+            waiting = len(self._pending)
+        if waiting >= self.max_batch:
+            self._wake.set()
+
+    def _apply(self, record):
+        seq, op, args = record["seq"], record["op"], record["args"]
+        if op in ("like", "unlike"):
+            self._likes[(args[0], args[1])] = (seq, op == "like")
+        elif op in ("friend", "unfriend"):
+            self._friends[(args[0], args[1])] = (seq, op == "friend")
+        elif op == "comment":
+            _, track_id, content, created_at = args
+            self._comments.setdefault(track_id, []).append(
+                (seq, {"username": record.get("username"), "content": content, "created_at": created_at}))
+
+    def like(self, user_id, track_id, conn=None):
+        self._submit("like", [user_id, track_id, now()], conn)
+
+    def unlike(self, user_id, track_id, conn=None):
+        self._submit("unlike", [user_id, track_id, now()], conn)
+
+    def befriend(self, user_id1, user_id2, conn=None):
+        self._submit("friend", [user_id1, user_id2, now()[:10]], conn)
+
+    def unfriend(self, user_id1, user_id2, conn=None):
+        self._submit("unfriend", [user_id1, user_id2, now()[:10]], conn)
+
+    def comment(self, user_id, track_id, content, username=None, conn=None):
+        self._submit("comment", [user_id, track_id, content, now()], conn, username=username)
+
+    def flush(self):
+        '''
+        Writes every pending action in one transaction. Raises mysql.connector.Error (and keeps them pending) if the
+        database is unavailable.
+        '''
+        with self._flush_lock:
+            with self._lock:
+                records = list(self._pending)
+            if not records:
+                return
+            write_batch(self._connection(), records, self._journal_id)
+            last_seq = records[-1]["seq"]
+
+            with self._lock:
+                del self._pending[:len(records)]
+                self._forget(last_seq)
+                if not self._pending:
+                    # everything is committed and checkpointed, start the journal over
+                    os.ftruncate(self._fd, 0)
+            self.flushed_batches += 1
+            self.flushed_records += len(records)
+
+    def _forget(self, last_seq):
+        # overlay entries are dropped once the database reflects them (unless a newer action replaced them)
+        for overlay in (self._likes, self._friends):
+            for key in [key for key, (seq, _) in overlay.items() if seq <= last_seq]:
+                del overlay[key]
+        for track_id in list(self._comments):
+            remaining = [entry for entry in self._comments[track_id] if entry[0] > last_seq]
+            if remaining:
+                self._comments[track_id] = remaining
+            else:
+                del self._comments[track_id]
+
+    # ---------- reads ----------
+
+    def liked(self, user_id, track_id):
+        '''
+        True/False if a like/unlike of the track by the user is still pending, None if the database is current.
+        '''
+        entry = self._likes.get((user_id, track_id))
+        return None if entry is None else entry[1]
+
+    def are_friends(self, user_id1, user_id2):
+        '''
+        Like `liked()` for the friendship of (user_id1, user_id2), ids in stored (sorted) order.
+        '''
+        entry = self._friends.get((user_id1, user_id2))
+        return None if entry is None else entry[1]
+
+    def pending_comments(self, track_id):
+        '''
+        Comments on the track not written yet, newest first (same shape as the `track_comments` rows).
+        '''
+        return [row for _, row in reversed(self._comments.get(track_id, []))]
+
+    @property
+    def pending(self):
+        return len(self._pending)
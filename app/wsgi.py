@@ -0,0 +1,113 @@
+'''
+Production entry point, served by gunicorn with the settings in gunicorn.conf.py:
+
+    gunicorn app.wsgi:app
+
+The master process imports this module once (`preload_app`) and, before forking any worker, attaches the shared
+read-only data with `preload()`: the memory-mapped catalog snapshot, the similar-track lists and the user taste
+matrix. Workers inherit those pages copy-on-write instead of each loading its own copy. The master's database
+connection is closed before the fork, since a MySQL session can't be shared between processes.
+
+Every worker then runs `init_worker()` before it accepts its first request: it opens its own connection and runs
+the hot page statements once, so they are prepared on the server and the catalog version stamp is read before a
+user waits on them.
+'''
+from mysql.connector import Error
+
+from . import connect_db, create_app
+from .metrics import REGISTRY, write_process_file
+from .routes import friends_page_params
+from .statements import forget_connection, run
+
+app = create_app()
+
+# statements behind every page view, run once per worker with a user id that matches nothing. this prepares them on
+# the worker's connection and pulls their index pages into the buffer pool without returning any rows
+WARM_UP_STATEMENTS = [
+    ("user_info", (0,)),
+    ("theme", (0,)),
+    ("liked_songs_first_page", (0, 1)),
+    ("friends_page", friends_page_params(0, 0, 1)),
+    ("user_liked_track_ids", (0,)),
+    ("taste_profiles_for_users", ("[0]",)),
+    ("track_info", ("",)),
+    ("user_liked_track", (0, "")),
+    ("track_comments", ("",)),
+]
+
+
+def preload(app):
+    '''
+    Loads the app's shared read-only data in the master process (gunicorn's `when_ready`), then drops its database
+    connection. Anything that isn't there yet (no snapshot exported, database down) is just loaded on first use.
+    '''
+    with app.app_context():
+        app.catalog.get()
+        app.similar_tracks.get()
+        # rebuilt from the database first if the on-disk copy is stale, in this thread (no refresher thread may be
+        # running when the master forks) and on a fresh autocommit connection of its own, closed afterwards
+        if getattr(app, "db", None) is not None:
+            try:
+                app.user_embeddings.refresh()
+            except (Error, OSError) as e:
+                print(f"Could not preload user embeddings: {e}")
+    release_connection(app)
+
+
+def init_worker(app, reconnect=True):
+    '''
+    Opens the worker's own database connection and warms it up (gunicorn's `post_worker_init`, which runs before
+    the worker starts accepting requests).
+
+    :param reconnect: open a new connection. False when the app was imported in this worker (no preload), so its
+    connection is already the worker's own
+    '''
+    # counters and histograms start from zero in every worker: whatever the master recorded was forked into all
+    REGISTRY.reset()
+    if reconnect:
+        release_connection(app)
+        try:
+            app.db = connect_db(app.config)
+        except Error as e:
+            print(f"Error connecting to MySQL: {e}")
+            return
+    if getattr(app, "db", None) is None:
+        return
+
+    # replay the journals of workers that died (or of the previous master's workers) before serving anything
+    try:
+        app.write_behind.recover(app.db)
+    except (Error, OSError) as e:
+        print(f"Write-behind recovery failed, the flusher retries it: {e}")
+
+    with app.app_context():
+        app.catalog_cache.check_version(app.db)
+        for name, params in WARM_UP_STATEMENTS:
+            try:
+                run(name, params)
+            except Error as e:
+                print(f"Warm-up of {name} failed: {e}")
+
+
+def shutdown_worker(app):
+    '''
+    Flushes the worker's pending writes and closes its connections when it exits (gunicorn's `worker_exit`).
+    '''
+    app.write_behind.close()
+    if app.config['METRICS_DIR']:
+        # final numbers, so this worker's counters still count after it's gone
+        write_process_file(app.config['METRICS_DIR'])
+    if app.async_db is not None:
+        app.async_db.close()
+    release_connection(app)
+
+
+def release_connection(app):
+    conn = getattr(app, "db", None)
+    if conn is None:
+        return
+    forget_connection(conn)
+    try:
+        conn.close()
+    except Error:
+        pass
@@ -1,5 +1,6 @@
 import mysql.connector
 import os
+import sys
 from dotenv import load_dotenv
 
 # Load environment variables from .env file if it exists
@@ -21,3 +22,63 @@ def get_connection():
     )
     return conn
 
+
+
+def bump_catalog_version(cur, conn):
+    """
+    Increment the catalog version stamp in CatalogMeta.
+
+    Call this after (re)loading Tracks or Artists. Running apps compare the stamp against the one they
+    cached under and drop their in-memory catalog cache when it changes.
+    """
+    cur.execute("""
+        INSERT INTO CatalogMeta (meta_key, meta_value) VALUES ('catalog_version', '1')
+        ON DUPLICATE KEY UPDATE meta_value = CAST(meta_value AS UNSIGNED) + 1
+    """)
+    conn.commit()
+    cur.execute("SELECT meta_value FROM CatalogMeta WHERE meta_key = 'catalog_version'")
+    version = cur.fetchone()[0]
+    print(f"Catalog version is now {version}")
+    return version
+
+
+def add_project_root():
+    """
+    Make the `app` package importable from the loader scripts, which run from generate_load_data/.
+    """
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if project_root not in sys.path:
+        sys.path.insert(0, project_root)
+
+
+def stamp_normalization_version(cur, conn):
+    """
+    Record in CatalogMeta which feature normalization the loaded Tracks follow (see app/features.py).
+
+    The app and the snapshot export compare it against their own version and refuse/warn on a mismatch.
+    """
+    add_project_root()
+    from app.features import NORMALIZATION_VERSION, NORMALIZATION_VERSION_KEY
+
+    cur.execute("""
+        INSERT INTO CatalogMeta (meta_key, meta_value) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE meta_value = VALUES(meta_value)
+    """, (NORMALIZATION_VERSION_KEY, NORMALIZATION_VERSION))
+    conn.commit()
+
+
+def refresh_catalog_snapshot(conn):
+    """
+    Re-export the binary catalog snapshot the app workers memory-map (see app/snapshot.py).
+
+    The new snapshot is written to its own directory and only then swapped in, so running workers keep
+    serving the old one until they notice the change.
+    """
+    add_project_root()
+    from app.snapshot import export_snapshot, DEFAULT_SNAPSHOT_DIR, SnapshotError
+
+    try:
+        return export_snapshot(conn, os.getenv("SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR))
+    except SnapshotError as e:
+        print(f"Skipping catalog snapshot: {e}")
+        return None
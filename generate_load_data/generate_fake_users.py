@@ -1,8 +1,11 @@
-import csv
 import random
 import hashlib
 from datetime import datetime, timedelta
-import os
+import numpy as np
+import pandas as pd
+from staging import StagingWriter, STAGING_DIR
+
+USER_BLOCK = 10000  # users generated (and written) per block
 
 
 def generate_password_hash(password):
@@ -14,9 +17,6 @@ def generate_fake_users(num_users=1000):
     """Generate fake users, preferences, subscriptions, and engagement data."""
     print(f"Generating {num_users} fake users...")
 
-    # Create processed directory if it doesn't exist
-    os.makedirs("../processed", exist_ok=True)
-
     # Subscription tiers
     subscriptions = [
         {"name": "Free", "cost": 0.00, "max_playlists": 15},
@@ -29,16 +29,19 @@ def generate_fake_users(num_users=1000):
     themes = ["light", "dark", "auto"]
     colors = ["#1DB954", "#FF6B6B", "#4ECDC4", "#45B7D1", "#FFA07A", "#98D8C8", "#F7DC6F", "#BB8FCE"]
 
-    # Generate users
-    users = []
-    preferences = []
+    # Generate users, written to the staging files one block at a time
+    users = {name: [] for name in ["user_id", "username", "email", "password_hash", "created_at",
+                                   "subscription_id", "subscription_start_date", "subscription_end_date"]}
+    preferences = {"user_id": [], "theme": [], "pfp_color": []}
+    users_writer = StagingWriter("users")
+    preferences_writer = StagingWriter("preferences")
 
     for i in range(1, num_users + 1):
         username = f"user_{i:06d}"
         email = f"{username}@example.com"
         password = f"password{i}"
         password_hash = generate_password_hash(password)
-        created_at = datetime.now() - timedelta(days=random.randint(0, 365))
+        created_at = (datetime.now() - timedelta(days=random.randint(0, 365))).replace(microsecond=0)
 
         # Subscription info (stored directly in Users table)
         subscription_id = None
@@ -48,61 +51,46 @@ def generate_fake_users(num_users=1000):
         if random.random() < 0.85:  # 85% have subscriptions
             sub = random.choice(subscriptions)
             subscription_id = subscriptions.index(sub) + 1
-            subscription_start_date = (created_at.date() + timedelta(days=random.randint(0, 30))).strftime("%Y-%m-%d")
+            subscription_start_date = created_at.date() + timedelta(days=random.randint(0, 30))
             # Some subscriptions are active, some expired
             if random.random() < 0.7:  # 70% active
                 subscription_end_date = None
             else:
-                subscription_end_date = (datetime.strptime(subscription_start_date, "%Y-%m-%d").date() + timedelta(days=random.randint(30, 365))).strftime("%Y-%m-%d")
-
-        users.append({
-            "user_id": i,
-            "username": username,
-            "email": email,
-            "password_hash": password_hash,
-            "created_at": created_at.strftime("%Y-%m-%d %H:%M:%S"),
-            "subscription_id": subscription_id,
-            "subscription_start_date": subscription_start_date,
-            "subscription_end_date": subscription_end_date
-        })
+                subscription_end_date = subscription_start_date + timedelta(days=random.randint(30, 365))
+
+        for name, value in [("user_id", i), ("username", username), ("email", email),
+                            ("password_hash", password_hash), ("created_at", created_at),
+                            ("subscription_id", subscription_id),
+                            ("subscription_start_date", subscription_start_date),
+                            ("subscription_end_date", subscription_end_date)]:
+            users[name].append(value)
 
         # Preferences
-        preferences.append({
-            "user_id": i,
-            "theme": random.choice(themes),
-            "pfp_color": random.choice(colors)
+        preferences["user_id"].append(i)
+        preferences["theme"].append(random.choice(themes))
+        preferences["pfp_color"].append(random.choice(colors))
+
+        if i % USER_BLOCK == 0 or i == num_users:
+            users_writer.write(users)
+            preferences_writer.write(preferences)
+            for columns in (users, preferences):
+                for values in columns.values():
+                    values.clear()
+
+    users_writer.close()
+    preferences_writer.close()
+
+    with StagingWriter("subscriptions") as writer:
+        writer.write({
+            "sub_id": list(range(1, len(subscriptions) + 1)),
+            "name": [sub["name"] for sub in subscriptions],
+            "cost": [sub["cost"] for sub in subscriptions],
+            "max_playlists": [sub["max_playlists"] for sub in subscriptions]
         })
 
-    # Write users CSV
-    print("Writing users.csv...")
-    with open("../processed/users.csv", "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=["user_id", "username", "email", "password_hash", "created_at", "subscription_id", "subscription_start_date", "subscription_end_date"])
-        writer.writeheader()
-        writer.writerows(users)
-
-    # Write preferences CSV
-    print("Writing preferences.csv...")
-    with open("../processed/preferences.csv", "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=["user_id", "theme", "pfp_color"])
-        writer.writeheader()
-        writer.writerows(preferences)
-
-    # Write subscriptions CSV
-    print("Writing subscriptions.csv...")
-    with open("../processed/subscriptions.csv", "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=["sub_id", "name", "cost", "max_playlists"])
-        writer.writeheader()
-        for i, sub in enumerate(subscriptions, 1):
-            writer.writerow({
-                "sub_id": i,
-                "name": sub["name"],
-                "cost": sub["cost"],
-                "max_playlists": sub["max_playlists"]
-            })
-
-    print(f"Generated {len(users)} users, {len(preferences)} preferences")
+    print(f"Generated {users_writer.rows} users, {preferences_writer.rows} preferences")
 
-    return len(users)
+    return users_writer.rows
 
 
 def generate_comments_and_likes(num_users, num_comments_per_user=5, num_likes_per_user=20):
@@ -111,17 +99,13 @@ def generate_comments_and_likes(num_users, num_comments_per_user=5, num_likes_pe
     print("Note: This requires tracks to be loaded first. We'll generate track IDs from the CSV.")
 
     # Get track IDs from tracks.csv
-    track_ids = []
     try:
-        with open("../data/SpotifyKaggle/tracks.csv", "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                track_ids.append(row["id"])
+        track_ids = pd.read_csv("../data/SpotifyKaggle/tracks.csv", usecols=["id"], dtype=str)["id"].to_numpy(object)
     except FileNotFoundError:
         print("Warning: tracks.csv not found. Skipping comments and likes generation.")
         return
 
-    if not track_ids:
+    if len(track_ids) == 0:
         print("Warning: No tracks found. Skipping comments and likes generation.")
         return
 
@@ -146,61 +130,48 @@ def generate_comments_and_likes(num_users, num_comments_per_user=5, num_likes_pe
         "One of the best tracks ever.",
     ]
 
-    comments = []
-    track_likes = []
-
-    for user_id in range(1, num_users + 1):
-        # Generate comments
-        num_comments = random.randint(0, num_comments_per_user)
-        commented_tracks = random.sample(track_ids, min(num_comments, len(track_ids)))
-
-        for track_id in commented_tracks:
-            comment_text = random.choice(comment_templates)
-            created_at = datetime.now() - timedelta(
-                days=random.randint(0, 180),
-                hours=random.randint(0, 23),
-                minutes=random.randint(0, 59)
-            )
-
-            comments.append({
-                "user_id": user_id,
-                "track_id": track_id,
-                "content": comment_text,
-                "created_at": created_at.strftime("%Y-%m-%d %H:%M:%S")
+    templates = np.array(comment_templates, dtype=object)
+    rng = np.random.default_rng()
+    now = np.datetime64(datetime.now().replace(microsecond=0), "s")
+
+    def random_times(count, max_days):
+        # now minus a random number of days, hours and minutes, like timedelta(days=..., hours=..., minutes=...)
+        seconds = (rng.integers(0, max_days + 1, count) * 86400 + rng.integers(0, 24, count) * 3600
+                   + rng.integers(0, 60, count) * 60)
+        return now - seconds.astype("timedelta64[s]")
+
+    def distinct_tracks(user_ids, per_user):
+        # exactly per_user[i] different random tracks for user_ids[i] (callers cap it at the number of tracks)
+        users = np.repeat(user_ids, per_user)
+        tracks = [rng.choice(len(track_ids), size=count, replace=False) for count in per_user]
+        tracks = np.concatenate(tracks) if tracks else np.zeros(0, dtype=np.int64)
+        return users, track_ids[tracks]
+
+    with StagingWriter("comments") as comments_writer, StagingWriter("track_likes") as likes_writer:
+        # vectorized per block of users so hundreds of millions of likes never sit in memory at once
+        for block_start in range(1, num_users + 1, USER_BLOCK):
+            user_ids = np.arange(block_start, min(block_start + USER_BLOCK, num_users + 1), dtype=np.int32)
+
+            # Generate comments
+            num_comments = np.minimum(rng.integers(0, num_comments_per_user + 1, len(user_ids)), len(track_ids))
+            comment_users, comment_tracks = distinct_tracks(user_ids, num_comments)
+            comments_writer.write({
+                "user_id": comment_users,
+                "track_id": comment_tracks,
+                "content": templates[rng.integers(0, len(templates), len(comment_users))],
+                "created_at": random_times(len(comment_users), 180)
             })
 
-        # Generate likes
-        num_likes = random.randint(5, num_likes_per_user)
-        liked_tracks = random.sample(track_ids, min(num_likes, len(track_ids)))
-
-        for track_id in liked_tracks:
-            liked_at = datetime.now() - timedelta(
-                days=random.randint(0, 365),
-                hours=random.randint(0, 23),
-                minutes=random.randint(0, 59)
-            )
-
-            track_likes.append({
-                "user_id": user_id,
-                "track_id": track_id,
-                "liked_at": liked_at.strftime("%Y-%m-%d %H:%M:%S")
+            # Generate likes
+            num_likes = np.minimum(rng.integers(5, num_likes_per_user + 1, len(user_ids)), len(track_ids))
+            like_users, like_tracks = distinct_tracks(user_ids, num_likes)
+            likes_writer.write({
+                "user_id": like_users,
+                "track_id": like_tracks,
+                "liked_at": random_times(len(like_users), 365)
             })
 
-    # Write comments CSV
-    print("Writing comments.csv...")
-    with open("../processed/comments.csv", "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=["user_id", "track_id", "content", "created_at"])
-        writer.writeheader()
-        writer.writerows(comments)
-
-    # Write track_likes CSV
-    print("Writing track_likes.csv...")
-    with open("../processed/track_likes.csv", "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=["user_id", "track_id", "liked_at"])
-        writer.writeheader()
-        writer.writerows(track_likes)
-
-    print(f"Generated {len(comments)} comments and {len(track_likes)} likes")
+    print(f"Generated {comments_writer.rows} comments and {likes_writer.rows} likes")
 
 
 if __name__ == "__main__":
@@ -214,5 +185,5 @@ if __name__ == "__main__":
     generate_comments_and_likes(num_users_created)
 
     print("\nFake user data generation completed!")
-    print(f"CSV files written to ../processed/ directory")
+    print(f"Parquet files written to {STAGING_DIR}/ directory")
 
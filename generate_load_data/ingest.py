@@ -0,0 +1,101 @@
+"""
+Streaming CSV ingestion shared by the loaders.
+
+CSV files are read by pandas in large chunks with explicit dtypes, so numbers are converted column-at-a-time
+in C instead of per field in Python. Each chunk is handed to a parse function (run in a process pool by
+app/engine.py's map_csv) that returns DataFrames ready to insert. Python-list columns such as `genres` and
+`id_artists` ("['a', 'b']") are exploded with one regex pass over the column instead of `ast.literal_eval`.
+"""
+import os
+import re
+import time
+
+import pandas as pd
+
+from db_config import add_project_root
+
+add_project_root()
+from app.engine import map_csv
+
+CHUNK_ROWS = 100000
+
+# one quoted item of a Python list literal, single- or double-quoted, with backslash escapes
+LIST_ITEM = r"'(?P<single>(?:[^'\\]|\\.)*)'|\"(?P<double>(?:[^\"\\]|\\.)*)\""
+ESCAPE = re.compile(r"\\(.)")
+
+
+def parse_list_column(series, name="value"):
+    """
+    Explode a column of Python-list literals ("['a', "b's"]", "[]", NaN) into one row per item.
+
+    :returns: DataFrame with the original row index in `row` and the stripped, non-empty item in `name`.
+    """
+    items = series.fillna("").astype(str).str.extractall(LIST_ITEM)
+    values = items["single"].fillna(items["double"])
+    if values.str.contains("\\", regex=False).any():
+        values = values.str.replace(ESCAPE, r"\1", regex=True)
+    values = values.str.strip()
+    exploded = pd.DataFrame({"row": items.index.get_level_values(0), name: values.to_numpy()})
+    return exploded[exploded[name] != ""].reset_index(drop=True)
+
+
+def parse_dates(series):
+    """
+    Vectorized release date parsing for YYYY-MM-DD, YYYY-MM and YYYY. Anything else becomes None.
+    """
+    text = series.fillna("").astype(str).str.strip()
+    lengths = text.str.len()
+    padded = text.where(lengths != 7, text + "-01").where(lengths != 4, text + "-01-01")
+    dates = pd.to_datetime(padded, format="%Y-%m-%d", errors="coerce")
+    return dates.dt.date.astype(object).where(dates.notna(), None)
+
+
+def to_rows(frame):
+    """
+    The frame's rows as plain Python tuples (NaN/NA -> None), ready for cursor.execute.
+    """
+    return list(frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None))
+
+
+class ParseReport:
+    """
+    Collects parsed chunks and prints parse throughput as they arrive.
+    """
+
+    def __init__(self, path, label):
+        self.label = label
+        self.size = os.path.getsize(path)
+        self.rows = 0
+        self.chunks = []
+        self.started = time.perf_counter()
+
+    def add(self, chunks, parsed):
+        # map_csv reducer: `parsed` is (row count, frames...) for one chunk
+        rows, *frames = parsed
+        self.rows += rows
+        chunks.append(frames)
+        elapsed = time.perf_counter() - self.started
+        print(f"  Parsed {self.rows} {self.label} ({self.rows / elapsed:,.0f} rows/s)")
+        return chunks
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        print(f"Parsed {self.rows} {self.label} in {elapsed:.1f}s "
+              f"({self.rows / elapsed:,.0f} rows/s, {self.size / elapsed / 1e6:.1f} MB/s)")
+
+
+def ingest_csv(path, parse, dtype, label="rows", chunk_rows=CHUNK_ROWS, workers=None):
+    """
+    Read `path` in chunks of `chunk_rows` with `dtype`, run `parse(frame)` on every chunk in parallel and
+    concatenate the results.
+
+    :param parse: top-level function returning (row count, frame1, frame2, ...) for one chunk
+    :returns: list of the concatenated frames, one per frame `parse` returns
+    """
+    report = ParseReport(path, label)
+    chunks = map_csv(parse, path, chunk_rows=chunk_rows, reduce=report.add, initial=[], workers=workers,
+                     dtype=dtype, keep_default_na=False, na_values=[""])
+    report.summary()
+    if not chunks:
+        return []
+    return [pd.concat(frames, ignore_index=True) for frames in zip(*chunks)]
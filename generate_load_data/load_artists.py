@@ -1,44 +1,41 @@
-import csv
-import ast
 import mysql.connector
-from db_config import get_connection
+import numpy as np
+import pandas as pd
+from db_config import get_connection, bump_catalog_version, refresh_catalog_snapshot
+from ingest import ingest_csv, parse_list_column, to_rows
+
+ARTISTS_CSV = "../data/SpotifyKaggle/artists.csv"
+
+ARTIST_DTYPES = {"id": str, "name": str, "genres": str, "followers": float, "popularity": float}
+
+
+def parse_artists_chunk(frame):
+    """Turn one chunk of artists.csv into (row count, Artists rows, artist-genre name pairs) frames."""
+    artists = pd.DataFrame({
+        "artist_id": frame["id"],
+        # Truncate name to fit VARCHAR(200) if needed
+        "name": frame["name"].fillna("").str.slice(0, 200),
+        "followers": np.trunc(frame["followers"].fillna(0)).astype(int),
+        "popularity": np.trunc(frame["popularity"].fillna(0)).astype(int)
+    })
+
+    # Parse genres (format: ['genre1', 'genre2'] or [])
+    genres = parse_list_column(frame["genres"], name="genre")
+    artist_genres = pd.DataFrame({"artist_id": frame["id"].loc[genres["row"]].to_numpy(),
+                                  "genre": genres["genre"].to_numpy()})
+
+    return len(frame), artists, artist_genres
+
 
 # Load Artists
 def load_artists(cur, conn):
     """Load artists from CSV and populate Artists, Genres, and ArtistGenres tables."""
     print("Loading artists from artists.csv...")
 
-    # First pass: collect all unique genres
-    genre_set = set()
-    artist_data = []
-
-    with open("../data/SpotifyKaggle/artists.csv", "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            artist_id = row["id"]
-            name = row["name"]
-            followers = int(float(row["followers"])) if row["followers"] else 0
-            popularity = int(row["popularity"]) if row["popularity"] else 0
-
-            # Parse genres (format: ['genre1', 'genre2'] or [])
-            genres_str = row["genres"]
-            try:
-                genres_list = ast.literal_eval(genres_str) if genres_str else []
-            except (ValueError, SyntaxError):
-                genres_list = []
-
-            # Collect genres
-            for genre in genres_list:
-                if genre and genre.strip():
-                    genre_set.add(genre.strip())
-
-            artist_data.append({
-                "artist_id": artist_id,
-                "name": name,
-                "followers": followers,
-                "popularity": popularity,
-                "genres": genres_list
-            })
+    artists, artist_genres = ingest_csv(ARTISTS_CSV, parse_artists_chunk, ARTIST_DTYPES, label="artists")
+    artist_data = to_rows(artists)
+    genre_set = set(artist_genres["genre"].unique())
+    del artists
 
     print(f"Found {len(genre_set)} unique genres")
     print(f"Found {len(artist_data)} artists")
@@ -68,17 +65,10 @@ def load_artists(cur, conn):
         batch = artist_data[i:i + batch_size]
         for artist in batch:
             try:
-                # Truncate name to fit VARCHAR(200) if needed
-                name = artist["name"][:200] if len(artist["name"]) > 200 else artist["name"]
-                cur.execute(insert_artist_sql, (
-                    artist["artist_id"],
-                    name,
-                    artist["followers"],
-                    artist["popularity"]
-                ))
+                cur.execute(insert_artist_sql, artist)
             except mysql.connector.IntegrityError as e:
                 # Skip duplicates
-                print(f"Warning: Skipping duplicate artist {artist['artist_id']}: {e}")
+                print(f"Warning: Skipping duplicate artist {artist[0]}: {e}")
                 continue
 
         conn.commit()
@@ -95,20 +85,15 @@ def load_artists(cur, conn):
     """
 
     ag_count = 0
-    for artist in artist_data:
-        for genre in artist["genres"]:
-            if genre and genre.strip() and genre.strip() in genre_map:
-                try:
-                    cur.execute(insert_ag_sql, (
-                        artist["artist_id"],
-                        genre_map[genre.strip()]
-                    ))
-                    ag_count += 1
-                except mysql.connector.IntegrityError:
-                    # Skip duplicates
-                    pass
-
-        if ag_count % 10000 == 0 and ag_count > 0:
+    for artist_id, genre in zip(artist_genres["artist_id"].tolist(), artist_genres["genre"].tolist()):
+        try:
+            cur.execute(insert_ag_sql, (artist_id, genre_map[genre]))
+            ag_count += 1
+        except mysql.connector.IntegrityError:
+            # Skip duplicates
+            continue
+
+        if ag_count % 10000 == 0:
             conn.commit()
             print(f"  Inserted {ag_count} artist-genre relationships...")
 
@@ -122,6 +107,8 @@ if __name__ == "__main__":
 
     try:
         load_artists(cur, conn)
+        bump_catalog_version(cur, conn)
+        refresh_catalog_snapshot(conn)
         print("Artists loading completed successfully!")
     except Exception as e:
         print(f"Error: {e}")
@@ -1,203 +1,78 @@
-import csv
 import mysql.connector
 from db_config import get_connection
+from staging import read_batches
 
 
-def load_subscriptions(cur, conn):
-    """Load subscriptions from CSV."""
-    print("Loading subscriptions...")
-    insert_sql = "INSERT INTO Subscriptions (sub_id, name, cost, max_playlists) VALUES (%s, %s, %s, %s)"
-
-    with open("../processed/subscriptions.csv", "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
+def insert_batches(cur, conn, name, insert_sql, label, batch_rows, report_every):
+    """
+    Stream the `name` staging table in batches of `batch_rows` rows, insert them, and commit per batch.
+    Rows that break a constraint (duplicates, unknown tracks) are skipped.
+    """
+    count = 0
+    for batch in read_batches(name, batch_rows):
+        for data in batch:
             try:
-                cur.execute(insert_sql, (
-                    int(row["sub_id"]),
-                    row["name"],
-                    float(row["cost"]),
-                    int(row["max_playlists"])
-                ))
+                cur.execute(insert_sql, data)
+                count += 1
             except mysql.connector.IntegrityError:
                 # Skip duplicates
                 pass
+            except mysql.connector.Error:
+                # Skip if track doesn't exist
+                pass
+        conn.commit()
+        if report_every and count // report_every > (count - len(batch)) // report_every:
+            print(f"  Loaded {count} {label}...")
+    return count
+
 
-    conn.commit()
+def load_subscriptions(cur, conn):
+    """Load subscriptions from the staging file."""
+    print("Loading subscriptions...")
+    insert_sql = "INSERT INTO Subscriptions (sub_id, name, cost, max_playlists) VALUES (%s, %s, %s, %s)"
+    insert_batches(cur, conn, "subscriptions", insert_sql, "subscriptions", 1000, 0)
     print("Subscriptions loaded")
 
 
 def load_users(cur, conn):
-    """Load users from CSV."""
+    """Load users from the staging file."""
     print("Loading users...")
     insert_sql = """
         INSERT INTO Users (user_id, username, email, password_hash, created_at,
                           subscription_id, subscription_start_date, subscription_end_date)
         VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
     """
-
-    batch_size = 1000
-    count = 0
-
-    with open("../processed/users.csv", "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        batch = []
-        for row in reader:
-            batch.append((
-                int(row["user_id"]),
-                row["username"],
-                row["email"],
-                row["password_hash"],
-                row["created_at"],
-                int(row["subscription_id"]) if row["subscription_id"] else None,
-                row["subscription_start_date"] if row["subscription_start_date"] else None,
-                row["subscription_end_date"] if row["subscription_end_date"] else None
-            ))
-
-            if len(batch) >= batch_size:
-                for data in batch:
-                    try:
-                        cur.execute(insert_sql, data)
-                        count += 1
-                    except mysql.connector.IntegrityError:
-                        pass
-                conn.commit()
-                batch = []
-                print(f"  Loaded {count} users...")
-
-        # Process remaining
-        for data in batch:
-            try:
-                cur.execute(insert_sql, data)
-                count += 1
-            except mysql.connector.IntegrityError:
-                pass
-        conn.commit()
-
+    count = insert_batches(cur, conn, "users", insert_sql, "users", 1000, 1000)
     print(f"Loaded {count} users")
 
 
 def load_preferences(cur, conn):
-    """Load preferences from CSV."""
+    """Load preferences from the staging file."""
     print("Loading preferences...")
     insert_sql = "INSERT INTO Preferences (user_id, theme, pfp_color) VALUES (%s, %s, %s)"
-
-    count = 0
-    with open("../processed/preferences.csv", "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                cur.execute(insert_sql, (
-                    int(row["user_id"]),
-                    row["theme"],
-                    row["pfp_color"]
-                ))
-                count += 1
-            except mysql.connector.IntegrityError:
-                pass
-
-    conn.commit()
+    count = insert_batches(cur, conn, "preferences", insert_sql, "preferences", 10000, 0)
     print(f"Loaded {count} preferences")
 
 
 def load_comments(cur, conn):
-    """Load comments from CSV."""
+    """Load comments from the staging file."""
     print("Loading comments...")
     insert_sql = """
         INSERT INTO Comments (user_id, track_id, content, created_at)
         VALUES (%s, %s, %s, %s)
     """
-
-    batch_size = 5000
-    count = 0
-    batch = []
-
-    with open("../processed/comments.csv", "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            batch.append((
-                int(row["user_id"]),
-                row["track_id"],
-                row["content"],
-                row["created_at"]
-            ))
-
-            if len(batch) >= batch_size:
-                for data in batch:
-                    try:
-                        cur.execute(insert_sql, data)
-                        count += 1
-                    except mysql.connector.IntegrityError:
-                        pass
-                    except mysql.connector.Error:
-                        # Skip if track doesn't exist
-                        pass
-                conn.commit()
-                batch = []
-                if count % 10000 == 0:
-                    print(f"  Loaded {count} comments...")
-
-        # Process remaining
-        for data in batch:
-            try:
-                cur.execute(insert_sql, data)
-                count += 1
-            except mysql.connector.IntegrityError:
-                pass
-            except mysql.connector.Error:
-                pass
-        conn.commit()
-
+    count = insert_batches(cur, conn, "comments", insert_sql, "comments", 5000, 10000)
     print(f"Loaded {count} comments")
 
 
 def load_track_likes(cur, conn):
-    """Load track likes from CSV."""
+    """Load track likes from the staging file."""
     print("Loading track likes...")
     insert_sql = """
         INSERT INTO TrackLikes (user_id, track_id, liked_at)
         VALUES (%s, %s, %s)
     """
-
-    batch_size = 10000
-    count = 0
-    batch = []
-
-    with open("../processed/track_likes.csv", "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            batch.append((
-                int(row["user_id"]),
-                row["track_id"],
-                row["liked_at"]
-            ))
-
-            if len(batch) >= batch_size:
-                for data in batch:
-                    try:
-                        cur.execute(insert_sql, data)
-                        count += 1
-                    except mysql.connector.IntegrityError:
-                        # Skip duplicates
-                        pass
-                    except mysql.connector.Error:
-                        # Skip if track doesn't exist
-                        pass
-                conn.commit()
-                batch = []
-                if count % 50000 == 0:
-                    print(f"  Loaded {count} likes...")
-
-        # Process remaining
-        for data in batch:
-            try:
-                cur.execute(insert_sql, data)
-                count += 1
-            except mysql.connector.IntegrityError:
-                pass
-            except mysql.connector.Error:
-                pass
-        conn.commit()
-
+    count = insert_batches(cur, conn, "track_likes", insert_sql, "likes", 10000, 50000)
     print(f"Loaded {count} track likes")
 
 
@@ -0,0 +1,115 @@
+"""
+Parquet staging files between generate_fake_users.py and load_fake_users.py.
+
+Every table is written to ../processed/<name>.parquet with a fixed Arrow schema (typed ids, timestamps and
+dates, dictionary-encoded repeated strings, zstd compression), in row groups so the generator never holds more
+than one group in memory. The loader streams the file back in record batches and turns each batch into insert
+tuples column by column.
+"""
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+STAGING_DIR = "../processed"
+ROW_GROUP_ROWS = 1_000_000
+BATCH_ROWS = 10_000
+
+SCHEMAS = {
+    "subscriptions": pa.schema([
+        ("sub_id", pa.int32()),
+        ("name", pa.string()),
+        ("cost", pa.float64()),
+        ("max_playlists", pa.int32())
+    ]),
+    "users": pa.schema([
+        ("user_id", pa.int32()),
+        ("username", pa.string()),
+        ("email", pa.string()),
+        ("password_hash", pa.string()),
+        ("created_at", pa.timestamp("s")),
+        ("subscription_id", pa.int32()),
+        ("subscription_start_date", pa.date32()),
+        ("subscription_end_date", pa.date32())
+    ]),
+    "preferences": pa.schema([
+        ("user_id", pa.int32()),
+        ("theme", pa.string()),
+        ("pfp_color", pa.string())
+    ]),
+    "comments": pa.schema([
+        ("user_id", pa.int32()),
+        ("track_id", pa.string()),
+        ("content", pa.string()),
+        ("created_at", pa.timestamp("s"))
+    ]),
+    "track_likes": pa.schema([
+        ("user_id", pa.int32()),
+        ("track_id", pa.string()),
+        ("liked_at", pa.timestamp("s"))
+    ])
+}
+
+
+def staging_path(name):
+    return os.path.join(STAGING_DIR, f"{name}.parquet")
+
+
+class StagingWriter:
+    """
+    Buffers columns for one staging table and writes them out one row group at a time.
+
+        with StagingWriter("track_likes") as writer:
+            writer.write({"user_id": user_ids, "track_id": track_ids, "liked_at": liked_at})
+    """
+
+    def __init__(self, name, row_group_rows=ROW_GROUP_ROWS):
+        self.name = name
+        self.schema = SCHEMAS[name]
+        self.row_group_rows = row_group_rows
+        self.rows = 0
+        self._pending = []
+        self._pending_rows = 0
+        os.makedirs(STAGING_DIR, exist_ok=True)
+        self._writer = pq.ParquetWriter(staging_path(name), self.schema, compression="zstd",
+                                        use_dictionary=True)
+
+    def write(self, columns):
+        """
+        Append rows given as a dict of column name -> list or array (all the same length).
+        """
+        table = pa.Table.from_pydict({field.name: columns[field.name] for field in self.schema}, schema=self.schema)
+        self._pending.append(table)
+        self._pending_rows += table.num_rows
+        self.rows += table.num_rows
+        if self._pending_rows >= self.row_group_rows:
+            self._flush()
+
+    def _flush(self):
+        if self._pending_rows:
+            self._writer.write_table(pa.concat_tables(self._pending), row_group_size=self.row_group_rows)
+        self._pending = []
+        self._pending_rows = 0
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+        print(f"Wrote {self.rows} rows to {staging_path(self.name)} "
+              f"({os.path.getsize(staging_path(self.name)) / 1e6:.1f} MB)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_batches(name, batch_rows=BATCH_ROWS):
+    """
+    Stream a staging table back as lists of row tuples (columns in schema order), `batch_rows` at a time.
+    Timestamps come back as datetime, dates as date and nulls as None, ready for cursor.execute.
+    """
+    parquet_file = pq.ParquetFile(staging_path(name))
+    columns = SCHEMAS[name].names
+    for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=columns):
+        yield list(zip(*(column.to_pylist() for column in batch.columns)))
@@ -0,0 +1,69 @@
+"""
+gunicorn settings for serving the app in production:
+
+    gunicorn app.wsgi:app          # picks up this file from the working directory
+
+Settings come from the same .env as the app (WEB_* variables, see .env.example). Reloads without dropping requests:
+
+    kill -HUP <master pid>      # new workers (with this file re-read) start, old ones finish their requests and exit
+    kill -USR2 <master pid>     # new code: starts a second master on the same socket...
+    kill -WINCH <old master>    # ...once it is up, the old workers finish their requests and exit
+    kill -QUIT <old master>     # then the old master goes away
+
+With `preload_app` a HUP reuses the code the master loaded, so deploying new code takes the USR2 sequence (which
+also preloads the current catalog snapshot again). A refreshed snapshot needs neither: workers pick it up on their
+own (see LazySnapshot).
+"""
+import multiprocessing
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).resolve().parent / ".env")
+
+# every worker writes its metrics here so /metrics can report all of them (see app/metrics.py)
+os.environ.setdefault("METRICS_DIR", str(Path(__file__).resolve().parent / "metrics"))
+
+bind = os.getenv("WEB_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_WORKERS", str(multiprocessing.cpu_count() * 2 + 1)))
+# one request at a time per worker: app.db is a single connection that can't be shared between threads
+worker_class = "sync"
+threads = 1
+timeout = int(os.getenv("WEB_TIMEOUT", "60"))
+# how long a worker gets to finish its in-flight request (and flush its write-behind queue) on reload/shutdown
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# load the app once in the master so the memory-mapped catalog data is shared copy-on-write by every worker
+preload_app = True
+
+# recycle workers now and then so a slow leak can't grow forever; jittered so they don't all restart together
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "5000"))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+
+
+def on_starting(server):
+    # counters start from zero with a new master, drop the files of the previous one
+    from app.metrics import clear_directory
+    clear_directory(os.environ["METRICS_DIR"])
+
+
+def when_ready(server):
+    # master, after the preloaded import and before the first fork
+    if server.cfg.preload_app:
+        from app.wsgi import app, preload
+        preload(app)
+
+
+def post_worker_init(worker):
+    # worker, before it accepts connections
+    from app.wsgi import app, init_worker
+    init_worker(app, reconnect=worker.cfg.preload_app)
+
+
+def worker_exit(server, worker):
+    from app.wsgi import app, shutdown_worker
+    shutdown_worker(app)
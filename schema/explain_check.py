@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+EXPLAIN every statement in app/statements.py against a loaded database and fail if any does a full table scan.
+
+Usage (from the project root, with the schema, migrations and data loaded):
+    python schema/explain_check.py
+
+Sample parameters are taken from the database itself (a user with likes, one of their friends, a commented
+track, an artist with tracks). Every statement needs an entry in sample_params(), so a new statement can't skip
+the check. Both table scans (type ALL) and full index scans (type index, every entry of an index) count. Scans of
+small tables (under MIN_ROWS estimated rows) are ignored; the scans that are there by design are listed in
+FULL_SCAN_ALLOWED with the reason.
+"""
+import json
+import os
+import sys
+
+import mysql.connector
+from dotenv import load_dotenv
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+from app.statements import STATEMENTS  # noqa: E402
+
+MIN_ROWS = 1000
+
+FULL_SCAN_ALLOWED = {
+    "all_friendships": "offline: reads every edge to build the in-memory friend graph",
+    "user_feature_sums": "offline: aggregates every like to build the user embedding matrix",
+    "random_tracks": "ORDER BY RAND() reads the catalog; only the fallback for tracks without precomputed neighbours",
+    "discovery_tracks": "random start point compares VARCHAR ids to a number, so the primary key can't be used",
+    # substring search: LIKE '%keyword%' has a leading wildcard, so no B-tree index can seek to the matches.
+    # search_users and search_tracks* stop at LIMIT 10 matches; making these cheap needs a FULLTEXT/ngram index
+    "search_users": "LIKE '%keyword%' on username, a leading wildcard can't use an index",
+    "search_tracks": "LIKE '%keyword%' on title, a leading wildcard can't use an index",
+    "search_tracks_by_artist": "LIKE '%keyword%' on title and artist name, a leading wildcard can't use an index",
+    "search_artists": "LIKE '%keyword%' on artist name, a leading wildcard can't use an index",
+}
+
+# INSERTs only touch the indexes of the rows they write
+SKIP = {"insert_user", "insert_preferences", "batch_insert_likes", "batch_insert_friendships", "batch_insert_comments",
+        "save_write_behind_checkpoint"}
+
+
+def sample_values(cursor):
+    def first(query, default):
+        cursor.execute(query)
+        row = cursor.fetchone()
+        return next(iter(row.values())) if row else default
+
+    user_id = first("SELECT user_id FROM TrackLikes LIMIT 1", 1)
+    cursor.execute("SELECT user_id2 FROM Friendships WHERE user_id1 = %s LIMIT 1", (user_id,))
+    row = cursor.fetchone()
+    other_id = row["user_id2"] if row else user_id + 1
+    return {
+        "user_id": user_id,
+        "other_id": other_id,
+        "username": first(f"SELECT username FROM Users WHERE user_id = {int(user_id)}", "user_000001"),
+        "track_id": first("SELECT track_id FROM Comments LIMIT 1", None) or first("SELECT track_id FROM Tracks LIMIT 1", ""),
+        "artist_id": first("SELECT artist_id FROM TrackArtists LIMIT 1", ""),
+        "genre_id": first("SELECT genre_id FROM Genres LIMIT 1", 1),
+    }
+
+
+def sample_params(s):
+    u, o, t, a = s["user_id"], s["other_id"], s["track_id"], s["artist_id"]
+    return {
+        "user_by_login": (s["username"], s["username"]),
+        "liked_songs_first_page": (u, 51),
+        "liked_songs_next_page": (u, "2100-01-01 00:00:00", "2100-01-01 00:00:00", "", 51),
+        "friends_page": (u, 0, 51, u, 0, 51, 51),
+        "friends_with_dates": (u, u),
+        "search_users": (u, u, "%user%", u),
+        "search_tracks": ("%love%",),
+        "search_tracks_by_artist": ("%love%", "%the%"),
+        "search_artists": ("%the%",),
+        "artist_info": (a,),
+        "artist_top_tracks": (a,),
+        "user_info": (u,),
+        "user_liked_tracks": (u,),
+        "track_artist_names_for_tracks": (json.dumps([t]),),
+        "user_friends": (u, u),
+        "track_info": (t,),
+        "user_liked_track_ids": (u,),
+        "user_liked_track": (u, t),
+        "track_comments": (t,),
+        "top_artists": (u,),
+        "top_genres": (u,),
+        "avg_liked_popularity": (u,),
+        "avg_liked_age": (u,),
+        "all_friendships": (),
+        "users_by_ids": (json.dumps([u, o]),),
+        "friends_with_dates_for_users": (json.dumps([u, o]), json.dumps([u, o])),
+        "friendships_for_pairs": (json.dumps([sorted([u, o])]),),
+        "taste_profiles_for_users": (json.dumps([u, o]),),
+        "user_feature_sums": (),
+        "track_titles": (json.dumps([t]),),
+        "track_vector": (t,),
+        "random_tracks": (10,),
+        "liked_genre_ids": (u,),
+        "discovery_tracks": (json.dumps([s["genre_id"]]),),
+        "theme": (u,),
+        "liked_feature_averages": (u,),
+        "batch_delete_likes": (json.dumps([[u, t, "2024-01-01 00:00:00"]]),),
+        "batch_delete_friendships": (json.dumps([[u, o, "2024-01-01"]]),),
+        "batch_rejected_comments": (json.dumps([[u, t, "sample", "2024-01-01 00:00:00"]]),),
+        "write_behind_checkpoint": ("0" * 32,),
+        "delete_write_behind_checkpoint": ("0" * 32,),
+    }
+
+
+def full_scans(plan):
+    '''
+    Rows of an EXPLAIN result that read a whole (large) base table or one of its indexes from end to end.
+    '''
+    scans = []
+    for row in plan:
+        table = row.get("table") or ""
+        extra = row.get("Extra") or ""
+        if row.get("type") not in ("ALL", "index") or table.startswith("<") or "Table function" in extra:
+            continue
+        if (row.get("rows") or 0) >= MIN_ROWS:
+            what = "full index scan" if row["type"] == "index" else "table scan"
+            scans.append(f"{table} ({what}, ~{row['rows']} rows)")
+    return scans
+
+
+def main():
+    load_dotenv(os.path.join(PROJECT_ROOT, ".env"))
+    conn = mysql.connector.connect(
+        host=os.getenv("DB_HOST", "localhost"),
+        port=int(os.getenv("DB_PORT", "3306")),
+        user=os.getenv("DB_USER", "spotify_user"),
+        password=os.getenv("DB_PASSWORD", "Spotify123!"),
+        database=os.getenv("DB_NAME", "spotify_db")
+    )
+    cursor = conn.cursor(dictionary=True)
+    params = sample_params(sample_values(cursor))
+
+    failures = 0
+    for name, sql in STATEMENTS.items():
+        if name in SKIP:
+            continue
+        if name not in params:
+            print(f"MISSING  {name}: add sample parameters to sample_params()")
+            failures += 1
+            continue
+
+        cursor.execute("EXPLAIN " + sql, params[name])
+        scans = full_scans(cursor.fetchall())
+        if not scans:
+            print(f"OK       {name}")
+        elif name in FULL_SCAN_ALLOWED:
+            print(f"ALLOWED  {name}: {', '.join(scans)} - {FULL_SCAN_ALLOWED[name]}")
+        else:
+            print(f"SCAN     {name}: {', '.join(scans)}")
+            failures += 1
+
+    cursor.close()
+    conn.close()
+    print(f"\n{failures} statement(s) with full table scans" if failures else "\nNo unexpected full table scans.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
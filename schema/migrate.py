@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations.
+
+Usage (from the project root):
+    python schema/migrate.py                # create the database if needed, apply pending migrations
+    python schema/migrate.py --status       # list applied and pending migrations
+    python schema/migrate.py --dry-run      # print what would run
+    python schema/migrate.py --baseline 1   # mark 0000-0001 applied without running them (migrated by hand)
+
+schema/schema.sql is the baseline (version 0) and only runs when the database doesn't exist yet; its
+`spotify_db` is replaced by --database (DB_NAME) so the tables and schema_version end up in the same database.
+schema.sql stays exactly the schema existing databases were created with: changes after it live in
+schema/migrations/NNNN_description.sql and are applied in version order, to new and existing databases alike. Each
+applied migration is recorded in the schema_version table with a SHA-256 of its file; editing an applied migration
+is an error, add a new one instead. (The one exception is a rewrite that leaves the resulting schema unchanged, e.g.
+making a file re-runnable: its old checksum goes in PREVIOUS_CHECKSUMS.)
+
+Migrations run against a live database, so every ALTER TABLE / CREATE INDEX must be online
+(ALGORITHM=INPLACE or INSTANT, LOCK=NONE). A file that really needs a table lock says so with a
+`-- migrate: offline` line. Statements wait at most --lock-wait-timeout seconds for the metadata lock (instead
+of queueing every query on the table behind them) and are retried a few times before giving up.
+
+MySQL DDL is not transactional: if a statement fails the migration is not recorded and the statements before it
+stay applied. Fix the cause, make the file re-runnable (or finish it by hand and use --baseline) and run again.
+"""
+import argparse
+import getpass
+import glob
+import hashlib
+import os
+import re
+import sys
+import time
+
+import mysql.connector
+from dotenv import load_dotenv
+
+SCHEMA_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(SCHEMA_DIR, "schema.sql")
+MIGRATIONS_DIR = os.path.join(SCHEMA_DIR, "migrations")
+MIGRATION_FILE = re.compile(r"^(\d{4})_([\w-]+)\.sql$")
+BASELINE_DATABASE = "spotify_db"  # the database name written in schema.sql
+DATABASE_NAME = re.compile(r"^[A-Za-z0-9_$]{1,64}$")
+
+OFFLINE_MARKER = re.compile(r"^--\s*migrate:\s*offline\s*$", re.MULTILINE | re.IGNORECASE)
+NEEDS_ONLINE = re.compile(r"^\s*(ALTER\s+TABLE|CREATE\s+(UNIQUE\s+|FULLTEXT\s+|SPATIAL\s+)?INDEX|DROP\s+INDEX)\b",
+                          re.IGNORECASE)
+ONLINE_ALGORITHM = re.compile(r"\bALGORITHM\s*=?\s*(INPLACE|INSTANT)\b", re.IGNORECASE)
+ONLINE_LOCK = re.compile(r"\bLOCK\s*=?\s*NONE\b", re.IGNORECASE)
+
+# version -> checksums of earlier versions of the file, still accepted for databases that applied them: the rewrite
+# produces the same schema
+PREVIOUS_CHECKSUMS = {
+    1: {"e92d23c0b67b4fda31c94939fc1b43a174abdd0b6309f848a5dc23a6554e7ab7"},  # before 0001 was made re-runnable
+}
+
+LOCK_WAIT_TIMEOUT_ERRNO = 1205
+LOCK_RETRIES = 3
+
+SCHEMA_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version      INT PRIMARY KEY,
+    name         VARCHAR(255) NOT NULL,
+    checksum     CHAR(64) NOT NULL,
+    applied_at   DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    execution_ms INT NOT NULL
+)
+"""
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path, "rb") as f:
+            raw = f.read()
+        self.checksum = hashlib.sha256(raw).hexdigest()
+        self.sql = raw.decode("utf-8")
+
+    @property
+    def label(self):
+        return f"{self.version:04d}_{self.name}"
+
+    def statements(self):
+        return split_statements(self.sql)
+
+    def matches(self, checksum):
+        """
+        Whether `checksum` (as recorded in schema_version) is this file's, or that of an accepted earlier version.
+        """
+        return checksum == self.checksum or checksum in PREVIOUS_CHECKSUMS.get(self.version, ())
+
+    def check_online(self):
+        """
+        Raise MigrationError for DDL that would lock the table, unless the file is marked offline.
+        """
+        if OFFLINE_MARKER.search(self.sql):
+            return
+        for statement in self.statements():
+            if NEEDS_ONLINE.match(statement) and not (ONLINE_ALGORITHM.search(statement)
+                                                      and ONLINE_LOCK.search(statement)):
+                first_line = statement.splitlines()[0]
+                raise MigrationError(f"{self.label}: '{first_line}' is not online; add ALGORITHM=INPLACE, LOCK=NONE "
+                                     f"or mark the file '-- migrate: offline'")
+
+
+def split_statements(sql):
+    """
+    Split a SQL script into statements: comments (--, #, /* */) are dropped, semicolons inside quotes and
+    backticks are kept, and `DELIMITER xx` lines change the terminator (for procedures and triggers).
+    """
+    statements = []
+    current = []
+    delimiter = ";"
+    i = 0
+    n = len(sql)
+    at_line_start = True
+
+    while i < n:
+        if at_line_start:
+            line_end = sql.find("\n", i)
+            line = sql[i:n if line_end == -1 else line_end]
+            match = re.match(r"\s*DELIMITER\s+(\S+)\s*$", line, re.IGNORECASE)
+            if match:
+                delimiter = match.group(1)
+                i = n if line_end == -1 else line_end + 1
+                continue
+        at_line_start = False
+
+        char = sql[i]
+        if char in "'\"`":
+            # quoted string or identifier, doubled quote or backslash escapes stay inside
+            j = i + 1
+            while j < n:
+                if sql[j] == "\\" and char != "`":
+                    j += 2
+                    continue
+                if sql[j] == char:
+                    if j + 1 < n and sql[j + 1] == char:
+                        j += 2
+                        continue
+                    break
+                j += 1
+            current.append(sql[i:j + 1])
+            i = j + 1
+        elif sql.startswith("--", i) and (i + 2 == n or sql[i + 2].isspace()) or char == "#":
+            line_end = sql.find("\n", i)
+            i = n if line_end == -1 else line_end
+        elif sql.startswith("/*", i) and not sql.startswith("/*!", i):
+            comment_end = sql.find("*/", i + 2)
+            i = n if comment_end == -1 else comment_end + 2
+        elif sql.startswith(delimiter, i):
+            statement = "".join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+            i += len(delimiter)
+        else:
+            current.append(char)
+            if char == "\n":
+                at_line_start = True
+            i += 1
+
+    statement = "".join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+def discover_migrations(directory=MIGRATIONS_DIR):
+    """
+    The migrations in `directory`, sorted by version. Versions must be unique and start at 1.
+    """
+    migrations = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.sql"))):
+        match = MIGRATION_FILE.match(os.path.basename(path))
+        if not match:
+            raise MigrationError(f"{path}: migration files are named NNNN_description.sql")
+        migrations.append(Migration(int(match.group(1)), match.group(2), path))
+
+    versions = [m.version for m in migrations]
+    duplicates = {v for v in versions if versions.count(v) > 1}
+    if duplicates:
+        raise MigrationError(f"duplicate migration versions: {sorted(duplicates)}")
+    if 0 in versions:
+        raise MigrationError("version 0000 is reserved for schema/schema.sql")
+    return migrations
+
+
+class Migrator:
+    def __init__(self, conn, database, lock_wait_timeout=10, dry_run=False):
+        if not DATABASE_NAME.match(database):
+            raise MigrationError(f"invalid database name {database!r} (letters, digits, _ and $ only)")
+        self.conn = conn
+        self.database = database
+        self.lock_wait_timeout = lock_wait_timeout
+        self.dry_run = dry_run
+        self.cursor = conn.cursor()
+
+    def database_exists(self):
+        self.cursor.execute("SELECT 1 FROM information_schema.SCHEMATA WHERE SCHEMA_NAME = %s", (self.database,))
+        return self.cursor.fetchone() is not None
+
+    def applied(self):
+        """
+        version -> (name, checksum) of every recorded migration.
+        """
+        self.cursor.execute("SELECT 1 FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s "
+                            "AND TABLE_NAME = 'schema_version'", (self.database,))
+        if self.cursor.fetchone() is None:
+            return {}
+        self.cursor.execute(f"SELECT version, name, checksum FROM `{self.database}`.schema_version")
+        return {version: (name, checksum) for version, name, checksum in self.cursor.fetchall()}
+
+    def verify(self, migrations, applied):
+        """
+        Raise MigrationError if an applied migration's file changed or disappeared.
+        """
+        by_version = {m.version: m for m in migrations}
+        for version, (name, checksum) in sorted(applied.items()):
+            if version == 0:
+                continue
+            migration = by_version.get(version)
+            if migration is None:
+                raise MigrationError(f"{version:04d}_{name} is recorded as applied but its file is missing")
+            if not migration.matches(checksum):
+                raise MigrationError(f"{migration.label} changed after it was applied "
+                                     f"(checksum {checksum[:12]} -> {migration.checksum[:12]}); add a new migration")
+
+    def execute(self, statement):
+        for attempt in range(1, LOCK_RETRIES + 1):
+            try:
+                self.cursor.execute(statement)
+                if self.cursor.with_rows:
+                    self.cursor.fetchall()
+                self.conn.commit()
+                return
+            except mysql.connector.Error as e:
+                if e.errno != LOCK_WAIT_TIMEOUT_ERRNO or attempt == LOCK_RETRIES:
+                    raise
+                print(f"    metadata lock busy, retrying ({attempt}/{LOCK_RETRIES - 1})")
+                time.sleep(attempt * 2)
+
+    def statements(self, migration):
+        statements = migration.statements()
+        if migration.version == 0 and self.database != BASELINE_DATABASE:
+            # schema.sql names its database (CREATE DATABASE, GRANT, USE): create the configured one instead
+            pattern = re.compile(rf"\b{BASELINE_DATABASE}\b")
+            statements = [pattern.sub(self.database, statement) for statement in statements]
+        return statements
+
+    def apply(self, migration):
+        statements = self.statements(migration)
+        print(f"Applying {migration.label} ({len(statements)} statements)")
+        if self.dry_run:
+            for statement in statements:
+                print(f"    {statement.splitlines()[0]}")
+            return
+
+        started = time.perf_counter()
+        for number, statement in enumerate(statements, start=1):
+            try:
+                self.execute(statement)
+            except mysql.connector.Error as e:
+                raise MigrationError(f"{migration.label}: statement {number} failed: {e}\n{statement}") from e
+        elapsed_ms = int((time.perf_counter() - started) * 1000)
+        self.record(migration, elapsed_ms)
+        print(f"    done in {elapsed_ms / 1000:.1f}s")
+
+    def record(self, migration, elapsed_ms=0):
+        self.cursor.execute(f"USE `{self.database}`")
+        self.cursor.execute(SCHEMA_VERSION_TABLE)
+        self.cursor.execute("INSERT INTO schema_version (version, name, checksum, execution_ms) "
+                            "VALUES (%s, %s, %s, %s)",
+                            (migration.version, migration.name, migration.checksum, elapsed_ms))
+        self.conn.commit()
+
+    def migrate(self, baseline=None):
+        migrations = discover_migrations()
+        self.cursor.execute("SET SESSION lock_wait_timeout = %s", (self.lock_wait_timeout,))
+
+        base = Migration(0, "schema", BASELINE_FILE)
+        if not self.database_exists():
+            self.apply(base)
+            if self.dry_run:
+                # nothing was created, so everything after the baseline is pending
+                for migration in migrations:
+                    self.apply(migration)
+                return
+
+        # migrations use unqualified table names
+        self.cursor.execute(f"USE `{self.database}`")
+        applied = self.applied()
+        if not applied:
+            # a database created before schema_version existed: its tables came from schema.sql
+            if not self.dry_run:
+                self.record(base)
+            applied = {0: (base.name, base.checksum)}
+
+        if baseline is not None:
+            for migration in migrations:
+                if migration.version <= baseline and migration.version not in applied:
+                    print(f"Marking {migration.label} as applied (baseline)")
+                    if not self.dry_run:
+                        self.record(migration)
+                    applied[migration.version] = (migration.name, migration.checksum)
+
+        self.verify(migrations, applied)
+        pending = [m for m in migrations if m.version not in applied]
+        for migration in pending:
+            migration.check_online()
+        if not pending:
+            print("Schema is up to date.")
+        for migration in pending:
+            self.apply(migration)
+
+    def status(self):
+        migrations = discover_migrations()
+        applied = self.applied() if self.database_exists() else {}
+        print(f"{'0000_schema':40} {'applied' if 0 in applied else 'pending'}")
+        for migration in migrations:
+            if migration.version not in applied:
+                state = "pending"
+            elif not migration.matches(applied[migration.version][1]):
+                state = "applied, CHANGED SINCE"
+            else:
+                state = "applied"
+            print(f"{migration.label:40} {state}")
+
+
+def main(argv=None):
+    load_dotenv(os.path.join(os.path.dirname(SCHEMA_DIR), ".env"))
+    parser = argparse.ArgumentParser(description="Apply schema/schema.sql and the numbered schema migrations.")
+    parser.add_argument("--status", action="store_true", help="list applied and pending migrations")
+    parser.add_argument("--dry-run", action="store_true", help="print the statements instead of running them")
+    parser.add_argument("--baseline", type=int, metavar="VERSION",
+                        help="record migrations up to VERSION as applied without running them")
+    parser.add_argument("--lock-wait-timeout", type=int, default=10, metavar="SECONDS",
+                        help="max wait for a table's metadata lock per attempt (default 10)")
+    parser.add_argument("--host", default=os.getenv("DB_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("DB_PORT", "3306")))
+    parser.add_argument("--user", default=os.getenv("DB_ADMIN_USER", "root"),
+                        help="needs CREATE/ALTER/GRANT privileges (default root, or DB_ADMIN_USER)")
+    parser.add_argument("--database", default=os.getenv("DB_NAME", "spotify_db"))
+    args = parser.parse_args(argv)
+
+    password = os.getenv("DB_ADMIN_PASSWORD")
+    if password is None:
+        password = getpass.getpass(f"MySQL password for {args.user}: ")
+
+    if not DATABASE_NAME.match(args.database):
+        parser.error(f"invalid database name {args.database!r} (letters, digits, _ and $ only)")
+
+    conn = mysql.connector.connect(host=args.host, port=args.port, user=args.user, password=password)
+    migrator = Migrator(conn, args.database, lock_wait_timeout=args.lock_wait_timeout, dry_run=args.dry_run)
+    try:
+        if args.status:
+            migrator.status()
+        else:
+            migrator.migrate(baseline=args.baseline)
+    except MigrationError as e:
+        print(f"Migration failed: {e}")
+        return 1
+    finally:
+        migrator.cursor.close()
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
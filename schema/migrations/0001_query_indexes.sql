@@ -0,0 +1,83 @@
+-- 0001: indexes for the queries in app/statements.py (checked by schema/explain_check.py)
+--
+-- Every ALTER is online (ALGORITHM=INPLACE, LOCK=NONE): reads and writes keep going while the index builds.
+-- Indexes made redundant by a wider one with the same prefix are dropped afterwards.
+--
+-- MySQL has no ADD/DROP INDEX IF [NOT] EXISTS, and DDL isn't transactional: each ALTER only runs if the index
+-- isn't there yet (or, for a DROP, still is), so a run that failed partway can simply be rerun (same pattern as 0004).
+
+-- artist_top_tracks: artist -> its tracks without touching the (track_id, artist_id) primary key
+SET @ddl = IF((SELECT COUNT(*) FROM information_schema.STATISTICS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'TrackArtists'
+                 AND INDEX_NAME = 'idx_ta_artist_track') = 0,
+              'ALTER TABLE TrackArtists ADD INDEX idx_ta_artist_track (artist_id, track_id), ALGORITHM=INPLACE, LOCK=NONE',
+              'DO 0');
+PREPARE add_index FROM @ddl;
+EXECUTE add_index;
+DEALLOCATE PREPARE add_index;
+
+-- track_comments: a track's comments already in created_at order (no filesort)
+SET @ddl = IF((SELECT COUNT(*) FROM information_schema.STATISTICS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Comments'
+                 AND INDEX_NAME = 'idx_comments_track_created') = 0,
+              'ALTER TABLE Comments ADD INDEX idx_comments_track_created (track_id, created_at), ALGORITHM=INPLACE, LOCK=NONE',
+              'DO 0');
+PREPARE add_index FROM @ddl;
+EXECUTE add_index;
+DEALLOCATE PREPARE add_index;
+SET @ddl = IF((SELECT COUNT(*) FROM information_schema.STATISTICS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Comments'
+                 AND INDEX_NAME = 'idx_comments_track') > 0,
+              'ALTER TABLE Comments DROP INDEX idx_comments_track, ALGORITHM=INPLACE, LOCK=NONE',
+              'DO 0');
+PREPARE drop_index FROM @ddl;
+EXECUTE drop_index;
+DEALLOCATE PREPARE drop_index;
+
+-- a user's likes in liked_at order (liked songs list)
+SET @ddl = IF((SELECT COUNT(*) FROM information_schema.STATISTICS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'TrackLikes'
+                 AND INDEX_NAME = 'idx_likes_user_liked') = 0,
+              'ALTER TABLE TrackLikes ADD INDEX idx_likes_user_liked (user_id, liked_at), ALGORITHM=INPLACE, LOCK=NONE',
+              'DO 0');
+PREPARE add_index FROM @ddl;
+EXECUTE add_index;
+DEALLOCATE PREPARE add_index;
+
+-- discovery_tracks: genre -> artists, covering
+SET @ddl = IF((SELECT COUNT(*) FROM information_schema.STATISTICS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'ArtistGenres'
+                 AND INDEX_NAME = 'idx_ag_genre_artist') = 0,
+              'ALTER TABLE ArtistGenres ADD INDEX idx_ag_genre_artist (genre_id, artist_id), ALGORITHM=INPLACE, LOCK=NONE',
+              'DO 0');
+PREPARE add_index FROM @ddl;
+EXECUTE add_index;
+DEALLOCATE PREPARE add_index;
+
+-- search_artists: walk artists by popularity reading only the index (name is in it for the LIKE filter)
+SET @ddl = IF((SELECT COUNT(*) FROM information_schema.STATISTICS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Artists'
+                 AND INDEX_NAME = 'idx_artists_popularity_name') = 0,
+              'ALTER TABLE Artists ADD INDEX idx_artists_popularity_name (popularity, name), ALGORITHM=INPLACE, LOCK=NONE',
+              'DO 0');
+PREPARE add_index FROM @ddl;
+EXECUTE add_index;
+DEALLOCATE PREPARE add_index;
+
+-- search_tracks: same for tracks, ordered by popularity with the title in the index
+SET @ddl = IF((SELECT COUNT(*) FROM information_schema.STATISTICS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Tracks'
+                 AND INDEX_NAME = 'idx_tracks_popularity_title') = 0,
+              'ALTER TABLE Tracks ADD INDEX idx_tracks_popularity_title (popularity, title), ALGORITHM=INPLACE, LOCK=NONE',
+              'DO 0');
+PREPARE add_index FROM @ddl;
+EXECUTE add_index;
+DEALLOCATE PREPARE add_index;
+SET @ddl = IF((SELECT COUNT(*) FROM information_schema.STATISTICS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Tracks'
+                 AND INDEX_NAME = 'idx_tracks_popularity') > 0,
+              'ALTER TABLE Tracks DROP INDEX idx_tracks_popularity, ALGORITHM=INPLACE, LOCK=NONE',
+              'DO 0');
+PREPARE drop_index FROM @ddl;
+EXECUTE drop_index;
+DEALLOCATE PREPARE drop_index;
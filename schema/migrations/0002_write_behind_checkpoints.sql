@@ -0,0 +1,10 @@
+-- 0002: commit checkpoints of the app's write-behind journals (app/write_behind.py)
+--
+-- Every flushed batch updates its journal's row in the same transaction, so replaying a journal after a crash
+-- skips exactly the records that were already committed.
+
+CREATE TABLE IF NOT EXISTS WriteBehindCheckpoints (
+    journal_id  VARCHAR(64) PRIMARY KEY,
+    last_seq    BIGINT NOT NULL,
+    updated_at  DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
@@ -0,0 +1,18 @@
+-- 0003: key/value stamps written by the loaders (generate_load_data/db_config.py)
+--
+-- catalog_version is bumped after every Tracks/Artists reload so running apps drop their in-memory catalog cache.
+-- feature_normalization is the feature normalization the stored Tracks follow (app/features.py). It is only
+-- stamped here while Tracks is empty: a catalog loaded before this migration holds the legacy (unstamped)
+-- normalization until load_tracks.py is rerun, and the app warns about that at startup.
+
+CREATE TABLE IF NOT EXISTS CatalogMeta (
+    meta_key    VARCHAR(50) PRIMARY KEY,
+    meta_value  VARCHAR(100) NOT NULL,
+    updated_at  DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+INSERT IGNORE INTO CatalogMeta (meta_key, meta_value) VALUES ('catalog_version', '1');
+
+INSERT IGNORE INTO CatalogMeta (meta_key, meta_value)
+SELECT 'feature_normalization', '2' FROM DUAL
+WHERE NOT EXISTS (SELECT 1 FROM Tracks);
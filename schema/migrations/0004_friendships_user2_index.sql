@@ -0,0 +1,14 @@
+-- 0004: reverse side of the Friendships primary key, so "friends of X" can look X up as user_id2 without a full
+-- scan (friends_page, friends_with_dates, user_friends in app/statements.py)
+--
+-- MySQL has no ADD INDEX IF NOT EXISTS; the ALTER only runs if the index isn't there yet, so the file can be rerun
+-- on a database that already has it.
+
+SET @ddl = IF((SELECT COUNT(*) FROM information_schema.STATISTICS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Friendships'
+                 AND INDEX_NAME = 'idx_friends_user2') = 0,
+              'ALTER TABLE Friendships ADD INDEX idx_friends_user2 (user_id2, user_id1), ALGORITHM=INPLACE, LOCK=NONE',
+              'DO 0');
+PREPARE add_index FROM @ddl;
+EXECUTE add_index;
+DEALLOCATE PREPARE add_index;
@@ -0,0 +1,140 @@
+"""
+A tiny in-memory stand-in for MySQL, for tests of how connections see each other's writes.
+
+Only the statements the tests need are implemented. Transactions behave like InnoDB's REPEATABLE READ: the first
+statement of a transaction takes a snapshot, later reads in it see only the snapshot (plus the transaction's own
+writes), and its writes reach the database at commit. An autocommit connection outside START TRANSACTION reads and
+writes the live data.
+"""
+import copy
+import json
+
+from app.statements import STATEMENTS
+
+CATALOG_META_SELECT = "SELECT meta_value FROM CatalogMeta WHERE meta_key = %s"
+
+
+def _user_liked_track(state, params):
+    return [{"liked": 1}] if tuple(params) in state["likes"] else []
+
+
+def _insert_likes(state, params):
+    state["likes"].update((row[0], row[1]) for row in json.loads(params[0]))
+    return []
+
+
+def _delete_likes(state, params):
+    state["likes"].difference_update((row[0], row[1]) for row in json.loads(params[0]))
+    return []
+
+
+def _checkpoint(state, params):
+    seq = state["checkpoints"].get(params[0])
+    return [] if seq is None else [{"last_seq": seq}]
+
+
+def _save_checkpoint(state, params):
+    state["checkpoints"][params[0]] = params[1]
+    return []
+
+
+def _delete_checkpoint(state, params):
+    state["checkpoints"].pop(params[0], None)
+    return []
+
+
+def _catalog_meta(state, params):
+    value = state["meta"].get(params[0])
+    return [] if value is None else [{"meta_value": value}]
+
+
+HANDLERS = {
+    STATEMENTS["user_liked_track"]: _user_liked_track,
+    STATEMENTS["batch_insert_likes"]: _insert_likes,
+    STATEMENTS["batch_delete_likes"]: _delete_likes,
+    STATEMENTS["write_behind_checkpoint"]: _checkpoint,
+    STATEMENTS["save_write_behind_checkpoint"]: _save_checkpoint,
+    STATEMENTS["delete_write_behind_checkpoint"]: _delete_checkpoint,
+    CATALOG_META_SELECT: _catalog_meta,
+}
+
+
+class FakeDatabase:
+
+    def __init__(self):
+        self.state = {"likes": set(), "meta": {}, "checkpoints": {}}
+
+    def connect(self, autocommit=False, **kwargs):
+        """Drop-in for mysql.connector.connect."""
+        return FakeConnection(self, autocommit)
+
+    def execute(self, sql, params):
+        """Runs a statement on the live data, as another (autocommit) client would."""
+        return HANDLERS[sql](self.state, params)
+
+
+class FakeConnection:
+
+    def __init__(self, db, autocommit):
+        self.db = db
+        self.autocommit = autocommit
+        self._snapshot = None
+        self._statements = []
+
+    @property
+    def in_transaction(self):
+        return self._snapshot is not None
+
+    def start_transaction(self):
+        self._snapshot = copy.deepcopy(self.db.state)
+        self._statements = []
+
+    def commit(self):
+        if self._snapshot is not None:
+            for handler, params in self._statements:
+                handler(self.db.state, params)
+        self._snapshot = None
+
+    def rollback(self):
+        self._snapshot = None
+
+    def execute(self, sql, params):
+        handler = HANDLERS[sql]
+        if self._snapshot is None:
+            if self.autocommit:
+                return handler(self.db.state, params)
+            self.start_transaction()
+        self._statements.append((handler, params))
+        return handler(self._snapshot, params)
+
+    def cursor(self, prepared=False, dictionary=False):
+        return FakeCursor(self, dictionary)
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class FakeCursor:
+
+    def __init__(self, conn, dictionary):
+        self.conn = conn
+        self.dictionary = dictionary
+        self.lastrowid = None
+        self._rows = []
+
+    def execute(self, sql, params=()):
+        rows = self.conn.execute(sql, params)
+        self._rows = rows if self.dictionary else [tuple(row.values()) for row in rows]
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def close(self):
+        pass
@@ -0,0 +1,34 @@
+import pytest
+
+from app.cache import CATALOG_VERSION_KEY, CatalogCache
+from fakedb import FakeDatabase
+
+
+@pytest.mark.parametrize("autocommit", [True, False])
+def test_a_version_bump_clears_the_cache(autocommit):
+    db = FakeDatabase()
+    db.state["meta"][CATALOG_VERSION_KEY] = "1"
+    conn = db.connect(autocommit=autocommit)
+    cache = CatalogCache(check_interval=0)
+
+    cache.check_version(conn)
+    cache.put(("track", "t"), {"title": "T"})
+    cache.check_version(conn)
+    assert cache.version == "1" and cache.get(("track", "t")) == {"title": "T"}
+
+    # the loaders bump the stamp on another connection
+    db.state["meta"][CATALOG_VERSION_KEY] = "2"
+    cache.check_version(conn)
+    assert cache.version == "2"
+    assert cache.get(("track", "t")) is None
+
+
+def test_the_version_check_is_rate_limited():
+    db = FakeDatabase()
+    db.state["meta"][CATALOG_VERSION_KEY] = "1"
+    cache = CatalogCache(check_interval=0)
+    cache.check_version(db.connect(autocommit=True))
+    cache.check_interval = 3600
+    db.state["meta"][CATALOG_VERSION_KEY] = "2"
+    cache.check_version(db.connect(autocommit=True))
+    assert cache.version == "1"
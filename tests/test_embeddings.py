@@ -0,0 +1,57 @@
+import numpy as np
+
+from app.embeddings import LazyUserEmbeddings, UserEmbeddings
+from app.features import FEATURE_COLUMNS
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def vector(value):
+    return np.full(len(FEATURE_COLUMNS), value)
+
+
+def test_likes_made_during_a_rebuild_survive_the_swap(tmp_path, monkeypatch):
+    connections = []
+
+    def connect():
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    lazy = LazyUserEmbeddings(str(tmp_path), connect=connect)
+
+    def from_db(conn=None, batch_size=100000):
+        # the grouped query has read user 3's one like; a second one arrives before the new matrix is swapped in
+        embeddings = UserEmbeddings.empty(4)
+        embeddings.update(3, vector(0.5))
+        lazy.update(3, vector(0.25))
+        return embeddings
+
+    monkeypatch.setattr(UserEmbeddings, "from_db", staticmethod(from_db))
+    lazy.refresh()
+
+    embeddings = lazy.get()
+    assert embeddings.counts[3] == 2
+    np.testing.assert_allclose(embeddings.profile(3), vector(0.375))
+
+    # built on a connection of its own, closed afterwards
+    assert len(connections) == 1 and connections[0].closed
+
+    # the log ends with the refresh
+    lazy.update(3, vector(0.25), sign=-1)
+    assert lazy.get().counts[3] == 1
+
+
+def test_a_refresh_that_loads_nothing_new_does_not_replay_updates(tmp_path):
+    UserEmbeddings.empty(4).save(str(tmp_path))
+    lazy = LazyUserEmbeddings(str(tmp_path))
+    lazy.get()
+    lazy.update(1, vector(0.5))
+
+    lazy.refresh()  # the snapshot is fresh: nothing is rebuilt or swapped
+    assert lazy.get().counts[1] == 1
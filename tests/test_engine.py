@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from app.engine import SharedArray, _run_chunk, add, column_stats, map_reduce, merge_column_stats
+
+
+def row_sums(arrays, start, end):
+    # module-level so the process pool can pickle it
+    return arrays["x"][start:end].sum(axis=0)
+
+
+def stats(matrix, workers, chunk_rows=7):
+    edges = np.linspace(0.0, 1.0, 5)
+    return map_reduce(column_stats, {"matrix": matrix}, chunk_rows=chunk_rows, reduce=merge_column_stats,
+                      args=(edges,), workers=workers)
+
+
+@pytest.mark.parametrize("n_rows", [2, 7, 50])
+def test_pool_matches_inline(n_rows):
+    rng = np.random.default_rng(n_rows)
+    matrix = rng.random((n_rows, 3))
+    matrix[0, 1] = np.nan
+    inline, pooled = stats(matrix, workers=1), stats(matrix, workers=2)
+    for key in inline:
+        assert np.allclose(inline[key], pooled[key]), key
+    assert inline["count"].tolist() == [n_rows, n_rows - 1, n_rows]
+    assert np.allclose(inline["sum"], np.nansum(matrix, axis=0))
+    assert np.allclose(inline["min"], np.nanmin(matrix, axis=0))
+
+
+def test_zero_rows_gives_empty_stats_not_none():
+    empty = stats(np.zeros((0, 3)), workers=2)
+    assert empty["count"].tolist() == [0, 0, 0]
+    assert empty["histogram"].shape == (3, 4)
+    assert np.all(np.isinf(empty["min"]))
+
+
+def test_partials_without_reducer_are_in_chunk_order():
+    x = np.arange(20).reshape(10, 2)
+    partials = map_reduce(row_sums, {"x": x}, chunk_rows=3, workers=2)
+    assert [p.tolist() for p in partials] == [x[i:i + 3].sum(axis=0).tolist() for i in range(0, 10, 3)]
+    assert map_reduce(row_sums, {"x": x[:0]}, chunk_rows=3, workers=2) == []
+
+
+def test_initial_accumulator():
+    x = np.ones((10, 2))
+    assert map_reduce(row_sums, {"x": x}, chunk_rows=4, reduce=add, initial=np.zeros(2), workers=1).tolist() \
+        == [10.0, 10.0]
+    assert map_reduce(row_sums, {"x": x[:0]}, reduce=add, initial=np.zeros(2), workers=1).tolist() == [0.0, 0.0]
+
+
+def test_reads_npy_paths(tmp_path):
+    x = np.arange(30, dtype=np.float64).reshape(15, 2)
+    path = str(tmp_path / "x.npy")
+    np.save(path, x)
+    assert map_reduce(row_sums, {"x": path}, chunk_rows=4, reduce=add, workers=2).tolist() \
+        == x.sum(axis=0).tolist()
+
+
+def test_workers_close_their_shared_memory_handles(monkeypatch):
+    closed = []
+    close = SharedArray.close
+    monkeypatch.setattr(SharedArray, "close", lambda self: (closed.append(self.owner), close(self)))
+
+    x = np.arange(12.0).reshape(6, 2)
+    shared = SharedArray.create(x)
+    try:
+        # what a pool worker runs for one chunk
+        assert np.allclose(_run_chunk((row_sums, {"x": shared.spec}, 0, 6, ())), x.sum(axis=0))
+        assert closed == [False]
+    finally:
+        shared.close()
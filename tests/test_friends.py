@@ -0,0 +1,62 @@
+import random
+
+import numpy as np
+
+from app.friends import FriendGraph
+
+
+def brute_force_friends_of_friends(edges, user_id):
+    friends = {v for u, v in edges if u == user_id} | {u for u, v in edges if v == user_id}
+    counts = {}
+    for friend in friends:
+        for u, v in edges:
+            for a, b in ((u, v), (v, u)):
+                if a == friend and b != user_id and b not in friends:
+                    counts[b] = counts.get(b, 0) + 1
+    return counts
+
+
+def as_dict(candidates, counts):
+    return dict(zip(candidates.tolist(), counts.tolist()))
+
+
+def test_friends_of_friends_counts_mutual_friends():
+    graph = FriendGraph.from_edges([1, 1, 2, 3, 3], [2, 3, 4, 4, 5])
+    assert as_dict(*graph.friends_of_friends(1)) == {4: 2, 5: 1}
+    assert as_dict(*graph.friends_of_friends(6)) == {}
+
+
+def test_friends_of_friends_with_overlay_matches_brute_force():
+    rng = random.Random(7)
+    edges = set()
+    while len(edges) < 120:
+        u, v = rng.sample(range(40), 2)
+        edges.add((min(u, v), max(u, v)))
+    u1, u2 = zip(*sorted(edges))
+    graph = FriendGraph.from_edges(u1, u2)
+
+    # toggles made after the build, including users the CSR has never seen
+    for _ in range(60):
+        u, v = rng.sample(range(45), 2)
+        pair = (min(u, v), max(u, v))
+        if pair in edges:
+            edges.discard(pair)
+            graph.remove_edge(*pair)
+        else:
+            edges.add(pair)
+            graph.add_edge(*pair)
+
+    for user_id in range(46):
+        expected = brute_force_friends_of_friends(edges, user_id)
+        assert as_dict(*graph.friends_of_friends(user_id)) == expected, user_id
+        friends = sorted({v for u, v in edges if u == user_id} | {u for u, v in edges if v == user_id})
+        assert graph.neighbors(user_id).tolist() == friends
+
+
+def test_removing_and_re_adding_an_edge_restores_it():
+    graph = FriendGraph.from_edges([1], [2])
+    graph.remove_edge(1, 2)
+    assert graph.neighbors(1).tolist() == []
+    graph.add_edge(2, 1)
+    assert graph.neighbors(1).tolist() == [2]
+    assert np.array_equal(graph.neighbors(2), [1])
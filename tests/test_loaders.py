@@ -0,0 +1,70 @@
+import json
+
+import numpy as np
+import pytest
+from flask import Flask
+
+from app import loaders
+from app.loaders import LOADERS, DataLoader
+
+
+class PendingFriendships:
+    # the write-behind overlay: (1, 3) was just unfriended
+    def are_friends(self, user_id1, user_id2):
+        return False if (user_id1, user_id2) == (1, 3) else None
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    calls = []
+    friendships = {(1, 2), (1, 3), (2, 5)}
+
+    def run(name, params=(), fetch="all", conn=None):
+        calls.append(name)
+        if name == "friends_with_dates_for_users":
+            ids = json.loads(params[0])
+            rows = []
+            for u1, u2 in sorted(friendships):
+                for owner, friend in ((u1, u2), (u2, u1)):
+                    if owner in ids:
+                        rows.append({"owner_id": owner, "user_id": friend, "username": f"u{friend}",
+                                     "date_befriended": "2024-01-01"})
+            return rows
+        if name == "friendships_for_pairs":
+            return [{"user_id1": a, "user_id2": b} for a, b in json.loads(params[0]) if (a, b) in friendships]
+        raise AssertionError(name)
+
+    monkeypatch.setattr(loaders, "run", run)
+    app = Flask(__name__)
+    app.write_behind = PendingFriendships()
+    with app.app_context():
+        yield calls
+
+
+def test_friends_are_loaded_in_one_query(queries):
+    friends = DataLoader(**LOADERS["friends"])
+    result = friends.load_many([1, "2", 9])
+    assert queries == ["friends_with_dates_for_users"]
+    assert [f["user_id"] for f in result[0]] == [2, 3]
+    assert [f["user_id"] for f in result[1]] == [1, 5]
+    assert result[2] == []
+    assert "owner_id" not in result[0][0]
+
+
+def test_friendships_are_loaded_in_one_query_and_pending_toggles_win(queries):
+    friendship = DataLoader(**LOADERS["friendship"])
+    assert friendship.load_many([(2, 1), (1, 3), (5, 2), (4, 1)]) == [True, False, True, False]
+    assert queries == ["friendships_for_pairs"]
+
+
+def test_missing_keys_get_their_own_copy_of_the_default():
+    profiles = DataLoader(lambda keys: {}, default=np.zeros(3))
+    first, second = profiles.load_many([1, 2])
+    first += 1
+    assert second.tolist() == [0.0, 0.0, 0.0]
+    assert LOADERS["taste_profile"]["default"].tolist() == [0.0] * len(LOADERS["taste_profile"]["default"])
+
+    lists = DataLoader(lambda keys: {}, default=[])
+    a, b = lists.load_many(["a", "b"])
+    a.append("x")
+    assert b == [] and lists.default == []
@@ -0,0 +1,107 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+from app.metrics import Registry, merge_process_files, render
+
+
+def family(name, kind, *samples):
+    return {"name": name, "kind": kind, "help": name, "samples": [list(s) for s in samples]}
+
+
+def write(directory, pid, families):
+    with open(os.path.join(directory, f"{pid}.json"), "w") as f:
+        json.dump(families, f)
+
+
+@pytest.fixture
+def dead_pid():
+    # a child that has exited and been reaped
+    child = subprocess.Popen(["true"])
+    child.wait()
+    return child.pid
+
+
+def samples(families, name):
+    for f in families:
+        if f["name"] == name:
+            return {tuple(sorted(labels.items())): value for _, labels, value in f["samples"]}
+    return {}
+
+
+def test_counters_are_summed_over_live_and_dead_processes(tmp_path, dead_pid):
+    live = os.getpid()
+    write(tmp_path, live, [family("requests_total", "counter", ["requests_total", {"endpoint": "a"}, 3])])
+    write(tmp_path, dead_pid, [family("requests_total", "counter", ["requests_total", {"endpoint": "a"}, 4],
+                                      ["requests_total", {"endpoint": "b"}, 1])])
+
+    merged = merge_process_files(str(tmp_path))
+    assert samples(merged, "requests_total") == {(("endpoint", "a"),): 7, (("endpoint", "b"),): 1}
+
+
+def test_gauges_of_live_processes_get_a_pid_label(tmp_path, dead_pid):
+    live = os.getpid()
+    write(tmp_path, live, [family("cache_bytes", "gauge", ["cache_bytes", {}, 10])])
+    write(tmp_path, dead_pid, [family("cache_bytes", "gauge", ["cache_bytes", {}, 99])])
+
+    merged = merge_process_files(str(tmp_path))
+    assert samples(merged, "cache_bytes") == {(("pid", str(live)),): 10}
+
+
+def test_histogram_buckets_are_summed(tmp_path, dead_pid):
+    def histogram(count):
+        return [family("latency_seconds", "histogram",
+                       ["latency_seconds_bucket", {"le": "0.1"}, count],
+                       ["latency_seconds_bucket", {"le": "+Inf"}, count],
+                       ["latency_seconds_sum", {}, 0.05 * count],
+                       ["latency_seconds_count", {}, count])]
+    write(tmp_path, os.getpid(), histogram(2))
+    write(tmp_path, dead_pid, histogram(3))
+
+    text = render(merge_process_files(str(tmp_path)))
+    assert 'latency_seconds_bucket{le="+Inf"} 5' in text
+    assert "latency_seconds_count 5" in text
+
+
+def test_exited_processes_are_folded_into_the_aggregate(tmp_path, dead_pid):
+    write(tmp_path, os.getpid(), [family("requests_total", "counter", ["requests_total", {}, 1])])
+    write(tmp_path, dead_pid, [family("requests_total", "counter", ["requests_total", {}, 4]),
+                               family("cache_bytes", "gauge", ["cache_bytes", {}, 99])])
+
+    assert samples(merge_process_files(str(tmp_path)), "requests_total") == {(): 5}
+    assert not (tmp_path / f"{dead_pid}.json").exists()
+    assert (tmp_path / "aggregate.json").exists()
+    # the totals stay the same on the next scrape, the dead worker isn't counted twice
+    merged = merge_process_files(str(tmp_path))
+    assert samples(merged, "requests_total") == {(): 5}
+    assert samples(merged, "cache_bytes") == {}
+
+
+def test_a_crash_after_writing_the_aggregate_does_not_count_twice(tmp_path, dead_pid):
+    write(tmp_path, dead_pid, [family("requests_total", "counter", ["requests_total", {}, 4])])
+    # as left by a merge that wrote the aggregate but died before deleting the file it folded
+    (tmp_path / "aggregate.json").write_text(json.dumps({
+        "families": [family("requests_total", "counter", ["requests_total", {}, 4])],
+        "folded": [f"{dead_pid}.json"]}))
+
+    assert samples(merge_process_files(str(tmp_path)), "requests_total") == {(): 4}
+    assert not (tmp_path / f"{dead_pid}.json").exists()
+
+
+def test_reset_drops_counters_but_keeps_callbacks():
+    registry = Registry()
+    counter = registry.counter("events_total", "events")
+    registry.callback("size", "size", "gauge", lambda: 3)
+    counter.inc()
+    registry.reset()
+    assert {f["name"]: f["samples"] for f in registry.families()} == {"events_total": [], "size": [["size", {}, 3]]}
+    counter.inc()
+    assert registry.families()[0]["samples"] == [["events_total", {}, 1.0]]
+
+
+def test_unreadable_files_are_skipped(tmp_path):
+    write(tmp_path, os.getpid(), [family("requests_total", "counter", ["requests_total", {}, 1])])
+    (tmp_path / "12345.json").write_text('[{"name": "torn')
+    assert samples(merge_process_files(str(tmp_path)), "requests_total") == {(): 1}
@@ -0,0 +1,78 @@
+import os
+
+from schema.migrate import MIGRATIONS_DIR, PREVIOUS_CHECKSUMS, Migration, split_statements
+
+
+def test_splits_on_semicolons():
+    assert split_statements("CREATE TABLE a (id INT);\nCREATE TABLE b (id INT);") == [
+        "CREATE TABLE a (id INT)", "CREATE TABLE b (id INT)"]
+
+
+def test_keeps_semicolons_inside_quotes_and_backticks():
+    sql = "INSERT INTO t VALUES ('a;b', \"c;d\");\nSELECT `odd;name` FROM t;"
+    assert split_statements(sql) == ["INSERT INTO t VALUES ('a;b', \"c;d\")", "SELECT `odd;name` FROM t"]
+
+
+def test_escaped_and_doubled_quotes_stay_inside_the_string():
+    sql = "SELECT 'it''s;', 'back\\';slash';\nSELECT 1;"
+    assert split_statements(sql) == ["SELECT 'it''s;', 'back\\';slash'", "SELECT 1"]
+
+
+def test_drops_comments():
+    sql = """
+    -- a line comment; with a semicolon
+    # another one;
+    /* a block
+       comment; */
+    SELECT 1; -- trailing
+    SELECT 2;
+    """
+    assert split_statements(sql) == ["SELECT 1", "SELECT 2"]
+
+
+def test_double_dash_needs_a_space_to_be_a_comment():
+    assert split_statements("SELECT 1--1;") == ["SELECT 1--1"]
+
+
+def test_keeps_executable_comments():
+    assert split_statements("/*!40101 SET NAMES utf8 */;") == ["/*!40101 SET NAMES utf8 */"]
+
+
+def test_delimiter_changes_the_terminator():
+    sql = """
+    DELIMITER //
+    CREATE TRIGGER t BEFORE INSERT ON a FOR EACH ROW
+    BEGIN
+        SET NEW.x = 1;
+        SET NEW.y = 2;
+    END//
+    DELIMITER ;
+    SELECT 1;
+    """
+    statements = split_statements(sql)
+    assert len(statements) == 2
+    assert statements[0].startswith("CREATE TRIGGER t") and statements[0].endswith("END")
+    assert "SET NEW.x = 1;" in statements[0]
+    assert statements[1] == "SELECT 1"
+
+
+def test_last_statement_without_terminator():
+    assert split_statements("SELECT 1;\nSELECT 2") == ["SELECT 1", "SELECT 2"]
+
+
+def test_query_indexes_migration_is_online_and_guarded():
+    migration = Migration(1, "query_indexes", os.path.join(MIGRATIONS_DIR, "0001_query_indexes.sql"))
+    migration.check_online()
+    ddl = [s for s in migration.statements() if s.startswith("SET @ddl")]
+    assert len(ddl) == 8
+    # every ALTER is behind an information_schema check, so a rerun after a partial failure skips what's done
+    assert not [s for s in migration.statements() if s.upper().startswith("ALTER")]
+    assert all("information_schema.STATISTICS" in s and "ALGORITHM=INPLACE, LOCK=NONE" in s for s in ddl)
+
+
+def test_rewritten_migration_still_matches_its_recorded_checksum():
+    migration = Migration(1, "query_indexes", os.path.join(MIGRATIONS_DIR, "0001_query_indexes.sql"))
+    for checksum in PREVIOUS_CHECKSUMS[1]:
+        assert migration.matches(checksum)
+    assert migration.matches(migration.checksum)
+    assert not migration.matches("0" * 64)
@@ -0,0 +1,42 @@
+import pytest
+from werkzeug.exceptions import BadRequest
+
+from app.routes import decode_cursor, encode_cursor, friend_cursor, liked_song_cursor, paginate
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor("2024-01-01 00:00:11", "4uLU6hMCjMI75M1A2tKUQC")
+    assert "=" not in cursor
+    assert decode_cursor(cursor, 2) == ["2024-01-01 00:00:11", "4uLU6hMCjMI75M1A2tKUQC"]
+
+
+@pytest.mark.parametrize("cursor", ["zz", "!!!", encode_cursor("a"), encode_cursor("a", "b", "c")])
+def test_bad_cursors_are_rejected(cursor):
+    with pytest.raises(BadRequest):
+        decode_cursor(cursor, 2)
+
+
+def test_non_list_cursor_is_rejected():
+    import base64
+    cursor = base64.urlsafe_b64encode(b'{"a": 1}').decode("ascii")
+    with pytest.raises(BadRequest):
+        decode_cursor(cursor, 1)
+
+
+def test_paginate_last_page_has_no_cursor():
+    rows = [{"user_id": i} for i in range(3)]
+    assert paginate(rows, 3, friend_cursor) == (rows, None)
+    assert paginate([], 3, friend_cursor) == ([], None)
+
+
+def test_paginate_cursor_points_after_the_last_row_of_the_page():
+    # the query fetches page_size + 1 rows to know whether there is a next page
+    rows = [{"user_id": i} for i in range(1, 5)]
+    page, cursor = paginate(rows, 3, friend_cursor)
+    assert page == rows[:3]
+    assert decode_cursor(cursor, 1) == [3]
+
+
+def test_liked_song_cursor_holds_the_sort_key():
+    row = {"liked_at": "2024-01-01 00:00:11", "track_id": "t11"}
+    assert decode_cursor(liked_song_cursor(row), 2) == ["2024-01-01 00:00:11", "t11"]
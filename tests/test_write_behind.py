@@ -0,0 +1,150 @@
+import json
+import os
+
+import pytest
+
+from app import write_behind
+from app.write_behind import JOURNAL_SUFFIX, WriteBehindQueue, coalesce, read_journal, try_lock
+
+
+def record(seq, op, *args):
+    return {"seq": seq, "op": op, "args": list(args)}
+
+
+def test_coalesce_last_toggle_wins():
+    batches = coalesce([
+        record(1, "like", 1, "a", "2024-01-01 00:00:00"),
+        record(2, "unlike", 1, "a", "2024-01-01 00:00:01"),
+        record(3, "like", 1, "b", "2024-01-01 00:00:02"),
+        record(4, "friend", 1, 2, "2024-01-01"),
+        record(5, "unfriend", 1, 2, "2024-01-01"),
+        record(6, "friend", 1, 2, "2024-01-01"),
+    ])
+    assert batches == {
+        "batch_insert_likes": [[1, "b", "2024-01-01 00:00:02"]],
+        "batch_delete_likes": [[1, "a", "2024-01-01 00:00:01"]],
+        "batch_insert_friendships": [[1, 2, "2024-01-01"]],
+    }
+
+
+def test_coalesce_keeps_every_comment_in_order():
+    batches = coalesce([
+        record(1, "comment", 1, "a", "first", "2024-01-01 00:00:00"),
+        record(2, "comment", 1, "a", "first", "2024-01-01 00:00:00"),
+        record(3, "comment", 2, "a", "second", "2024-01-01 00:00:01"),
+    ])
+    assert [row[2] for row in batches["batch_insert_comments"]] == ["first", "first", "second"]
+
+
+def write_journal(path, records, torn=None):
+    with open(path, "w", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps(r) + "\n")
+        if torn:
+            f.write(torn)
+
+
+def test_read_journal_skips_a_torn_last_line(tmp_path):
+    path = tmp_path / ("j" + JOURNAL_SUFFIX)
+    write_journal(path, [record(1, "like", 1, "a", "t")], torn='{"seq": 2, "op": "li')
+    assert [r["seq"] for r in read_journal(path)] == [1]
+
+
+class FakeConnection:
+    in_transaction = False
+
+    def __init__(self):
+        self.commits = 0
+
+    def start_transaction(self):
+        pass
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def replay(monkeypatch):
+    # statements run by recover(), with the checkpoint of every journal at seq 2
+    calls = []
+
+    def run(name, params=(), fetch="all", conn=None):
+        calls.append((name, params))
+        if name == "write_behind_checkpoint":
+            return {"last_seq": 2}
+        return None if fetch in ("one", "none") else []
+
+    monkeypatch.setattr(write_behind, "run", run)
+    return calls
+
+
+def test_recover_replays_only_records_after_the_checkpoint(tmp_path, replay):
+    path = tmp_path / ("dead" + JOURNAL_SUFFIX)
+    write_journal(path, [record(1, "like", 1, "a", "t1"),
+                         record(2, "like", 1, "b", "t2"),
+                         record(3, "like", 1, "c", "t3"),
+                         record(4, "unlike", 1, "a", "t4")])
+    conn = FakeConnection()
+    WriteBehindQueue(str(tmp_path), connect=None).recover(conn)
+
+    batches = {name: json.loads(params[0]) for name, params in replay if name.startswith("batch_")}
+    assert batches == {"batch_insert_likes": [[1, "c", "t3"]], "batch_delete_likes": [[1, "a", "t4"]]}
+    assert ("save_write_behind_checkpoint", ("dead", 4)) in replay
+    assert ("delete_write_behind_checkpoint", ("dead",)) in replay
+    assert not path.exists()
+    assert conn.commits == 2
+
+
+def test_recover_removes_a_fully_checkpointed_journal_without_writing(tmp_path, replay):
+    path = tmp_path / ("done" + JOURNAL_SUFFIX)
+    write_journal(path, [record(1, "like", 1, "a", "t1"), record(2, "like", 1, "b", "t2")])
+    WriteBehindQueue(str(tmp_path), connect=None).recover(FakeConnection())
+
+    assert not [name for name, _ in replay if name.startswith("batch_")]
+    assert not path.exists()
+
+
+def test_recover_leaves_journals_of_live_processes(tmp_path, replay):
+    path = tmp_path / ("live" + JOURNAL_SUFFIX)
+    write_journal(path, [record(3, "like", 1, "a", "t1")])
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        assert try_lock(fd)
+        WriteBehindQueue(str(tmp_path), connect=None).recover(FakeConnection())
+    finally:
+        os.close(fd)
+
+    assert replay == []
+    assert path.exists()
+
+
+def test_a_flushed_like_stays_visible_on_the_request_connection(tmp_path, monkeypatch):
+    import mysql.connector
+    from flask import Flask
+
+    from app import connect_db
+    from app.routes import has_liked
+    from fakedb import FakeDatabase
+
+    db = FakeDatabase()
+    monkeypatch.setattr(mysql.connector, "connect", db.connect)
+    config = {"DB_HOST": "localhost", "DB_PORT": 3306, "DB_USER": "u", "DB_PASSWORD": "p", "DB_NAME": "spotify_db"}
+    app = Flask(__name__)
+    app.db = connect_db(config)
+    app.write_behind = WriteBehindQueue(str(tmp_path), connect=lambda: connect_db(config), flush_interval=60)
+
+    with app.app_context():
+        assert not has_liked(1, "t")  # the request connection has read before the like
+        app.write_behind.like(1, "t")
+        assert has_liked(1, "t")  # from the overlay
+        app.write_behind.flush()
+        assert app.write_behind.liked(1, "t") is None
+        assert has_liked(1, "t")  # from the database, committed on the flusher's connection
+
+        app.write_behind.unlike(1, "t")
+        app.write_behind.flush()
+        assert not has_liked(1, "t")
+    assert db.state["likes"] == set()